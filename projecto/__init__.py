@@ -5,6 +5,7 @@ from flask import Flask, render_template, redirect, url_for
 from flask.ext.login import current_user
 
 from .blueprints import blueprints
+from .compression import CompressionMiddleware
 from .extensions import login_manager, build_partials, build_js_files, build_css_files
 from .apiv1.files.models import File
 from settings import APP_FOLDER, STATIC_FOLDER, TEMPLATES_FOLDER, API, LOADED_MODULES
@@ -12,6 +13,13 @@ from settings import APP_FOLDER, STATIC_FOLDER, TEMPLATES_FOLDER, API, LOADED_MO
 app = Flask(__name__, static_folder=STATIC_FOLDER, template_folder=TEMPLATES_FOLDER)
 app.config.from_pyfile(os.path.join(APP_FOLDER, "settings.py"))
 
+if app.config["COMPRESSION_LEVEL"]:
+  app.wsgi_app = CompressionMiddleware(app.wsgi_app,
+                                       level=app.config["COMPRESSION_LEVEL"],
+                                       min_size=app.config["COMPRESSION_MIN_SIZE"],
+                                       max_buffer=app.config["COMPRESSION_MAX_BUFFER"],
+                                       static_prefix=app.static_url_path + "/")
+
 # Login management
 login_manager.setup_app(app)
 
@@ -5,6 +5,7 @@ from flask.ext.login import current_user
 from kvkit import NotFoundError
 
 from ..hacks import Blueprint
+from ...changes import record
 from ...models import Comment
 from ...utils import ensure_good_request, project_access_required, jsonify
 
@@ -25,7 +26,8 @@ def post(project, parent_id):
   comment.author = current_user._get_current_object()
   comment.parent = parent_id
   comment.save()
-  return jsonify(**comment.serialize(restricted=("title", "parent", "author"), include_key=True))
+  record(project.key, "comment", comment.key, "save", parent=parent_id)
+  return jsonify(**comment.serializer(("title", "parent", "author"), include_key=True)(comment))
 
 
 @blueprint.route("/<comment_id>", methods=["DELETE"])
@@ -43,6 +45,7 @@ def delete(project, parent_id, comment_id):
     # however this is not possible right now as we don't know what the parent is.
     if current_user.key == comment.author.key or current_user.key in project.owners:
       comment.delete()
+      record(project.key, "comment", comment.key, "delete", parent=parent_id)
       return jsonify(status="okay")
     else:
       return abort(403)
@@ -5,8 +5,10 @@ from flask.ext.login import current_user
 from kvkit import NotFoundError
 
 from ..hacks import Blueprint
-from .models import FeedItem
-from ...utils import ensure_good_request, project_access_required, jsonify
+from .models import FeedItem, ArchivedFeedItem
+from ...changes import conditional, record
+from ...models import FAST_READ, INDEX_BATCH_SIZE, archive_many
+from ...utils import ensure_good_request, project_access_required, jsonify, requested_fields, select_fields
 
 
 blueprint = Blueprint("api_v1_feed", __name__,
@@ -27,39 +29,63 @@ def post(project):
   feeditem.author = current_user._get_current_object()
   feeditem.parent = project
   feeditem.save()
-  return jsonify(**feeditem.serialize(restricted=("title", "parent", "author"), include_key=True))
+  record(project.key, "feeditem", feeditem.key, "save")
+  return jsonify(**feeditem.serializer(("title", "parent", "author"), include_key=True)(feeditem))
+
+
+def _archive(keys):
+  # Failures are fine here, they are archived on a later request.
+  feeditems, _ = FeedItem.get_many(keys)
+  archive_many([feeditem for feeditem in feeditems if feeditem is not None], ArchivedFeedItem)
+
+
+def latest(project, fields, amount, ttype=None):
+  """The newest amount feed items of project (only those of type ttype, if
+  given) as projections of fields (None for all of them), newest first. Only the newest 200 are
+  kept in the feed, the others are archived."""
+  feeditems = []
+  overflow = []
+
+  fields = FeedItem.projected_fields(fields, needed=("date", "type"))
+  for feeditem in FeedItem.index_projected("parent", project.key, fields=fields, **FAST_READ):
+    if ttype is not None and feeditem.type != ttype:
+      continue
+
+    if len(feeditems) >= 200:
+      overflow.append(feeditem.key)
+      if len(overflow) >= INDEX_BATCH_SIZE:
+        _archive(overflow)
+        overflow = []
+      continue
+
+    feeditems.append(feeditem)
+
+  _archive(overflow)
+
+  feeditems.sort(key=lambda feeditem: feeditem.date, reverse=True)
+  return feeditems[:amount]
 
 
 @blueprint.route("/", methods=["GET"])
 @project_access_required
+@conditional
 def index(project):
   try:
     amount = min(int(request.args.get("amount", 20)), 200)
   except (TypeError, ValueError):
     return abort(400)
-  ttype = request.args.get("type")
-  feed = []
-
-  i = 0
-  for feeditem in FeedItem.index("parent", project.key):
-    if ttype is not None and feeditem.type != ttype:
-      continue
-
-    if i >= 200:
-      feeditem.archive()
-      continue
-
-    feed.append(feeditem.serialize_for_client("keys"))
-    i += 1
 
-  feed.sort(key=lambda item: item["date"], reverse=True)
-  feed = feed[:amount]
+  fields = requested_fields(FeedItem.client_fields())
+  feeditems = latest(project, fields, amount, request.args.get("type"))
+  feed = FeedItem.serialize_projections_for_client(feeditems, "keys" if fields is None or "children" in fields else None)
+  feed = select_fields(feed, fields)
 
   return jsonify(feed=feed)
 
 
 @blueprint.route("/<id>", methods=["GET"])
 @project_access_required
+@conditional
 def get(project, id):
   try:
     feeditem = FeedItem.get(id)
@@ -81,6 +107,7 @@ def delete(project, id):
   else:
     if current_user.key == feeditem.author.key or current_user.key in project.owners:
       feeditem.delete()
+      record(project.key, "feeditem", feeditem.key, "delete")
       return jsonify(status="okay")
     else:
       return abort(403)
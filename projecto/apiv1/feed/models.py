@@ -5,13 +5,12 @@ from kvkit import (
   StringProperty
 )
 
-from ...models import BaseDocument, Content, rc, Project, Comment, CommentParentMixin
-
-from settings import DATABASES
+from ...models import BaseDocument, Content, bucket, Project, Comment, CommentParentMixin, FAST_READ
 
 
 class ArchivedFeedItem(CommentParentMixin, BaseDocument, Content):
-  _riak_options = {"bucket": rc.bucket(DATABASES["archived_feed"])}
+  # Read only in lists of old items.
+  _riak_options = dict(FAST_READ, bucket=bucket("archived_feed"))
   _child_class = Comment
 
   parent = ReferenceProperty(Project, index=True, load_on_demand=True)
@@ -19,7 +18,7 @@ class ArchivedFeedItem(CommentParentMixin, BaseDocument, Content):
 
 
 class FeedItem(CommentParentMixin, BaseDocument, Content):
-  _riak_options = {"bucket": rc.bucket(DATABASES["feed"])}
+  _riak_options = {"bucket": bucket("feed")}
   _child_class = Comment
 
   parent = ReferenceProperty(Project, index=True, load_on_demand=True)
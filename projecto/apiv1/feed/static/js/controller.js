@@ -33,7 +33,7 @@
   }]);
 
   module.controller(
-    "FeedController", ["$scope", "toast", "title", "FeedService", "ProjectsService", function($scope, toast, title, FeedService, ProjectsService) {
+    "FeedController", ["$scope", "toast", "title", "FeedService", "ProjectsService", "ChangesService", function($scope, toast, title, FeedService, ProjectsService, ChangesService) {
       $scope.posts = [];
       $scope.newpost = "";
 
@@ -90,11 +90,74 @@
         }
       };
 
+      var indexOfPost = function(key) {
+        for (var i=0; i<$scope.posts.length; i++) {
+          if ($scope.posts[i].key === key)
+            return i;
+        }
+        return -1;
+      };
+
+      var getPost = function(key) {
+        var req = FeedService.get($scope.currentProject, key);
+        req.success(function(post) {
+          // The list only has the keys of comments.
+          post.children = post.children.map(function(comment) { return comment.key; });
+          var i = indexOfPost(key);
+          if (i === -1) {
+            $scope.posts.splice(0, 0, post);
+          } else {
+            $scope.posts[i] = post;
+          }
+        });
+      };
+
+      // Applies changes from ChangesService to the posts shown.
+      $scope.applyChanges = function(changes) {
+        var get = {};
+        var change, i;
+        for (i=0; i<changes.length; i++) {
+          change = changes[i];
+          if (change.type === "feeditem") {
+            if (change.op === "save") {
+              get[change.key] = true;
+            } else {
+              delete get[change.key];
+              var j = indexOfPost(change.key);
+              if (j !== -1)
+                $scope.posts.splice(j, 1);
+            }
+          } else if (change.type === "comment" && indexOfPost(change.parent) !== -1) {
+            get[change.parent] = true;
+          } else if (change.type === "user") {
+            $scope.update();
+            return;
+          }
+        }
+
+        for (var key in get)
+          getPost(key);
+      };
+
+      var stopFollowing = function() {};
+      $scope.$on("$destroy", function() {
+        stopFollowing();
+      });
+
       $scope.currentProject = null;
 
       ProjectsService.getCurrentProject().done(function(currentProject){
         $scope.currentProject = currentProject;
-        $scope.update();
+        // Comes with where the changes after it are followed from.
+        var req = ProjectsService.bootstrap($scope.currentProject);
+        req.success(function(data) {
+          title("Feed", $scope.currentProject);
+          $scope.posts = angular.copy(data.feed);
+          stopFollowing = ChangesService.follow($scope.currentProject, data.since, $scope.applyChanges, $scope.update);
+        });
+        req.error(function() {
+          $scope.update();
+        });
         $scope.$$phase || $scope.$apply();
       });
     }]
@@ -1,12 +1,18 @@
 from __future__ import absolute_import
 
+from cStringIO import StringIO
+import os
+
 from flask import request, abort, send_file
 from flask.ext.login import current_user
 from kvkit import NotFoundError
 
 from ..hacks import Blueprint
 from .models import File
-from ...utils import ensure_good_request, project_access_required, jsonify
+from ...changes import conditional, record
+from ...concurrency import batches
+from ...models import INDEX_BATCH_SIZE, User, prefetch
+from ...utils import ensure_good_request, project_access_required, jsonify, stream_jsonify
 
 blueprint = Blueprint("api_v1_files", __name__,
                       static_folder="static",
@@ -29,19 +35,23 @@ def _get_path():
   return path, None
 
 
+def _serialize_children(files):
+  # Generates the listing as files are fetched, for stream_jsonify.
+  for batch in batches(files, INDEX_BATCH_SIZE):
+    for f in prefetch(batch, "author", User):
+      yield f.serialize_for_client(recursive=False)
+
+
 @blueprint.route("/", methods=["GET"])
 @project_access_required
+@conditional
 def get_item(project):
   path = request.args.get("path", None)
   if path is None:
     return abort(400)
 
   if path == "/":
-    r = {"path": "/"}
-    r["children"] = children = []
-    for f in File.lsroot(project):
-      children.append(f.serialize_for_client(recursive=False))
-    return jsonify(**r)
+    return stream_jsonify(path="/", children=_serialize_children(File.lsroot(project)))
   else:
     try:
       f = File.get_by_project_path(project, path)
@@ -49,6 +59,10 @@ def get_item(project):
       return abort(404)
     else:
       if not request.args.get("download", False):
+        if f.is_directory:
+          item = f.serialize_for_client(recursive=False)
+          item["children"] = _serialize_children(f.children)
+          return stream_jsonify(**item)
         return jsonify(**f.serialize_for_client())
       else:
         return send_file(f.fspath, as_attachment=True)
@@ -79,6 +93,7 @@ def create_item(project):
       f.save()
     except NotFoundError:
       return abort(404)
+    record(project.key, "file", f.key, "save")
 
     return jsonify(**f.serialize_for_client())
   else:
@@ -101,10 +116,11 @@ def update_item(project):
     # TODO: if files gets more meta data, we can update them here.
     # Otherwise we only need to update the content.
     if request.files.get("file", None) and not f.is_directory:
-      f.update_content(request.files["file"].read())
+      f.update_upload(request.files["file"], current_user._get_current_object())
       request.files["file"].close()
     else:
       return abort(400)
+    record(project.key, "file", f.key, "save")
 
     return jsonify(**f.serialize_for_client())
 
@@ -123,6 +139,7 @@ def delete_item(project):
     return abort(404)
   else:
     f.delete()
+    record(project.key, "file", f.key, "delete")
     return jsonify(status="okay")
 
 
@@ -139,9 +156,65 @@ def move_item(project):
   except NotFoundError:
     return abort(404)
   else:
+    key = f.key
     try:
       f.move(request.json["path"], current_user._get_current_object())
     except NotFoundError:
       return abort(404)
+    record(project.key, "file", key, "move")
 
     return jsonify(status="okay")
+
+
+@blueprint.route("/versions", methods=["GET"])
+@project_access_required
+@conditional
+def list_versions(project):
+  path, err = _get_path()
+  if err:
+    return err
+
+  try:
+    f = File.get_by_project_path(project, path)
+  except NotFoundError:
+    return abort(404)
+
+  if f.is_directory:
+    return abort(400)
+
+  versions = [v.serialize_for_client() for v in f.versions()]
+  versions.reverse()
+  return jsonify(path=f.path, versions=versions)
+
+
+@blueprint.route("/versions/<int:number>", methods=["GET"])
+@project_access_required
+@conditional
+def get_version(project, number):
+  path, err = _get_path()
+  if err:
+    return err
+
+  try:
+    f = File.get_by_project_path(project, path)
+    if f.is_directory:
+      return abort(400)
+    content = f.version_content(number)
+  except NotFoundError:
+    return abort(404)
+
+  return send_file(StringIO(content), as_attachment=True,
+                   attachment_filename=os.path.basename(f.path),
+                   add_etags=False)
+
+
+@blueprint.route("/search", methods=["GET"])
+@project_access_required
+@conditional
+def search(project):
+  q = request.args.get("q", "")
+  if not q.strip():
+    return abort(400)
+
+  prefix_only = request.args.get("prefix", "0") == "1"
+  return jsonify(results=File.search(project, q, prefix_only=prefix_only))
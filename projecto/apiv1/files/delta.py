@@ -0,0 +1,129 @@
+"""A small binary delta format used for file version history.
+
+A delta is a zlib compressed list of operations that rebuilds a target string
+from a source string:
+
+  C <offset:uint32> <length:uint32>  -- copy length bytes from source[offset:]
+  I <length:uint32> <bytes>          -- insert the following bytes verbatim
+
+Matching is done by indexing the source in fixed size blocks and extending any
+block hit in both directions, which is good enough for the kind of edits people
+make to documents and source files.
+"""
+
+from __future__ import absolute_import
+
+import struct
+import zlib
+
+BLOCK_SIZE = 16
+
+_COPY = "C"
+_INSERT = "I"
+_COPY_HEADER = struct.Struct(">II")
+_INSERT_HEADER = struct.Struct(">I")
+
+# Used to quickly extend matches before falling back to a byte by byte compare.
+_EXTEND_STEP = 256
+
+
+class CorruptDelta(ValueError):
+  pass
+
+
+def _match_length(source, soffset, target, toffset):
+  length = 0
+  slen = len(source)
+  tlen = len(target)
+  while soffset + length + _EXTEND_STEP <= slen and toffset + length + _EXTEND_STEP <= tlen:
+    if source[soffset+length:soffset+length+_EXTEND_STEP] != target[toffset+length:toffset+length+_EXTEND_STEP]:
+      break
+    length += _EXTEND_STEP
+
+  while soffset + length < slen and toffset + length < tlen and source[soffset+length] == target[toffset+length]:
+    length += 1
+
+  return length
+
+
+def diff(source, target, max_insert=None):
+  """Computes a delta that turns source into target. Gives up and returns
+  None once more than max_insert bytes of target are found nowhere in
+  source, as the scan is slowest (byte by byte) where nothing matches."""
+  index = {}
+  for i in xrange(0, len(source) - BLOCK_SIZE + 1, BLOCK_SIZE):
+    index.setdefault(source[i:i+BLOCK_SIZE], i)
+
+  ops = []
+  pending = 0  # start of the bytes that are not covered by a copy yet
+  inserted = 0
+  i = 0
+  n = len(target)
+  while i + BLOCK_SIZE <= n:
+    offset = index.get(target[i:i+BLOCK_SIZE])
+    if offset is None:
+      i += 1
+      if max_insert is not None and inserted + i - pending > max_insert:
+        return None
+      continue
+
+    length = _match_length(source, offset, target, i)
+
+    # Grow the match backwards into the pending insert, if possible.
+    while i > pending and offset > 0 and target[i-1] == source[offset-1]:
+      i -= 1
+      offset -= 1
+      length += 1
+
+    if i > pending:
+      ops.append(_INSERT + _INSERT_HEADER.pack(i - pending) + target[pending:i])
+      inserted += i - pending
+      if max_insert is not None and inserted > max_insert:
+        return None
+
+    ops.append(_COPY + _COPY_HEADER.pack(offset, length))
+    i += length
+    pending = i
+
+  if pending < n:
+    if max_insert is not None and inserted + n - pending > max_insert:
+      return None
+    ops.append(_INSERT + _INSERT_HEADER.pack(n - pending) + target[pending:])
+
+  return zlib.compress("".join(ops))
+
+
+def patch(source, delta):
+  """Applies a delta generated by `diff` on source and returns the target."""
+  try:
+    ops = zlib.decompress(delta)
+  except zlib.error as e:
+    raise CorruptDelta(str(e))
+
+  pieces = []
+  i = 0
+  n = len(ops)
+  while i < n:
+    op = ops[i]
+    i += 1
+    if op == _COPY:
+      if i + _COPY_HEADER.size > n:
+        raise CorruptDelta("Truncated copy operation.")
+      offset, length = _COPY_HEADER.unpack_from(ops, i)
+      i += _COPY_HEADER.size
+      if offset + length > len(source):
+        raise CorruptDelta("Copy operation out of bounds.")
+      pieces.append(source[offset:offset+length])
+    elif op == _INSERT:
+      if i + _INSERT_HEADER.size > n:
+        raise CorruptDelta("Truncated insert operation.")
+      length, = _INSERT_HEADER.unpack_from(ops, i)
+      i += _INSERT_HEADER.size
+      if i + length > n:
+        raise CorruptDelta("Truncated insert operation.")
+      pieces.append(ops[i:i+length])
+      i += length
+    else:
+      raise CorruptDelta("Unknown operation {!r}.".format(op))
+
+  return "".join(pieces)
@@ -1,28 +1,156 @@
 from __future__ import absolute_import
 
+from cStringIO import StringIO
 from datetime import datetime
 import os
+import shutil
+from uuid import uuid4
 
 from kvkit import (
+  BooleanProperty,
   DateTimeProperty,
   Document,
+  ListProperty,
   NotFoundError,
+  NumberProperty,
   ReferenceProperty,
+  StringProperty,
 )
-import werkzeug.utils
+from werkzeug.datastructures import FileStorage
 
-from ...models import BaseDocument, Project, User, rc
+from ...concurrency import batches, blocking
+from ...models import INDEX_BATCH_SIZE, BaseDocument, Project, User, bucket, prefetch, raise_errors
 from ...utils import safe_mkdirs
+from . import delta
 
-from settings import DATABASES
+from settings import FILE_DELTA_MAX_SIZE, FILE_SNAPSHOT_INTERVAL
 
 
 class CannotMoveToDestination(IOError):
   pass
 
 
+def _unicode(s):
+  return s.decode("utf-8") if isinstance(s, str) else s
+
+
+def trigrams(s):
+  return set(s[i:i+3] for i in xrange(len(s) - 2))
+
+
+# Disk helpers. Callers run these through `blocking` so a slow disk only holds
+# up the request waiting on it instead of the whole worker.
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _read_file(path):
+  with open(path, "rb") as f:
+    return f.read()
+
+
+def _write_file(path, content):
+  with open(path, "wb") as f:
+    f.write(content)
+
+
+def _is_binary(content):
+  return "\0" in content[:8192]
+
+
+def _delta_source(path):
+  """The content of path to diff an update of it against, or None if it
+  should not be diffed."""
+  if not os.path.exists(path) or os.path.getsize(path) > FILE_DELTA_MAX_SIZE:
+    return None
+
+  content = _read_file(path)
+  return None if _is_binary(content) else content
+
+
+def _listdir(path):
+  """Returns (name, is_directory) for every entry of a directory."""
+  return [(name, os.path.isdir(os.path.join(path, name))) for name in os.listdir(path)]
+
+
+def _save_upload(upload, path):
+  """Copies an uploaded FileStorage to path. The upload may be reading from the
+  request socket, which has to stay on the hub, so only the writes are handed
+  to the threadpool."""
+  f = blocking(open, path, "wb")
+  try:
+    while True:
+      chunk = upload.stream.read(CHUNK_SIZE)
+      if not chunk:
+        break
+      blocking(f.write, chunk)
+  finally:
+    blocking(f.close)
+
+
+def _ensure_history_dir(history_dir):
+  for d in (os.path.dirname(os.path.dirname(history_dir)), os.path.dirname(history_dir), history_dir):
+    safe_mkdirs(d)
+
+
+def _write_version(history_dir, name, data):
+  _ensure_history_dir(history_dir)
+  _write_file(os.path.join(history_dir, name), data)
+
+
+def _copy_version(history_dir, name, path):
+  _ensure_history_dir(history_dir)
+  shutil.copyfile(path, os.path.join(history_dir, name))
+
+
+def _remove_if_exists(path):
+  if os.path.exists(path):
+    os.remove(path)
+
+
+def _rebuild_version(history_dir, number):
+  """Applies the deltas since the closest snapshot. Returns None if some part
+  of the history is missing."""
+  deltas = []
+  while not os.path.exists(os.path.join(history_dir, "{}.snapshot".format(number))):
+    path = os.path.join(history_dir, "{}.delta".format(number))
+    if number <= 1 or not os.path.exists(path):
+      return None
+    deltas.append(path)
+    number -= 1
+
+  content = _read_file(os.path.join(history_dir, "{}.snapshot".format(number)))
+  for path in reversed(deltas):
+    content = delta.patch(content, _read_file(path))
+  return content
+
+
+class FileVersion(BaseDocument):
+  """Metadata of one version of a file. The content itself lives on disk next
+  to the other versions of the file, either as a full snapshot or as a delta
+  against the previous version."""
+  _riak_options = {"bucket": bucket("file_versions")}
+
+  history = StringProperty(index=True)
+  number = NumberProperty()
+  author = ReferenceProperty(User, load_on_demand=True)
+  date = DateTimeProperty(default=lambda: None)
+  size = NumberProperty()
+  snapshot = BooleanProperty(default=False)
+
+  @staticmethod
+  def keygen(history, number):
+    return "{}:{}".format(history, number)
+
+  def serialize_for_client(self):
+    item = self.serializer(("history", "author"))(self)
+    item["author"] = self.author.serialize_for_client() if self.author else None
+    return item
+
+
 class File(BaseDocument):
-  _riak_options = {"bucket": rc.bucket(DATABASES["files"])}
+  _riak_options = {"bucket": bucket("files")}
+  _compact_encoding = True
 
   # Only this user and root can read this!
   MODE = 0600
@@ -30,10 +158,25 @@ class File(BaseDocument):
   # This must be set by some initialization!
   FILES_FOLDER = None
 
+  # Version history is kept under FILES_FOLDER/VERSIONS_DIRNAME/<project key>/
+  VERSIONS_DIRNAME = ".versions"
+
   author = ReferenceProperty(User, load_on_demand=True)
   date = DateTimeProperty(default=lambda: None)
   project = ReferenceProperty(Project, load_on_demand=True)
 
+  # history identifies the version chain of a file and survives moves.
+  history = StringProperty()
+  version = NumberProperty(default=0)
+
+  # Filename search. Values are prefixed with "<project key>`" so a single
+  # index query never leaves the project. name_index is the lowercased base
+  # name for prefix searches, path_trigrams covers substrings of the path.
+  name_index = StringProperty(index=True)
+  path_trigrams = ListProperty(index=True)
+
+  SEARCH_LIMIT = 50
+
   def __init__(self, key=None, *args, **kwargs):
     if not key:
       raise KeyError("You need to supply a key to the File model!")
@@ -57,10 +200,13 @@ class File(BaseDocument):
   def keygen(cls, project, path):
     """Parses a path that is passed from the client securely.
 
-    Returns a filesystem path as well as a key for db and if it is a directory.
+    Names are kept as they are, so that clients find files under the names
+    they gave them. Only "." and ".." are dropped, and names with NUL bytes,
+    which no file can have.
     """
-    path = path.lstrip("/")
-    path = [werkzeug.utils.secure_filename(p.strip()) for p in path.split("/") if p.strip() not in ("..", ".")]
+    # Paths read from disk are bytes, unlike the ones from requests.
+    path = _unicode(path).lstrip("/")
+    path = [p for p in path.split("/") if p not in ("..", ".") and "\0" not in p]
     path = "/".join(path)
 
     key = project.key + "`/" + path
@@ -68,7 +214,7 @@ class File(BaseDocument):
 
   @property
   def path(self):
-    return self.key.rsplit("`", 1)[1]
+    return self.key.split("`", 1)[1]
 
   @property
   def fspath(self):
@@ -84,24 +230,19 @@ class File(BaseDocument):
   def is_directory(self):
     return self.path[-1] == "/"
 
+  @property
+  def history_dir(self):
+    return os.path.join(File.FILES_FOLDER, File.VERSIONS_DIRNAME, self.project.key, self.history)
+
   def serialize_for_client(self, recursive=True):
-    item = self.serialize(restricted=("project", "author"))
+    item = self.serializer(("project", "author", "history", "name_index", "path_trigrams"))(self)
     item["author"] = self.author.serialize_for_client()
     item["path"] = self.path
 
     # recursive is a lie. It only goes down one level! :D
     if recursive and self.is_directory:
-      item["children"] = children = []
-      fspath = self.fspath
-      root = os.path.join(File.FILES_FOLDER, self.project.key)
-      l = len(root) + 1
-      for fname in os.listdir(fspath):
-        path = os.path.join(fspath, fname)
-        if os.path.isdir(path):
-          path += "/"
-        path = path[l:]
-
-        children.append(File.get_by_project_path(self.project, path).serialize_for_client(recursive=False))
+      children = prefetch(list(self.children), "author", User)
+      item["children"] = [child.serialize_for_client(recursive=False) for child in children]
     return item
 
   def _ensure_base_dir_exists(self, fspath):
@@ -109,7 +250,7 @@ class File(BaseDocument):
       raise ValueError("Ensuring base dir only works on absolute path!")
     fspath = fspath.rstrip("/").rsplit("/", 1)
     fspath = fspath[0] + "/"
-    return fspath.endswith(self.project.key + "/") or os.path.exists(fspath)
+    return fspath.endswith(self.project.key + "/") or blocking(os.path.exists, fspath)
 
   def save(self, *args, **kwargs):
     self.date = datetime.now()
@@ -118,42 +259,206 @@ class File(BaseDocument):
     if not self._ensure_base_dir_exists(fspath):
       raise NotFoundError("Base dir is not found for {}".format(fspath))
 
-    if not os.path.exists(fspath):
+    if not blocking(os.path.exists, fspath):
       # We have to do this.. Should PROBABLY move this to new_project
       # TODO: move this to new project
-      safe_mkdirs(self.base_dir)
+      blocking(safe_mkdirs, self.base_dir)
 
       if self.is_directory:
-        safe_mkdirs(fspath)
+        blocking(safe_mkdirs, fspath)
       else:
         # TODO: we need to worry about race conditions here as well.
         if self._content:
-          self._content.save(fspath)
+          _save_upload(self._content, fspath)
+          self._record_snapshot(fspath, author=self.author)
+
+    self._update_search_fields()
+    return BaseDocument.save(self, *args, **kwargs)
+
+  def _update_search_fields(self):
+    # Trigrams of characters, not of UTF-8 bytes, so they match the ones of
+    # queries.
+    prefix = self.key.split("`", 1)[0] + "`"
+    path = _unicode(self.path).lower()
+    self.name_index = (prefix + path.rstrip("/").rsplit("/", 1)[-1]).encode("utf-8")
+    self.path_trigrams = [(prefix + t).encode("utf-8") for t in trigrams(path)]
+
+  def reindex(self):
+    """Rewrites the search fields without touching anything else. Used to
+    index files saved before search existed."""
+    self._update_search_fields()
+    return BaseDocument.save(self)
 
-    return Document.save(self, *args, **kwargs)
+  @classmethod
+  def search(cls, project, query, prefix_only=False, limit=SEARCH_LIMIT):
+    """Returns the sorted paths of files in project whose base name starts
+    with query or, unless prefix_only, whose path contains query. Queries
+    shorter than three characters have no trigrams to look up, so they only
+    match the start of base names. Only index queries are made, no file is
+    loaded."""
+    query = _unicode(query).strip().lower()
+    if not query:
+      return []
+
+    key_prefix = project.key + "`"
+    if prefix_only or len(query) < 3:
+      start = (key_prefix + query).encode("utf-8")
+      # No UTF-8 byte is \xff.
+      keys = cls.index_keys_only("name_index", start, start + "\xff")
+    else:
+      keys = None
+      for trigram in trigrams(query):
+        matches = set(cls.index_keys_only("path_trigrams", (key_prefix + trigram).encode("utf-8")))
+        keys = matches if keys is None else keys & matches
+        if not keys:
+          break
+
+    l = len(key_prefix)
+    # The trigrams only narrow things down. "abcd" matches "abc_bcd" too.
+    paths = [path for path in (_unicode(key)[l:] for key in keys) if query in path.lower()]
+    paths.sort()
+    return paths[:limit]
 
   @property
   def content(self):
     if self.is_directory:
       raise AttributeError("Directories do not have 'content'!")
 
-    with open(self.fspath) as f:
-      c = f.read()
-    return c
+    return blocking(_read_file, self.fspath)
 
-  def update_content(self, content):
-    """Updates the actual file.
+  def update_content(self, content, author=None):
+    """Updates the actual file and records a new version of it.
 
     This method will call save and will immediately save the file"""
     if self.is_directory:
       raise AttributeError("Directories do not have 'content'!")
 
-    with open(self.fspath, "w") as f:
-      f.write(content)
+    if not self.version and blocking(os.path.exists, self.fspath):
+      # Files from before version history existed start their history with
+      # whatever is on disk right now.
+      self._record_snapshot(self.fspath, author=self.author)
 
+    # The previous content is only read if the new version can be a delta.
+    previous = None
+    if (self.version or 0) % FILE_SNAPSHOT_INTERVAL != 0 and len(content) <= FILE_DELTA_MAX_SIZE and not _is_binary(content):
+      previous = blocking(_delta_source, self.fspath)
+
+    blocking(_write_file, self.fspath, content)
+
+    self._record_version(content, previous, author=author or self.author)
     self.date = datetime.now()
     self.save()
 
+  def update_upload(self, upload, author=None):
+    """Like update_content, for an uploaded FileStorage. The upload is written
+    to disk in chunks, and only read back if it can be stored as a delta.
+    Larger ones are copied to the history as a snapshot."""
+    if self.is_directory:
+      raise AttributeError("Directories do not have 'content'!")
+
+    if not self.version and blocking(os.path.exists, self.fspath):
+      self._record_snapshot(self.fspath, author=self.author)
+
+    if not self.history:
+      self.history = uuid4().hex
+    blocking(_ensure_history_dir, self.history_dir)
+
+    # Written out of sight of directory listings and moved in place once
+    # complete.
+    upload_path = os.path.join(self.history_dir, "upload-" + uuid4().hex)
+    try:
+      _save_upload(upload, upload_path)
+      size = blocking(os.path.getsize, upload_path)
+      if size <= FILE_DELTA_MAX_SIZE:
+        content = blocking(_read_file, upload_path)
+        previous = None
+        if (self.version or 0) % FILE_SNAPSHOT_INTERVAL != 0 and not _is_binary(content):
+          previous = blocking(_delta_source, self.fspath)
+        blocking(os.rename, upload_path, self.fspath)
+        self._record_version(content, previous, author=author or self.author)
+      else:
+        self._record_snapshot(upload_path, author=author or self.author)
+        blocking(os.rename, upload_path, self.fspath)
+    finally:
+      blocking(_remove_if_exists, upload_path)
+
+    self.date = datetime.now()
+    self.save()
+
+  def _record_version(self, content, previous=None, author=None):
+    """Stores content as the next version of this file. A full snapshot is
+    taken every FILE_SNAPSHOT_INTERVAL versions, without a previous version
+    to diff against, or whenever a delta against previous would not save
+    much. Otherwise only the delta is stored."""
+    if not self.history:
+      self.history = uuid4().hex
+
+    number = (self.version or 0) + 1
+    snapshot = previous is None or (number - 1) % FILE_SNAPSHOT_INTERVAL == 0
+    if not snapshot:
+      # Gives up early on content that is mostly new.
+      data = blocking(delta.diff, previous, content, len(content) // 2)
+      snapshot = data is None or len(data) >= len(content) // 2
+
+    if snapshot:
+      data = content
+
+    blocking(_write_version, self.history_dir, "{}.{}".format(number, "snapshot" if snapshot else "delta"), data)
+    self._add_version(number, snapshot, len(content), author)
+
+  def _record_snapshot(self, path, author=None):
+    """Stores the file at path as the next version of this file, a snapshot.
+    The file is copied on disk rather than read into memory."""
+    if not self.history:
+      self.history = uuid4().hex
+
+    number = (self.version or 0) + 1
+    blocking(_copy_version, self.history_dir, "{}.snapshot".format(number), path)
+    self._add_version(number, True, blocking(os.path.getsize, path), author)
+
+  def _add_version(self, number, snapshot, size, author):
+    FileVersion(key=FileVersion.keygen(self.history, number), data={
+      "history": self.history,
+      "number": number,
+      "author": author,
+      "date": datetime.now(),
+      "size": size,
+      "snapshot": snapshot,
+    }).save()
+    self.version = number
+
+  def versions(self):
+    if self.is_directory:
+      raise AttributeError("Directories do not have versions!")
+
+    keys = [FileVersion.keygen(self.history, number) for number in xrange(1, (self.version or 0) + 1)]
+    versions, _ = FileVersion.get_many(keys)
+    versions = [version for version in versions if version is not None]
+    return prefetch(versions, "author", User)
+
+  def version_content(self, number):
+    """Rebuilds the content of a given version from the closest snapshot at or
+    before it. At most FILE_SNAPSHOT_INTERVAL - 1 deltas are applied."""
+    if self.is_directory:
+      raise AttributeError("Directories do not have versions!")
+
+    if number < 1 or number > (self.version or 0):
+      raise NotFoundError("Version {} of {} not found!".format(number, self.key))
+
+    content = blocking(_rebuild_version, self.history_dir, number)
+    if content is None:
+      raise NotFoundError("History of {} is incomplete!".format(self.key))
+    return content
+
+  def _delete_history(self):
+    if not self.history:
+      return
+
+    keys = [FileVersion.keygen(self.history, number) for number in xrange(1, (self.version or 0) + 1)]
+    raise_errors(FileVersion.delete_many(keys))
+
+    blocking(shutil.rmtree, self.history_dir, ignore_errors=True)
+
   def delete(self, *args, **kwargs):
     """ Deletes from the file system too.
 
@@ -163,9 +468,9 @@ class File(BaseDocument):
     # This is for moving only. In that we already removed that path.
     db_only = kwargs.pop("db_only", False)
     fspath = self.fspath
-    if not db_only and not os.path.exists(fspath):
+    if not db_only and not blocking(os.path.exists, fspath):
       try:
-        Document.delete(self, *args, **kwargs)
+        BaseDocument.delete(self, *args, **kwargs)
       except:
         pass
 
@@ -174,12 +479,14 @@ class File(BaseDocument):
     if self.is_directory:
       base_dir = os.path.join(File.FILES_FOLDER, self.project.key)
       l = len(base_dir)
-      for root, subdirs, filenames in os.walk(fspath, topdown=False):
-        for fname in filenames:
-          p = os.path.join(root, fname)
-          p = p[l:]
-          key = File.keygen(self.project, p)
-          File.get(key).delete(db_only=db_only)
+      for root, subdirs, filenames in blocking(list, os.walk(fspath, topdown=False)):
+        # The files of a directory go together. Subdirectories come after
+        # their contents, so that they are empty by the time they are removed.
+        keys = [File.keygen(self.project, os.path.join(root, fname)[l:]) for fname in filenames]
+        files, missing = File.get_many(keys)
+        if missing:
+          raise NotFoundError("{} not found!".format(missing[0]))
+        raise_errors(BaseDocument.delete_many(files, db_only=db_only))
 
         if root != fspath:
           p = root[l:] + "/" # os walk does not have the trailing slash
@@ -187,45 +494,51 @@ class File(BaseDocument):
           File.get(key).delete(db_only=db_only)
 
       if not db_only:
-        os.rmdir(fspath) # suppose to fail if it is not empty.
+        blocking(os.rmdir, fspath) # suppose to fail if it is not empty.
     else:
       if not db_only:
-        os.unlink(fspath)
+        blocking(os.unlink, fspath)
+        self._delete_history()
+
+    return BaseDocument.delete(self, *args, **kwargs)
 
-    return Document.delete(self, *args, **kwargs)
+  @staticmethod
+  def _list(project, fspath):
+    """Returns an iterator over the File of everything in the directory
+    fspath. The directory is read right away and the files are fetched
+    INDEX_BATCH_SIZE at a time as the iterator is consumed. Entries on disk
+    without metadata are skipped."""
+    base_dir = os.path.join(File.FILES_FOLDER, project.key)
+    l = len(base_dir)
+
+    keys = []
+    for fname, is_directory in blocking(_listdir, fspath):
+      path = os.path.join(fspath, fname)
+      if is_directory:
+        path += "/"
+      keys.append(File.keygen(project, path[l:]))
+
+    def fetch():
+      for batch in batches(keys, INDEX_BATCH_SIZE):
+        files, _ = File.get_many(batch)
+        for f in files:
+          if f is not None:
+            yield f
+
+    return fetch()
 
   @property
   def children(self):
-    fspath = self.fspath
-
-    if self.is_directory:
-      base_dir = os.path.join(File.FILES_FOLDER, self.project.key)
-      l = len(base_dir)
-      for fname in os.listdir(fspath):
-        path = os.path.join(fspath, fname)
-        if os.path.isdir(path):
-          path += "/"
-        path = path[l:]
-        key = File.keygen(self.project, path)
-        yield File.get(key)
-    else:
+    if not self.is_directory:
       raise AttributeError("Files do not have 'children'!")
 
+    return File._list(self.project, self.fspath)
+
   @staticmethod
   def lsroot(project):
     base_dir = os.path.join(File.FILES_FOLDER, project.key)
-    l = len(base_dir)
-
-    if not os.path.exists(base_dir):
-      os.mkdir(base_dir)
-
-    for fname in os.listdir(base_dir):
-      path = os.path.join(base_dir, fname)
-      if os.path.isdir(path):
-        path += "/"
-      path = path[l:]
-      key = File.keygen(project, path)
-      yield File.get(key)
+    blocking(safe_mkdirs, base_dir)
+    return File._list(project, base_dir)
 
   @classmethod
   def get_by_project_path(cls, project, path):
@@ -258,13 +571,13 @@ class File(BaseDocument):
       raise NotFoundError("Base dir is not found for {}".format(new_path))
 
     if not db_only:
-      if os.path.exists(new_fspath):
+      if blocking(os.path.exists, new_fspath):
         raise CannotMoveToDestination("Destination already exists.")
 
       if new_fspath.startswith(old_fspath):
         raise CannotMoveToDestination("Cannot move directory into itself.")
 
-      os.renames(old_fspath, new_fspath)
+      blocking(os.renames, old_fspath, new_fspath)
 
     self.save()
     File.get(oldkey).delete(db_only=True)
@@ -273,13 +586,36 @@ class File(BaseDocument):
       base_dir = os.path.join(File.FILES_FOLDER, self.project.key)
       l = len(base_dir)
 
-      for fname in os.listdir(new_fspath):
+      for fname, is_directory in blocking(_listdir, new_fspath):
         p = os.path.join(new_fspath, fname)
 
-        if os.path.isdir(p):
+        if is_directory:
           p += "/"
 
         p = p[l:]
 
         key = File.keygen(self.project, p.replace(new_path, old_path, 1))
         File.get(key).move(p, db_only=True)
+
+  def copy(self, new_path, author=None):
+    """Copies this file to new_path and returns the copy. Directories are
+    copied with everything under them. The copy starts a new history."""
+    if self.is_directory != new_path.endswith("/"):
+      raise ValueError("Files must be copied to a file path and directories to a directory path.")
+
+    data = {"path": new_path, "project": self.project, "author": author or self.author}
+    if not self.is_directory:
+      data["file"] = FileStorage(StringIO(self.content))
+      copied = File.create(data=data)
+      copied.save()
+      return copied
+
+    copied = File.create(data=data)
+    if copied.key.startswith(self.key):
+      raise CannotMoveToDestination("Cannot copy directory into itself.")
+
+    copied.save()
+    l = len(self.path)
+    for child in self.children:
+      child.copy(copied.path + child.path[l:], author)
+    return copied
@@ -4,6 +4,8 @@ from flask import request
 from flask.ext.login import current_user, login_required
 
 from ..hacks import Blueprint
+from ...changes import record
+from ...models import Project
 from ...utils import (
     ensure_good_request,
     jsonify
@@ -25,4 +27,16 @@ meta = {
 def changename():
   current_user.name = request.json["name"]
   current_user.save()
+  # Names show up next to everything the user posted.
+  for field in ("owners", "collaborators"):
+    for key in Project.index_keys_only(field, current_user.key):
+      record(key, "user", current_user.key, "save")
   return jsonify(status="okay")
+
+
+@blueprint.route("/davtoken", methods=["POST"])
+@login_required
+def davtoken():
+  token = current_user.new_dav_token()
+  current_user.save()
+  return jsonify(token=token)
@@ -1,15 +1,21 @@
 from __future__ import absolute_import
 
-from flask import request, abort
+from flask import request, abort, Response
 from flask.ext.login import current_user, login_required
 
 from ..hacks import Blueprint
-from ...models import Project, User
+from ..feed import api as feed_api
+from ..feed.models import FeedItem
+from ..todos import api as todos_api
+from ..todos.models import Todo
+from ...changes import changes_since, conditional, event_stream, record, version
+from ...models import Project, User, STRICT_WRITE, load_users, request_users
 from ...utils import (
     ensure_good_request,
     project_access_required,
     project_managers_required,
-    jsonify
+    jsonify,
+    requested_fields
 )
 
 
@@ -21,6 +27,13 @@ meta = {
   "url_prefix": "/projects"
 }
 
+# Only shown to owners.
+MEMBER_FIELDS = ("owners", "collaborators", "unregistered_collaborators", "unregistered_owners")
+LIST_FIELDS = sorted(field for field in Project._properties() if field not in MEMBER_FIELDS)
+
+# Feed items and todos in /bootstrap, like the first pages the app asks for.
+FIRST_PAGE_SIZE = 20
+
 
 @blueprint.route("/", methods=["POST"])
 @ensure_good_request({"name"}, {"name"})
@@ -35,35 +48,103 @@ def post():
 @blueprint.route("/", methods=["GET"])
 @login_required
 def index():
-  projects_owned = [project.serialize(restricted=("owners", "collaborators", "unregistered_collaborators", "unregistered_owners"), include_key=True) for project in Project.index("owners", current_user.key)]
-  projects_participating = [project.serialize(restricted=("owners", "collaborators", "unregistered_collaborators", "unregistered_owners"), include_key=True) for project in Project.index("collaborators", current_user.key)]
+  fields = requested_fields(LIST_FIELDS)
+  projected = LIST_FIELDS if fields is None else sorted(fields)
+  projects_owned = [project.serialize(include_key=True) for project in Project.index_projected("owners", current_user.key, fields=projected)]
+  projects_participating = [project.serialize(include_key=True) for project in Project.index_projected("collaborators", current_user.key, fields=projected)]
 
   return jsonify(owned=projects_owned, participating=projects_participating)
 
 
 @blueprint.route("/<project_id>", methods=["GET"])
 @project_access_required
+@conditional
 def get(project):
   if current_user.key in project.owners:
     return jsonify(**project.serialize(include_key=True))
   else:
-    return jsonify(**project.serialize(restricted=("owners", "collaborators", "unregistered_collaborators", "unregistered_owners"), include_key=True))
+    return jsonify(**project.serialize(restricted=MEMBER_FIELDS, include_key=True))
+
+
+@blueprint.route("/<project_id>/changes", methods=["GET"])
+@project_access_required
+@conditional
+def changes(project):
+  since = request.args.get("since")
+  if since is None:
+    # Where a client that is about to fetch its lists starts from.
+    return jsonify(changes=[], since=version(project.key), more=False, reset=False)
+
+  try:
+    since = int(since)
+  except ValueError:
+    return abort(400)
+
+  result, complete = changes_since(project.key, since)
+  response = jsonify(**result)
+  if not complete:
+    # The same request can get more later without a new version.
+    response.cache_control.no_store = True
+  return response
+
+
+@blueprint.route("/<project_id>/events", methods=["GET"])
+@project_access_required
+def events(project):
+  # Not stream_with_context: the stream must not keep the request around.
+  return Response(event_stream(project.key), mimetype="text/event-stream",
+                  headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def _members(project, users):
+  load_users(users, project.owners + project.collaborators)
+  owners = [{"name": users[key].name, "email": users[key].emails[0]} for key in project.owners if users[key] is not None]
+  collaborators = [{"name": users[key].name, "email": users[key].emails[0]} for key in project.collaborators if users[key] is not None]
+  return dict(owners=owners, collaborators=collaborators, unregistered_owners=project.unregistered_owners, unregistered_collaborators=project.unregistered_collaborators)
 
 
 @blueprint.route("/<project_id>/members", methods=["GET"])
 @project_managers_required
+@conditional
 def members(project):
-  owners = []
-  for key in project.owners:
-    u = User.get(key)
-    owners.append({"name": u.name, "email": u.emails[0]})
+  return jsonify(**_members(project, request_users()))
 
-  collaborators = []
-  for key in project.collaborators:
-    u = User.get(key)
-    collaborators.append({"name": u.name, "email": u.emails[0]})
 
-  return jsonify(owners=owners, collaborators=collaborators, unregistered_owners=project.unregistered_owners, unregistered_collaborators=project.unregistered_collaborators)
+@blueprint.route("/<project_id>/bootstrap", methods=["GET"])
+@project_access_required
+@conditional
+def bootstrap(project):
+  """Everything the app shows when a project is opened: the project, the
+  member summary, the first page of the feed and of the todo list, and the
+  tag facets, behind one access check. since is where the client follows
+  /changes from, read before any of it.
+
+  Users are read at once for all of it: the members and every author."""
+  since = version(project.key)
+  feeditems = feed_api.latest(project, None, FIRST_PAGE_SIZE)
+  todos, total, tags = todos_api.overview(project, FIRST_PAGE_SIZE)
+
+  # Shared with the access check, which may have read the members already.
+  users = load_users(request_users(), project.owners + project.collaborators +
+                                      [item.author for item in feeditems] + [todo.author for todo in todos])
+
+  if current_user.key in project.owners:
+    serialized = project.serialize(include_key=True)
+    summary = _members(project, users)
+  else:
+    serialized = project.serialize(restricted=MEMBER_FIELDS, include_key=True)
+    summary = {}
+  summary["count"] = len(project.owners) + len(project.collaborators)
+
+  return jsonify(project=serialized,
+                 since=since,
+                 members=summary,
+                 feed=FeedItem.serialize_projections_for_client(feeditems, users=users),
+                 todos={"todos": Todo.serialize_projections_for_client(todos, users=users),
+                        "currentPage": 1,
+                        "totalTodos": total,
+                        "todosPerPage": FIRST_PAGE_SIZE,
+                        "tags": tags})
 
 
 @blueprint.route("/<project_id>/addowners", methods=["POST"])
@@ -77,7 +158,8 @@ def addowner(project):
     else:
       project.unregistered_owners.append(email)
 
-  project.save()
+  project.save(**STRICT_WRITE)
+  record(project.key, "project", project.key, "save")
   return jsonify(status="okay")
 
 
@@ -92,7 +174,8 @@ def addcollaborator(project):
     else:
       project.unregistered_collaborators.append(email)
 
-  project.save()
+  project.save(**STRICT_WRITE)
+  record(project.key, "project", project.key, "save")
   return jsonify(status="okay")
 
 
@@ -118,7 +201,8 @@ def removeowners(project):
       except ValueError:
         return abort(404)
 
-  project.save()
+  project.save(**STRICT_WRITE)
+  record(project.key, "project", project.key, "save")
   return jsonify(status="okay")
 
 
@@ -139,5 +223,6 @@ def removecollaborators(project):
       except ValueError:
         return abort(404)
 
-  project.save()
+  project.save(**STRICT_WRITE)
+  record(project.key, "project", project.key, "save")
   return jsonify(status="okay")
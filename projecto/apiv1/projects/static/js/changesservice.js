@@ -0,0 +1,79 @@
+"use strict";
+
+(function() {
+  // Lists ask /projects/<id>/changes for what changed after the sequence they
+  // were fetched at, instead of fetching everything again. The sequence has
+  // to be asked for before the list is fetched, so nothing falls in between.
+  //
+  // Browsers with EventSource are told about new versions by
+  // /projects/<id>/events and only ask then. Others poll.
+  angular.module("projecto").service("ChangesService", ["$http", "$interval", "$timeout", function($http, $interval, $timeout) {
+    var self = this;
+
+    this.POLL_INTERVAL = 10000;
+    // In case the event stream misses something.
+    this.EVENTS_POLL_INTERVAL = 120000;
+
+    this.since = function(project, since) {
+      return $http({
+        method: "GET",
+        url: window.API_PREFIX + "/projects/" + project.key + "/changes",
+        params: since === undefined ? {} : {since: since}
+      });
+    };
+
+    // Calls apply(changes) with the changes after since as they come, and
+    // reset() when they are no longer known and everything has to be
+    // fetched again. Returns a function that stops following.
+    this.follow = function(project, since, apply, reset) {
+      var busy = false;
+      // The newest version the event stream told about.
+      var latest = since;
+      var poll = function() {
+        if (busy)
+          return;
+
+        busy = true;
+        var req = self.since(project, since);
+        req.success(function(data) {
+          busy = false;
+          since = data.since;
+          if (data.reset) {
+            reset();
+          } else if (data.changes.length > 0) {
+            apply(data.changes);
+          }
+
+          if (data.more) {
+            poll();
+          } else if (!data.reset && since < latest) {
+            // Versions that came in meanwhile, or changes that are not
+            // journaled yet.
+            $timeout(poll, 1000);
+          }
+        });
+
+        req.error(function() {
+          busy = false;
+        });
+      };
+
+      var source = null;
+      if (window.EventSource) {
+        source = new window.EventSource(window.API_PREFIX + "/projects/" + project.key + "/events");
+        source.addEventListener("version", function(e) {
+          latest = Math.max(latest, JSON.parse(e.data).version);
+          if (latest > since)
+            $timeout(poll);
+        });
+      }
+
+      var timer = $interval(poll, source ? self.EVENTS_POLL_INTERVAL : self.POLL_INTERVAL);
+      return function() {
+        $interval.cancel(timer);
+        if (source)
+          source.close();
+      };
+    };
+  }]);
+})();
@@ -82,6 +82,27 @@
       }
     };
 
+    // What the views of a project open with: the project, its members, the
+    // first pages of the feed and the todos, and the since they follow
+    // /changes from. Fetched once per project and shared, so it can be
+    // behind on what changed; following /changes from its since catches up.
+    // Views must not modify it.
+    this._bootstrap = null;
+
+    this.bootstrap = function(project) {
+      if (!self._bootstrap || self._bootstrap.key !== project.key) {
+        var req = $http({
+          method: "GET",
+          url: projectAPIPrefix + "/" + project.key + "/bootstrap"
+        });
+        req.error(function() {
+          self._bootstrap = null;
+        });
+        self._bootstrap = {key: project.key, req: req};
+      }
+      return self._bootstrap.req;
+    };
+
     this.getCurrentProjectStats = function() {
       if ($location.path().slice(0, 9) != "/projects" || !$route.current || !$route.current.params.id) {
         var deferred = $.Deferred();
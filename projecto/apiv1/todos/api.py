@@ -8,7 +8,10 @@ from kvkit import NotFoundError
 
 from ..hacks import Blueprint
 from .models import Todo, ArchivedTodo
-from ...utils import ensure_good_request, project_access_required, jsonify, markdown_to_db
+from ...changes import conditional, record, record_many
+from ...concurrency import batches
+from ...models import FAST_READ, INDEX_BATCH_SIZE, archive_many
+from ...utils import ensure_good_request, project_access_required, jsonify, markdown_to_db, requested_fields, select_fields
 
 blueprint = Blueprint("api_v1_todos", __name__,
                       static_folder="static",
@@ -35,6 +38,7 @@ def post(project):
   todo.author = current_user._get_current_object()
   todo.parent = project
   todo.save()
+  record(project.key, "todo", todo.key, "save")
   return jsonify(**todo.serialize_for_client("keys"))
 
 
@@ -69,18 +73,22 @@ def put(project, id):
     return abort(400)
 
   todo.save()
+  record(project.key, "todo", todo.key, "save")
   return jsonify(**todo.serialize_for_client())
 
 
 @blueprint.route("/", methods=["GET"])
 @project_access_required
+@conditional
 def index(project):
   archived = request.args.get("archived", "0") == "1"
+  fields = requested_fields(Todo.client_fields())
+  projected = Todo.projected_fields(fields, needed=("date", "done"))
   if archived:
-    l = ArchivedTodo.index("parent", project.key)
+    l = ArchivedTodo.index_projected("parent", project.key, fields=projected, **FAST_READ)
     showdone = True
   else:
-    l = Todo.index("parent", project.key)
+    l = Todo.index_projected("parent", project.key, fields=projected, **FAST_READ)
     showdone = request.args.get("showdone", "0") == 1
 
   try:
@@ -89,19 +97,16 @@ def index(project):
   except (TypeError, ValueError):
     return abort(400)
 
-  todos = []
-
   # TODO: Lists through everything. Is very slow.
-  for todo in l:
-    if not showdone and todo.done:
-      continue
-
-    todos.append(todo.serialize_for_client(include_comments="keys"))
-
-  todos.sort(key=lambda x: x["date"], reverse=True)
+  todos = [todo for todo in l if showdone or not todo.done]
+  todos.sort(key=lambda todo: todo.date, reverse=True)
   totalTodos = len(todos)
 
-  return jsonify(todos=todos[page*amount:page*amount+amount],
+  # Only the page is serialized.
+  todos = todos[page*amount:page*amount+amount]
+  todos = Todo.serialize_projections_for_client(todos, "keys" if fields is None or "children" in fields else None)
+
+  return jsonify(todos=select_fields(todos, fields),
                  currentPage=page+1,
                  totalTodos=totalTodos,
                  todosPerPage=amount)  # 10 todos perpage?
@@ -110,6 +115,7 @@ def index(project):
 # also needs caching
 @blueprint.route("/filter", methods=["GET"])
 @project_access_required
+@conditional
 def filter(project):
   tags = set(request.args.getlist("tags"))
   showdone = request.args.get("showdone", "0") == "1"
@@ -124,31 +130,55 @@ def filter(project):
   # TODO: milestone based filters
   # TODO: time based filters
 
-  todos = Todo.index("parent", project.key)
+  fields = requested_fields(Todo.client_fields())
+  projected = Todo.projected_fields(fields, needed=("date", "done", "tags"))
+  todos = Todo.index_projected("parent", project.key, fields=projected, **FAST_READ)
   filtered = []
   for todo in todos:
     if (not todo.done and shownotdone) or (showdone and todo.done):
       if len(todo.tags) == 0 and " " in tags:
-        filtered.append(todo.serialize_for_client(include_comments="keys"))
+        filtered.append(todo)
         continue
       else:
         for tag in todo.tags:
           if tag in tags:
-            filtered.append(todo.serialize_for_client(include_comments="keys"))
+            filtered.append(todo)
             break
 
-  filtered.sort(key=lambda x: x["date"], reverse=True)
+  filtered.sort(key=lambda todo: todo.date, reverse=True)
   totalTodos = len(filtered)
   if (totalTodos < (page * amount + 1)):
     page = int(math.ceil(totalTodos / amount)) - 1
     if (page < 0):
       page = 0
 
-  return jsonify(todos=filtered[page*amount:page*amount+amount],
+  # Only the page is serialized.
+  filtered = filtered[page*amount:page*amount+amount]
+  filtered = Todo.serialize_projections_for_client(filtered, "keys" if fields is None or "children" in fields else None)
+
+  return jsonify(todos=select_fields(filtered, fields),
                  currentPage=page+1,
                  totalTodos=totalTodos, todosPerPage=amount)
 
 
+def overview(project, amount=20):
+  """What the todo list of the app starts with. Returns (todos, total,
+  tags): the first page of the todos of project that are not done, as /filter
+  gives it for all tags, as projections of list_fields(); how many todos
+  there are to page through; and the tag facets, how many todos have each
+  tag. The todos are read once for all of it."""
+  todos = []
+  tags = {}
+  for todo in Todo.index_projected("parent", project.key, fields=Todo.list_fields(), **FAST_READ):
+    for tag in todo.tags or ():
+      tags[tag] = tags.get(tag, 0) + 1
+    if not todo.done:
+      todos.append(todo)
+
+  todos.sort(key=lambda todo: todo.date, reverse=True)
+  return todos[:amount], len(todos), tags
+
+
 @blueprint.route("/<id>", methods=["DELETE"])
 @project_access_required
 def delete(project, id):
@@ -163,10 +193,12 @@ def delete(project, id):
 
   if request.args.get("really", "0") == "1":
     todo.delete()
+    record(project.key, "todo", todo.key, "delete")
   else:
     if archived:
       return Response(status=304)
     todo.archive()
+    record(project.key, "todo", todo.key, "archive")
 
   return jsonify(status="okay")
 
@@ -175,17 +207,22 @@ def delete(project, id):
 @project_access_required
 def clear_done(project):
   # No option to get archived.
-  # is very slow.
-  # TODO: fix slowness.
-  for todo in Todo.index("parent", project.key):
-    if todo.done:
-      todo.archive()
+  done = (todo for todo in Todo.index("parent", project.key) if todo.done)
+  failed = []
+  for batch in batches(done, INDEX_BATCH_SIZE):
+    errors = archive_many(batch, ArchivedTodo)
+    failed.extend(todo.key for todo, error in zip(batch, errors) if error is not None)
+    record_many(project.key, [("todo", todo.key, "archive", None) for todo, error in zip(batch, errors) if error is None])
+
+  if failed:
+    return jsonify(status="error", failed=failed), 500
 
   return jsonify(status="okay")
 
 
 @blueprint.route("/<id>", methods=["GET"])
 @project_access_required
+@conditional
 def get(project, id):
   archived = request.args.get("archived", "0") == "1"
   todocls = ArchivedTodo if archived else Todo
@@ -214,17 +251,19 @@ def markdone(project, id):
 
   todo.done = request.json["done"]
   todo.save()
+  record(project.key, "todo", todo.key, "save")
   return jsonify(status="okay")
 
 
 # TODO: needs caching
 @blueprint.route("/tags/", methods=["GET"])
 @project_access_required
+@conditional
 def list_tags(project):
   archived = request.args.get("archived", "0") == "1"
   todocls = ArchivedTodo if archived else Todo
 
-  todos = todocls.index("parent", project.key)
+  todos = todocls.index_projected("parent", project.key, fields=("tags", ), **FAST_READ)
   tags = set()
   for todo in todos:
     if todo.tags:
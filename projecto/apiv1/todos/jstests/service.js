@@ -310,6 +310,26 @@
       expect(list.todosPerPage).toBe(20);
     });
 
+    it("should bootstrap todolists", function() {
+      var data = {
+        todos: angular.copy(todolist),
+        currentPage: 1,
+        totalTodos: 20,
+        todosPerPage: 20,
+        tags: {tag1: 3, tag2: 1}
+      };
+
+      var list = new TodoList(project);
+      list.bootstrap(data);
+
+      expect(list.tags).toEqual(["tag1", "tag2", " "]);
+      expect(list.tagsFiltered).toEqual(["tag1", "tag2", " "]);
+      expect(list.todos).toBeTheSameTodoListAs(todolist);
+      expect(list.totalPages).toBe(1);
+      // Shared with other views, so left alone.
+      expect(data.todos).toEqual(todolist);
+    });
+
     it("should toggle tags filtered", function() {
       var list = new TodoList(project);
 
@@ -383,6 +403,49 @@
       expect(list.todos.get(todoKey + 6).data.title).toBe("YAY!");
     });
 
+    it("should apply changes", function() {
+      var filterUrl = baseUrl + "filter?page=1&showdone=0&shownotdone=1&tags=+";
+      $httpBackend.expectGET(filterUrl).respond({
+        todos: angular.copy(todolist),
+        currentPage: 1,
+        totalTodos: 20,
+        todosPerPage: 20
+      });
+
+      var list = new TodoList(project);
+      list.fetch();
+      $httpBackend.flush();
+
+      var updated = angular.copy(todolist[1]);
+      updated.title = "Updated";
+      list.applyChanges([
+        {seq: 1, type: "todo", key: todoKey + "0", op: "archive", parent: null},
+        {seq: 2, type: "todo", key: todoKey + "1", op: "save", parent: null},
+        {seq: 3, type: "comment", key: "comment", op: "save", parent: todoKey + "2"},
+        {seq: 4, type: "feeditem", key: "post", op: "save", parent: null}
+      ], [todoKey + "2"]);
+
+      // Only the todo that is not skipped is fetched.
+      $httpBackend.expectGET(baseUrl + todoKey + "1?archived=0").respond(updated);
+      $httpBackend.flush();
+
+      expect(list.todos.length()).toBe(19);
+      expect(list.totalTodos).toBe(19);
+      expect(list.todos.contains(todoKey + "0")).toBe(false);
+      expect(list.todos.get(todoKey + "1").data.title).toBe("Updated");
+
+      // New todos need the list.
+      list.applyChanges([{seq: 5, type: "todo", key: "newtodo", op: "save", parent: null}]);
+      $httpBackend.expectGET(filterUrl).respond({
+        todos: angular.copy(todolist),
+        currentPage: 1,
+        totalTodos: 20,
+        todosPerPage: 20
+      });
+      $httpBackend.flush();
+      expect(list.todos.length()).toBe(20);
+    });
+
 
   });
 })();
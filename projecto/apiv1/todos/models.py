@@ -9,13 +9,12 @@ from kvkit import (
   StringProperty
 )
 
-from ...models import BaseDocument, Content, Comment, CommentParentMixin, Project, User, rc
-
-from settings import DATABASES
+from ...models import BaseDocument, Content, Comment, CommentParentMixin, Project, User, bucket
 
 
 class Todo(CommentParentMixin, BaseDocument, Content):
-  _riak_options = {"bucket": rc.bucket(DATABASES["todos"])}
+  _riak_options = {"bucket": bucket("todos")}
+  _compact_encoding = True
   _child_class = Comment
 
   parent = ReferenceProperty(Project, index=True, load_on_demand=True)
@@ -36,4 +35,4 @@ class Todo(CommentParentMixin, BaseDocument, Content):
 
 
 class ArchivedTodo(Todo):
-  _riak_options = {"bucket": rc.bucket(DATABASES["archived_todos"])}
+  _riak_options = {"bucket": bucket("archived_todos")}
@@ -166,7 +166,7 @@
     }, 0);
   }]);
 
-  module.controller("TodosController", ["$scope", "$location", "$window", "toast", "title", "Todos", "ProjectsService", function($scope, $location, $window, toast, title, Todos, ProjectsService) {
+  module.controller("TodosController", ["$scope", "$location", "$window", "toast", "title", "Todos", "ProjectsService", "ChangesService", function($scope, $location, $window, toast, title, Todos, ProjectsService, ChangesService) {
     $scope.newtodo = null;
     $scope.todolist = null;
     $scope.todolist_for_template = null;
@@ -344,13 +344,47 @@
       });
     };
 
+    var stop_following = function() {};
+    var follow_changes = function(since) {
+      var apply = function(changes) {
+        $scope.todolist.applyChanges(changes, $scope.currently_editing).then(function() {
+          regenerate_list_for_template();
+        });
+      };
+      stop_following = ChangesService.follow($scope.currentProject, since, apply, function() {
+        $scope.update();
+      });
+    };
+    $scope.$on("$destroy", function() {
+      stop_following();
+    });
+
     $scope.currentProject = null;
     ProjectsService.getCurrentProject().done(function(currentProject){
       if (currentProject){
         $scope.currentProject = currentProject;
         $scope.todolist = new Todos.TodoList($scope.currentProject, {archived: $scope.is_archived});
         title("Todos", $scope.currentProject);
-        $scope.update(true);
+        var req;
+        if ($scope.is_archived) {
+          // Where the changes are followed from is asked for before the list
+          // is fetched, so no change falls in between.
+          req = ChangesService.since($scope.currentProject);
+          req.success(function(data) {
+            follow_changes(data.since);
+            $scope.update(true);
+          });
+        } else {
+          req = ProjectsService.bootstrap($scope.currentProject);
+          req.success(function(data) {
+            $scope.todolist.bootstrap(data.todos);
+            regenerate_list_for_template();
+            follow_changes(data.since);
+          });
+        }
+        req.error(function() {
+          $scope.update(true);
+        });
         $scope.$$phase || $scope.$apply();
       } else {
         window.notLoaded();
@@ -256,28 +256,38 @@
         throw "TodoList has not been fetched.";
     };
 
+    TodoList.prototype.recomputeTodos = function(data, archived) {
+      this.todos = new datastructures.LinkedMap();
+      var tododata, todokey;
+      for (var i=0, l=data.todos.length; i<l; i++) {
+        tododata = data.todos[i];
+        todokey = tododata.key;
+        delete tododata.key;
+        this.todos.put(todokey, new TodoItem(todokey, this.project, tododata, archived));
+      }
+
+      this.currentPage = data.currentPage;
+      this.totalTodos = data.totalTodos;
+      this.todosPerPage = data.todosPerPage;
+      this.totalPages = Math.ceil(this.totalTodos / this.todosPerPage);
+    };
+
+    // Fills the list with the todos of ProjectsService.bootstrap, which are
+    // what fetch(true) gets for a list that is not archived. tags there
+    // holds how many todos have each tag.
+    TodoList.prototype.bootstrap = function(data) {
+      data = angular.copy(data);
+      this.tags = Object.keys(data.tags);
+      this.tags.push(" ");
+      this.tagsFiltered = angular.copy(this.tags);
+      this.recomputeTodos(data, false);
+    };
+
     TodoList.prototype.fetch = function(initialize) {
       // Depending on archived state, we use filter or whatever.
       var deferred = $q.defer();
 
-      // Refactored.
-      var recomputeTodos = function(data, archived) {
-        this.todos = new datastructures.LinkedMap();
-        var tododata, todokey;
-        for (var i=0, l=data.todos.length; i<l; i++) {
-          tododata = data.todos[i];
-          todokey = tododata.key;
-          delete tododata.key;
-          this.todos.put(todokey, new TodoItem(todokey, this.project, tododata, archived));
-        }
-
-        this.currentPage = data.currentPage;
-        this.totalTodos = data.totalTodos;
-        this.todosPerPage = data.todosPerPage;
-        this.totalPages = Math.ceil(this.totalTodos / this.todosPerPage);
-      };
-
-      recomputeTodos = recomputeTodos.bind(this);
+      var recomputeTodos = this.recomputeTodos.bind(this);
 
       var self = this;
       if (this.archived) {
@@ -379,6 +389,56 @@
       return deferred.promise;
     };
 
+    // Applies changes from ChangesService to the todos in the list, leaving
+    // alone those whose keys are in skip (such as todos being edited). New
+    // todos and renamed users make the list be fetched again, as where they
+    // go depends on the filters and the page.
+    TodoList.prototype.applyChanges = function(changes, skip) {
+      skip = skip || [];
+      var refetch = false;
+      var refresh = {};
+      var change, key;
+
+      for (var i=0; i<changes.length; i++) {
+        change = changes[i];
+        if (change.type === "todo") {
+          key = change.key;
+          if (change.op === "save") {
+            if (this.todos.contains(key))
+              refresh[key] = true;
+            else if (!this.archived)
+              refetch = true;
+          } else if (change.op === "archive" && this.archived) {
+            refetch = true;
+          } else if (this.todos.contains(key)) {
+            // Deleted, or archived out of this list.
+            this.todos.remove(key);
+            this.totalTodos--;
+            delete refresh[key];
+          }
+        } else if (change.type === "comment") {
+          if (this.todos.contains(change.parent))
+            refresh[change.parent] = true;
+        } else if (change.type === "user" || change.type === "project") {
+          refetch = true;
+        }
+      }
+
+      if (refetch)
+        return this.fetch();
+
+      var requests = [];
+      for (key in refresh) {
+        if (skip.indexOf(key) === -1)
+          requests.push(this.todos.get(key).refresh());
+      }
+
+      var self = this;
+      return $q.all(requests).then(function() {
+        return self;
+      });
+    };
+
     return {
       TodoItem: TodoItem,
       TodoList: TodoList
@@ -26,7 +26,11 @@ def login():
     "audience": current_app.config["SITE_URL"]
   }
 
-  response = requests.post("https://verifier.login.persona.org/verify", data=payload)
+  try:
+    response = requests.post("https://verifier.login.persona.org/verify", data=payload, timeout=current_app.config["PERSONA_VERIFIER_TIMEOUT"])
+  except requests.RequestException:
+    return jsonify(status="verifier unavailable"), 502
+
   if response.status_code == 200:
     persona_data = ujson.loads(response.text)
     if persona_data["status"] == "okay" and persona_data["audience"] == payload["audience"]:
@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+
+from flask import Blueprint, abort, request
+from werkzeug.security import safe_str_cmp
+
+from .. import changes
+from ..cache import cache
+from ..models import rc
+from ..utils import jsonify
+from settings import STATUS_TOKEN
+
+blueprint = Blueprint("status", __name__)
+
+meta = {
+  "url_prefix": "/_status",
+}
+
+# Only a monitoring agent should see these: one with STATUS_TOKEN if it is
+# set, else one on the same box. Statistics are per worker process, so with
+# several workers each scrape sees one of them.
+LOCAL_ADDRESSES = ("127.0.0.1", "::1")
+
+
+@blueprint.before_request
+def monitoring_only():
+  if STATUS_TOKEN:
+    if not safe_str_cmp(request.headers.get("X-Status-Token", ""), STATUS_TOKEN):
+      abort(404)
+    return
+
+  # request.remote_addr comes from X-Forwarded-For once ProxyFix is applied,
+  # which clients can send themselves. And behind a proxy on the same box,
+  # every request comes from a local address, so proxied ones are refused.
+  environ = request.environ
+  remote_addr = environ.get("werkzeug.proxy_fix.orig_remote_addr", environ.get("REMOTE_ADDR"))
+  if remote_addr not in LOCAL_ADDRESSES or "HTTP_X_FORWARDED_FOR" in environ:
+    abort(404)
+
+
+@blueprint.route("/riak")
+def riak_pool():
+  return jsonify(**rc.stats())
+
+
+@blueprint.route("/cache")
+def document_cache():
+  return jsonify(**cache.report())
+
+
+@blueprint.route("/changes")
+def change_journal():
+  return jsonify(errors=changes.errors)
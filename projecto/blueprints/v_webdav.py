@@ -0,0 +1,482 @@
+"""WebDAV access to project files so projects can be mounted as a drive.
+
+WebDAV clients cannot go through Persona, so besides the normal session they
+can authenticate with HTTP basic auth using an email and the token generated
+via /api/v1/profile/davtoken.
+
+PROPFIND is answered straight from the file system with one stat per entry.
+Directory scans from Finder and Explorer are frequent and would otherwise cost
+a Riak round trip per file. Like all file system access here, the scans run
+in the threadpool, a directory at a time.
+
+Paths are taken as they are. Ones that cannot be used as they are get a 400
+rather than being rewritten, which would save files under names the client
+does not know about.
+"""
+
+from __future__ import absolute_import
+
+from datetime import datetime
+from functools import wraps
+import mimetypes
+import os
+import stat
+import urllib
+import urlparse
+from uuid import uuid4
+from xml.sax.saxutils import escape
+
+from flask import Blueprint, Response, abort, current_app, request, stream_with_context
+from flask.ext.login import current_user
+from kvkit import NotFoundError
+from werkzeug.datastructures import FileStorage
+from werkzeug.http import http_date, parse_range_header
+
+from ..apiv1.files.models import File, CannotMoveToDestination
+from ..changes import record
+from ..concurrency import blocking
+from ..extensions import csrf
+from ..models import Project, User
+from ..utils import is_project_member, safe_mkdirs
+
+blueprint = Blueprint("webdav", __name__)
+
+meta = {
+  "url_prefix": "/dav",
+}
+
+CHUNK_SIZE = 64 * 1024
+
+# Methods that change files, and what they are recorded as in the change
+# journal of the project.
+CHANGE_OPS = {"PUT": "save", "DELETE": "delete", "MKCOL": "save", "COPY": "save", "MOVE": "move"}
+
+ALLOWED_METHODS = ("OPTIONS", "GET", "HEAD", "PUT", "DELETE", "PROPFIND", "PROPPATCH", "MKCOL", "COPY", "MOVE", "LOCK", "UNLOCK")
+
+MULTISTATUS_START = '<?xml version="1.0" encoding="utf-8"?>\n<D:multistatus xmlns:D="DAV:">\n'
+MULTISTATUS_END = '</D:multistatus>\n'
+RESPONSE_TEMPLATE = '<D:response><D:href>{href}</D:href><D:propstat><D:prop>{props}</D:prop><D:status>HTTP/1.1 200 OK</D:status></D:propstat></D:response>\n'
+
+# Finder mounts shares read only unless the server claims to support locking.
+# Locks are not enforced, they are only handed out.
+LOCK_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<D:prop xmlns:D="DAV:"><D:lockdiscovery><D:activelock>
+<D:locktype><D:write/></D:locktype><D:lockscope><D:exclusive/></D:lockscope>
+<D:depth>{depth}</D:depth><D:timeout>Second-3600</D:timeout>
+<D:locktoken><D:href>{token}</D:href></D:locktoken>
+</D:activelock></D:lockdiscovery></D:prop>
+"""
+
+
+def _authenticated_user():
+  if current_user.is_authenticated():
+    return current_user._get_current_object()
+
+  auth = request.authorization
+  if not auth or not auth.username or not auth.password:
+    return None
+
+  userkeys = list(User.index_keys_only("emails", auth.username))
+  if not userkeys:
+    return None
+
+  try:
+    user = User.get(userkeys[0])
+  except NotFoundError:
+    return None
+
+  return user if user.check_dav_token(auth.password) else None
+
+
+def dav_access_required(fn):
+  """Like project_access_required, but also accepts basic auth and asks for
+  credentials instead of returning a 403 to anonymous users."""
+  @wraps(fn)
+  def wrapped(project_id, *args, **kwargs):
+    user = _authenticated_user()
+    if user is None:
+      return Response("Authentication required.", 401, {"WWW-Authenticate": 'Basic realm="projecto"'})
+
+    try:
+      project = Project.get(project_id, cached=False)
+    except NotFoundError:
+      return abort(404)
+
+    if not is_project_member(user, project):
+      return abort(403)
+
+    return fn(project, user, *args, **kwargs)
+  return wrapped
+
+
+def _clean_path(path):
+  """Returns "/" + path, or None if a name in it is empty, "." or "..", or has
+  a NUL byte."""
+  names = path.split("/")
+  # Collections may end in a slash.
+  if names[-1] == "":
+    names.pop()
+
+  for name in names:
+    if name in ("", ".", "..") or "\0" in name:
+      return None
+  return "/" + path
+
+
+def _base_dir(project):
+  base_dir = os.path.join(File.FILES_FOLDER, project.key)
+  blocking(safe_mkdirs, base_dir)
+  return base_dir
+
+
+def _stat(fspath):
+  try:
+    return os.stat(fspath)
+  except OSError:
+    return None
+
+
+def _stat_entries(root, names):
+  """Returns (name, stat) for the names in root that still exist, in one trip
+  to the threadpool."""
+  entries = []
+  for name in names:
+    st = _stat(os.path.join(root, name))
+    if st is not None:
+      entries.append((name, st))
+  return entries
+
+
+def _href(project, path):
+  href = request.script_root + meta["url_prefix"] + "/" + project.key + path
+  if isinstance(href, unicode):
+    href = href.encode("utf-8")
+  return escape(urllib.quote(href))
+
+
+def _etag(st):
+  return '"{:x}-{:x}"'.format(int(st.st_mtime), st.st_size)
+
+
+def _propfind_entry(project, path, st, is_directory):
+  name = path.rstrip("/").rsplit("/", 1)[-1] or project.key
+  props = [
+    "<D:displayname>{}</D:displayname>".format(escape(name)),
+    "<D:creationdate>{}</D:creationdate>".format(datetime.utcfromtimestamp(st.st_ctime).strftime("%Y-%m-%dT%H:%M:%SZ")),
+    "<D:getlastmodified>{}</D:getlastmodified>".format(http_date(st.st_mtime)),
+    "<D:getetag>{}</D:getetag>".format(escape(_etag(st))),
+  ]
+
+  if is_directory:
+    props.append("<D:resourcetype><D:collection/></D:resourcetype>")
+  else:
+    props.append("<D:resourcetype/>")
+    props.append("<D:getcontentlength>{}</D:getcontentlength>".format(st.st_size))
+    props.append("<D:getcontenttype>{}</D:getcontenttype>".format(mimetypes.guess_type(name)[0] or "application/octet-stream"))
+
+  return RESPONSE_TEMPLATE.format(href=_href(project, path), props="".join(props))
+
+
+def _propfind_entries(project, base_dir, path, fspath, st, depth):
+  is_directory = stat.S_ISDIR(st.st_mode)
+  if is_directory and not path.endswith("/"):
+    path += "/"
+
+  yield _propfind_entry(project, path, st, is_directory)
+  if not is_directory or depth == "0":
+    return
+
+  l = len(base_dir)
+  if depth == "1":
+    directories = [(fspath, sorted(blocking(os.listdir, fspath)))]
+  else:
+    # Walked a directory at a time, each in a trip to the threadpool.
+    walk = os.walk(fspath)
+    directories = iter(lambda: blocking(next, walk, None), None)
+    directories = ((root, subdirs + filenames) for root, subdirs, filenames in directories)
+
+  for root, names in directories:
+    for name, child_st in blocking(_stat_entries, root, names):
+      child_is_directory = stat.S_ISDIR(child_st.st_mode)
+      p = os.path.join(root, name)[l:] + ("/" if child_is_directory else "")
+      yield _propfind_entry(project, p, child_st, child_is_directory)
+
+
+def propfind(project, user, path):
+  depth = request.headers.get("Depth", "infinity").lower()
+  if depth not in ("0", "1", "infinity"):
+    return abort(400)
+
+  base_dir = _base_dir(project)
+  fspath = os.path.join(base_dir, path[1:])
+  st = blocking(_stat, fspath)
+  if st is None:
+    return abort(404)
+
+  def generate():
+    yield MULTISTATUS_START
+    for entry in _propfind_entries(project, base_dir, path, fspath, st, depth):
+      yield entry
+    yield MULTISTATUS_END
+
+  return Response(stream_with_context(generate()), 207, mimetype="application/xml")
+
+
+def proppatch(project, user, path):
+  # Clients use this to set timestamps and the like. We don't store dead
+  # properties, but refusing makes Explorer abort uploads.
+  if not blocking(os.path.exists, os.path.join(_base_dir(project), path[1:])):
+    return abort(404)
+
+  body = MULTISTATUS_START + RESPONSE_TEMPLATE.format(href=_href(project, path), props="") + MULTISTATUS_END
+  return Response(body, 207, mimetype="application/xml")
+
+
+def _read_file(fspath, start, length):
+  f = blocking(open, fspath, "rb")
+  try:
+    f.seek(start)
+    while length > 0:
+      data = blocking(f.read, min(CHUNK_SIZE, length))
+      if not data:
+        break
+      length -= len(data)
+      yield data
+  finally:
+    f.close()
+
+
+def get(project, user, path):
+  fspath = os.path.join(_base_dir(project), path[1:])
+  st = blocking(_stat, fspath)
+  if st is None:
+    return abort(404)
+  if stat.S_ISDIR(st.st_mode):
+    return abort(405)
+
+  size = st.st_size
+  headers = {
+    "Accept-Ranges": "bytes",
+    "ETag": _etag(st),
+    "Last-Modified": http_date(st.st_mtime),
+  }
+
+  start, end, status = 0, size, 200
+  ranges = parse_range_header(request.headers.get("Range"))
+  # Multiple ranges are rare enough that we just send the whole file then.
+  if ranges is not None and ranges.units == "bytes" and len(ranges.ranges) == 1:
+    begin, stop = ranges.ranges[0]
+    if begin < 0:
+      begin, stop = max(size + begin, 0), size
+    elif stop is None or stop > size:
+      stop = size
+
+    if begin >= stop:
+      headers["Content-Range"] = "bytes */{}".format(size)
+      return Response(status=416, headers=headers)
+
+    start, end, status = begin, stop, 206
+    headers["Content-Range"] = "bytes {}-{}/{}".format(start, end - 1, size)
+
+  headers["Content-Length"] = str(end - start)
+  mimetype = mimetypes.guess_type(fspath)[0] or "application/octet-stream"
+  return Response(_read_file(fspath, start, end - start), status, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+
+def put(project, user, path):
+  if path.endswith("/"):
+    return abort(405)
+
+  if request.content_length is not None and request.content_length > current_app.config["MAX_CONTENT_LENGTH"]:
+    return abort(413)
+
+  try:
+    f = File.get_by_project_path(project, path)
+  except NotFoundError:
+    f = File.create(data={
+      "path": path,
+      "project": project,
+      "author": user,
+      "file": FileStorage(request.stream, filename=path.rsplit("/", 1)[-1]),
+    })
+    try:
+      f.save()
+    except NotFoundError:
+      return abort(409)
+    return Response(status=201)
+  else:
+    if f.is_directory:
+      return abort(405)
+    f.update_upload(FileStorage(request.stream, filename=path.rsplit("/", 1)[-1]), user)
+    return Response(status=204)
+
+
+def delete(project, user, path):
+  try:
+    f = _resolve(project, path)
+  except NotFoundError:
+    return abort(404)
+
+  if f is None:
+    return abort(403)
+
+  f.delete()
+  return Response(status=204)
+
+
+def mkcol(project, user, path):
+  if request.content_length:
+    return abort(415)
+
+  path = path.rstrip("/") + "/"
+  try:
+    File.get_by_project_path(project, path)
+  except NotFoundError:
+    pass
+  else:
+    return abort(405)
+
+  try:
+    File.create(data={"path": path, "project": project, "author": user}).save()
+  except NotFoundError:
+    return abort(409)
+
+  return Response(status=201)
+
+
+def _destination(project, f):
+  destination = request.headers.get("Destination")
+  if not destination:
+    return None
+
+  prefix = request.script_root + meta["url_prefix"] + "/" + project.key + "/"
+  try:
+    destination = urllib.unquote(urlparse.urlparse(destination).path).decode("utf-8")
+  except UnicodeDecodeError:
+    return None
+  if not destination.startswith(prefix):
+    return None
+
+  destination = _clean_path(destination[len(prefix):])
+  if destination is None:
+    return None
+  if f.is_directory and not destination.endswith("/"):
+    destination += "/"
+  elif not f.is_directory:
+    destination = destination.rstrip("/")
+
+  return destination if destination != "/" else None
+
+
+def _copy_or_move(project, user, path, move):
+  try:
+    f = _resolve(project, path)
+  except NotFoundError:
+    return abort(404)
+
+  if f is None:
+    return abort(403)
+
+  destination = _destination(project, f)
+  if destination is None:
+    return abort(400)
+
+  if destination == f.path:
+    return abort(403)
+
+  overwritten = False
+  try:
+    existing = File.get_by_project_path(project, destination)
+  except NotFoundError:
+    pass
+  else:
+    if request.headers.get("Overwrite", "T").upper() == "F":
+      return abort(412)
+    existing.delete()
+    overwritten = True
+
+  try:
+    if move:
+      f.move(destination, user)
+    else:
+      f.copy(destination, user)
+  except NotFoundError:
+    return abort(409)
+  except CannotMoveToDestination:
+    return abort(403)
+
+  return Response(status=204 if overwritten else 201)
+
+
+def copy(project, user, path):
+  if request.headers.get("Depth", "infinity").lower() not in ("0", "infinity"):
+    return abort(400)
+  return _copy_or_move(project, user, path, False)
+
+
+def move(project, user, path):
+  return _copy_or_move(project, user, path, True)
+
+
+def lock(project, user, path):
+  token = "opaquelocktoken:" + uuid4().hex
+  body = LOCK_TEMPLATE.format(depth=escape(request.headers.get("Depth", "infinity")), token=token)
+  return Response(body, 200, {"Lock-Token": "<{}>".format(token)}, mimetype="application/xml")
+
+
+def unlock(project, user, path):
+  return Response(status=204)
+
+
+def options(project, user, path):
+  return Response(status=200, headers={
+    "Allow": ", ".join(ALLOWED_METHODS),
+    "DAV": "1, 2",
+    "MS-Author-Via": "DAV",
+  })
+
+
+def _resolve(project, path):
+  """Returns the File at path, or None for the project root. Clients leave out
+  the trailing slash of collections quite often, so that is tried as well."""
+  if path == "/":
+    return None
+
+  try:
+    return File.get_by_project_path(project, path)
+  except NotFoundError:
+    if path.endswith("/"):
+      raise
+    return File.get_by_project_path(project, path + "/")
+
+
+HANDLERS = {
+  "OPTIONS": options,
+  "GET": get,
+  "HEAD": get,
+  "PUT": put,
+  "DELETE": delete,
+  "PROPFIND": propfind,
+  "PROPPATCH": proppatch,
+  "MKCOL": mkcol,
+  "COPY": copy,
+  "MOVE": move,
+  "LOCK": lock,
+  "UNLOCK": unlock,
+}
+
+
+@blueprint.route("/<project_id>/", defaults={"path": ""}, methods=ALLOWED_METHODS)
+@blueprint.route("/<project_id>/<path:path>", methods=ALLOWED_METHODS)
+@csrf.exempt
+@dav_access_required
+def resource(project, user, path):
+  path = _clean_path(path)
+  if path is None:
+    return abort(400)
+
+  response = HANDLERS[request.method](project, user, path)
+  if request.method in CHANGE_OPS:
+    # Without a key, clients refetch the files they show.
+    record(project.key, "file", None, CHANGE_OPS[request.method])
+  return response
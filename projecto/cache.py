@@ -0,0 +1,272 @@
+"""A read-through cache for documents.
+
+Classes opt in with `_cache_options` (see BaseDocument). Only User does:
+projects and todos are read by access checks and conditional GETs, which
+read from the store so they are never stale. Documents are
+cached in the memcached servers of CACHE_SHARED_SERVERS, shared between
+workers and machines, and every worker keeps the ones it read recently in a
+local LRU:
+
+  - v:<bucket, key> holds the version of the document, its vclock in Riak.
+  - d:<bucket, key, version> holds the document itself.
+
+(Both are hashed into valid memcached keys.)
+
+A local entry is only used if its version is the one in the shared tier, so
+a save in one worker is seen by every other worker as soon as it invalidates
+the version. Invalidating leaves a marker in place of the version for
+fence_ttl seconds, so that a read that started before the save can't put
+the older version back when it finishes. Without a shared tier nothing is
+cached, as workers could not tell each other about saves.
+
+Entries keep the version they were read at, so a document from the cache
+can be saved with the causal context (the vclock) of what it was read as.
+
+The cache is best effort. A shared tier that is down or slow only costs the
+hits, never a request.
+"""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict, defaultdict
+from hashlib import md5
+import socket
+import threading
+import time
+import zlib
+
+import ujson
+
+from settings import CACHE_SHARED_SERVERS, CACHE_SHARED_TIMEOUT
+
+
+def cache_options(size=1000, local_ttl=5, ttl=300, fence_ttl=10):
+  """Options for `_cache_options` of a document class.
+
+  size: documents of the class kept in the local LRU of each worker.
+  local_ttl: seconds a local entry is kept.
+  ttl: seconds documents are kept in the shared tier.
+  fence_ttl: seconds after a save during which the document is not cached.
+    Reads that take longer than this can still cache an older version.
+  """
+  return {"size": size, "local_ttl": local_ttl, "ttl": ttl, "fence_ttl": fence_ttl}
+
+
+# Where the version of a document was just invalidated.
+_FENCE = "-"
+
+# Prefixes versions made up by the cache for stores without one of their own,
+# which are not vclocks. Riak vclocks are base64 and have no ":".
+_HASHED = "md5:"
+
+
+class LRUCache(object):
+  def __init__(self, size, ttl):
+    self.size = size
+    self.ttl = ttl
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()
+
+  def get(self, key):
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry is None:
+        return None
+
+      expires, value = entry
+      if expires < time.time():
+        return None
+
+      # Moves it to the most recently used end.
+      self.entries[key] = entry
+      return value
+
+  def set(self, key, value):
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = (time.time() + self.ttl, value)
+      while len(self.entries) > self.size:
+        self.entries.popitem(last=False)
+
+  def delete(self, key):
+    with self.lock:
+      self.entries.pop(key, None)
+
+  def __len__(self):
+    return len(self.entries)
+
+
+class MemcacheClient(object):
+  """Just enough of the memcached text protocol for the cache: get, add, set
+  and delete. Keys are spread over servers by hash. A server that fails is
+  left alone for retry_after seconds. Failures are counted and otherwise
+  treated as misses."""
+
+  def __init__(self, servers, timeout=0.2, retry_after=10, pool_size=8):
+    self.servers = servers
+    self.timeout = timeout
+    self.retry_after = retry_after
+    self.pool_size = pool_size
+    self.idle = [[] for _ in servers]
+    self.dead_until = [0] * len(servers)
+    self.errors = 0
+
+  def _connect(self, i):
+    if self.idle[i]:
+      return self.idle[i].pop()
+    sock = socket.create_connection(self.servers[i], self.timeout)
+    return sock, sock.makefile("rb")
+
+  def _call(self, key, command, read):
+    i = zlib.crc32(key) % len(self.servers)
+    if self.dead_until[i] > time.time():
+      return None
+
+    conn = None
+    try:
+      conn = self._connect(i)
+      conn[0].sendall(command)
+      result = read(conn[1])
+    except (socket.error, IOError, ValueError):
+      self.errors += 1
+      self.dead_until[i] = time.time() + self.retry_after
+      if conn is not None:
+        conn[0].close()
+      return None
+
+    if len(self.idle[i]) < self.pool_size:
+      self.idle[i].append(conn)
+    else:
+      conn[0].close()
+    return result
+
+  @staticmethod
+  def _read_line(f):
+    line = f.readline()
+    if not line.endswith("\r\n"):
+      raise IOError("connection closed")
+    return line[:-2]
+
+  def get(self, key):
+    def read(f):
+      line = self._read_line(f)
+      if line == "END":
+        return None
+
+      _, _, _, length = line.split(" ")
+      value = f.read(int(length) + 2)[:-2]
+      if self._read_line(f) != "END":
+        raise ValueError("unexpected response")
+      return value
+
+    return self._call(key, "get {}\r\n".format(key), read)
+
+  def _store(self, command, key, value, ttl):
+    return self._call(key, "{} {} 0 {} {}\r\n{}\r\n".format(command, key, int(ttl), len(value), value),
+                      lambda f: self._read_line(f) == "STORED")
+
+  def set(self, key, value, ttl):
+    return self._store("set", key, value, ttl)
+
+  def add(self, key, value, ttl):
+    return self._store("add", key, value, ttl)
+
+  def delete(self, key):
+    return self._call(key, "delete {}\r\n".format(key), self._read_line)
+
+
+class DocumentCache(object):
+  def __init__(self, shared=None):
+    self.shared = shared
+    self.local = {}
+    self.lock = threading.Lock()
+    self.stats = defaultdict(lambda: {"local_hits": 0, "shared_hits": 0, "misses": 0, "invalidations": 0})
+
+  def _local(self, bucket, options):
+    lru = self.local.get(bucket)
+    if lru is None:
+      with self.lock:
+        lru = self.local.setdefault(bucket, LRUCache(options["size"], options["local_ttl"]))
+    return lru
+
+  @staticmethod
+  def _hash(*parts):
+    # memcached keys can't be long or contain spaces.
+    parts = [p.encode("utf-8") if isinstance(p, unicode) else p for p in parts]
+    return md5("\0".join(parts)).hexdigest()
+
+  def _version_key(self, bucket, key):
+    return "v:" + self._hash(bucket, key)
+
+  def _data_key(self, bucket, key, version):
+    return "d:" + self._hash(bucket, key, version)
+
+  @staticmethod
+  def _found(version, encoded):
+    return ujson.loads(encoded), None if version.startswith(_HASHED) else version
+
+  def get(self, bucket, key, options):
+    """Returns (data, version) for the cached serialized document, or None.
+    version is what the store gave put, None if it gave nothing."""
+    stats = self.stats[bucket]
+    if self.shared is None:
+      stats["misses"] += 1
+      return None
+
+    version = self.shared.get(self._version_key(bucket, key))
+    if version is None or version == _FENCE:
+      stats["misses"] += 1
+      return None
+
+    local = self._local(bucket, options).get(key)
+    if local is not None and local[0] == version:
+      stats["local_hits"] += 1
+      return self._found(*local)
+
+    encoded = self.shared.get(self._data_key(bucket, key, version))
+    if encoded is None:
+      stats["misses"] += 1
+      return None
+
+    self._local(bucket, options).set(key, (version, encoded))
+    stats["shared_hits"] += 1
+    return self._found(version, encoded)
+
+  def put(self, bucket, key, data, version, options):
+    """Caches a document just read from the store at version."""
+    if self.shared is None:
+      return
+
+    encoded = ujson.dumps(data)
+    if version is None:
+      version = _HASHED + md5(encoded).hexdigest()
+
+    self.shared.set(self._data_key(bucket, key, version), encoded, options["ttl"])
+    # add, not set, so a slow reader replaces neither a version another
+    # worker cached in the meantime nor the fence of a save.
+    if self.shared.add(self._version_key(bucket, key), version, options["ttl"]):
+      self._local(bucket, options).set(key, (version, encoded))
+
+  def invalidate(self, bucket, key, options):
+    self.stats[bucket]["invalidations"] += 1
+    self._local(bucket, options).delete(key)
+    if self.shared is not None:
+      self.shared.set(self._version_key(bucket, key), _FENCE, options["fence_ttl"])
+
+  def report(self):
+    report = {}
+    for bucket, stats in self.stats.items():
+      stats = dict(stats)
+      lookups = stats["local_hits"] + stats["shared_hits"] + stats["misses"]
+      stats["hit_rate"] = round(float(stats["local_hits"] + stats["shared_hits"]) / lookups, 4) if lookups else None
+      stats["local_size"] = len(self.local[bucket]) if bucket in self.local else 0
+      report[bucket] = stats
+
+    return {
+      "shared": self.shared is not None,
+      "shared_errors": self.shared.errors if self.shared is not None else 0,
+      "buckets": report,
+    }
+
+
+cache = DocumentCache(MemcacheClient(CACHE_SHARED_SERVERS, CACHE_SHARED_TIMEOUT) if CACHE_SHARED_SERVERS else None)
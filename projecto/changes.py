@@ -0,0 +1,243 @@
+"""Versions and change journals of projects.
+
+Every project has a version, a counter in the counters bucket. Every request
+that changes something in the project (its feed, todos, comments, files or
+members) calls `record`, which increments the version and journals the
+change under its new version, its sequence number. Clients keep the
+sequence they are at and ask /projects/<id>/changes for what came after it
+instead of refetching whole lists. New versions are also published to the
+project's channel of the pubsub hub, which /projects/<id>/events streams to
+clients, so they know when to ask.
+
+GET handlers wrapped with `conditional` answer with an ETag made from the
+version, the user and the URL, and with a 304 as long as the client's
+If-None-Match still matches, without running the handler at all. ETags are
+compared weakly, as CompressionMiddleware weakens the ones of the responses
+it compresses.
+"""
+
+from __future__ import absolute_import
+
+from datetime import datetime, timedelta
+from functools import wraps
+from hashlib import md5
+
+from flask import current_app, request
+from flask.ext.login import current_user
+from kvkit import StringProperty, NumberProperty, DateTimeProperty
+import ujson
+
+from .concurrency import batches
+from .models import BaseDocument, INDEX_BATCH_SIZE, bucket, read_fresh, store
+from .pubsub import hub
+import settings
+
+# The journal of a project is trimmed every this many changes.
+TRIM_INTERVAL = 100
+
+# Changes returned by changes_since at once.
+CHANGES_PAGE_SIZE = 200
+
+# Versions record_many failed to count, in this process.
+errors = 0
+
+# Project keys to (since, datetime) of the gaps at the end of their journals
+# that changes_since has seen, in this process.
+_tail_gaps = {}
+
+
+def _position(project_key, seq):
+  # Sorts by project and then by sequence, so that one index range query
+  # gets what changed in a project after a sequence.
+  return "{}`{:020d}".format(project_key, seq)
+
+
+class Change(BaseDocument):
+  _riak_options = {"bucket": bucket("changes")}
+
+  position = StringProperty(index=True)
+  seq = NumberProperty()
+  # "todo", "feeditem", "comment", "file", "project" or "user".
+  type = StringProperty()
+  item = StringProperty()
+  # "save", "delete", "archive" or "move".
+  op = StringProperty()
+  # For comments: the todo or feed item they belong to.
+  parent = StringProperty()
+  date = DateTimeProperty()
+
+  def serialize_for_client(self):
+    return {"seq": self.seq, "type": self.type, "key": self.item, "op": self.op, "parent": self.parent}
+
+
+def version(project_key):
+  return store.counter(bucket("counters"), project_key)
+
+
+def record(project_key, type, key, op, parent=None):
+  """Records that something changed in a project. Returns the new version."""
+  return record_many(project_key, [(type, key, op, parent)])
+
+
+def record_many(project_key, changes):
+  """Records (type, key, op, parent) changes under consecutive sequence
+  numbers. Returns the new version, or None if it could not be counted.
+
+  Callers record after their write succeeded, so failing here would turn a
+  write that happened into an error. A version that cannot be counted is
+  counted in `errors` instead, and the changes are lost to the journal.
+
+  The version goes up before the changes are journaled. A change that fails
+  to be saved leaves a gap that changes_since waits out."""
+  global errors
+  if not changes:
+    return version(project_key)
+
+  try:
+    last = store.increment(bucket("counters"), project_key, len(changes))
+  except Exception:
+    errors += 1
+    return None
+
+  first = last - len(changes) + 1
+  now = datetime.now()
+  entries = []
+  for seq, (type, key, op, parent) in enumerate(changes, first):
+    position = _position(project_key, seq)
+    entries.append(Change(key=position, data={"position": position, "seq": seq, "type": type, "item": key, "op": op,
+                                              "parent": parent, "date": now}))
+  Change.save_many(entries)
+
+  hub.publish(project_key, {"version": last})
+
+  if last // TRIM_INTERVAL != (first - 1) // TRIM_INTERVAL:
+    _trim(project_key, last - settings.CHANGES_JOURNAL_SIZE)
+
+  return last
+
+
+def _trim(project_key, upto):
+  if upto < 1:
+    return
+
+  keys = Change.iterindex_keys("position", _position(project_key, 0), _position(project_key, upto))
+  for batch in batches(keys, INDEX_BATCH_SIZE):
+    Change.delete_many(batch)
+
+
+def changes_since(project_key, since, max_results=CHANGES_PAGE_SIZE):
+  """Returns (response, complete) for what changed in a project after the
+  sequence since. response holds:
+
+    changes: the changes, oldest first, at most max_results of them.
+    since: what to pass as since next time.
+    more: True if there are more changes right away.
+    reset: True if the changes after since are no longer journaled (or
+      since is not a sequence of this project). Clients have to refetch
+      everything and continue from the since given.
+
+  A change that is counted but not journaled yet holds back the changes
+  after it, unless they are older than CHANGES_GAP_WAIT seconds, in which
+  case it is taken as lost. So do changes missing at the end once they have
+  been missing for as long. complete is False when the response stops
+  short like this and a later request may get more without a new change."""
+  current = version(project_key)
+  if since > current or since < current - settings.CHANGES_JOURNAL_SIZE:
+    return {"changes": [], "since": current, "more": False, "reset": True}, True
+
+  entries, continuation = Change.index_page("position", _position(project_key, since + 1), _position(project_key, current),
+                                            max_results=max_results)
+
+  lost_before = datetime.now() - timedelta(seconds=settings.CHANGES_GAP_WAIT)
+  changes = []
+  complete = True
+  for entry in entries:
+    if entry.seq != since + 1 and entry.date > lost_before:
+      complete = False
+      break
+
+    changes.append(entry.serialize_for_client())
+    since = entry.seq
+
+  if complete and continuation is None and since < current:
+    # Nothing journaled after a gap at the end tells how old it is, so it is
+    # timed from when it was first seen here.
+    seen = _tail_gaps.get(project_key)
+    if seen is None or seen[0] != since:
+      seen = _tail_gaps[project_key] = (since, datetime.now())
+    if seen[1] > lost_before:
+      complete = False
+    else:
+      since = current
+  if complete:
+    _tail_gaps.pop(project_key, None)
+
+  return {"changes": changes, "since": since, "more": complete and continuation is not None, "reset": False}, complete
+
+
+def _event(name, data, id=None):
+  event = "event: {}\ndata: {}\n\n".format(name, ujson.dumps(data))
+  if id is not None:
+    event = "id: {}\n".format(id) + event
+  return event
+
+
+def event_stream(project_key):
+  """Yields a text/event-stream of the versions of a project: a version
+  event with the current one, then one whenever it changes. Clients ask
+  /changes what changed. Idle streams get a comment every EVENTS_KEEPALIVE
+  seconds.
+
+  It neither needs nor holds on to the request context, so that idle
+  streams cost little more than their subscription."""
+  subscription = hub.subscribe(project_key)
+  try:
+    # Subscribed first, so no version published in between is missed.
+    current = version(project_key)
+    yield "retry: 5000\n" + _event("version", {"version": current}, id=current)
+    while True:
+      messages = subscription.get(settings.EVENTS_KEEPALIVE)
+      if not messages:
+        yield ": keepalive\n\n"
+        continue
+
+      latest = max(message["version"] for message in messages)
+      # Versions published out of order can be older than what was sent.
+      if latest > current:
+        current = latest
+        yield _event("version", {"version": current}, id=current)
+  finally:
+    subscription.close()
+
+
+def etag(project_version):
+  # What a member sees of a project depends on who they are, like whether
+  # they are an owner.
+  url = request.path + "?" + request.query_string
+  return md5("{}:{}:{}".format(project_version, current_user.key, url)).hexdigest()
+
+
+def conditional(fn):
+  """For GET handlers that take a project (so below project_access_required).
+  The version is read before the handler runs, so a change made while it
+  runs only makes the next request miss. The handler reads documents from
+  the store rather than the cache: a response built from a stale document
+  would be tagged, and 304ed, as the new version. Responses marked no-store
+  by the handler get no ETag."""
+  @wraps(fn)
+  def wrapped(project, *args, **kwargs):
+    tag = etag(version(project.key))
+    if request.if_none_match.contains_weak(tag):
+      response = current_app.response_class(status=304)
+    else:
+      read_fresh()
+      response = current_app.make_response(fn(project=project, *args, **kwargs))
+      if response.status_code != 200 or response.cache_control.no_store:
+        return response
+
+    response.set_etag(tag)
+    # Browsers revalidate with If-None-Match every time instead of guessing
+    # how long the response is fresh.
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+  return wrapped
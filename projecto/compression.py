@@ -0,0 +1,180 @@
+"""gzip/deflate compression of responses, as WSGI middleware.
+
+Responses are compressed when the client accepts it and they are worth it:
+a compressible content type (text, JSON, JavaScript, XML, SVG), no
+Content-Encoding of their own and, if their length is known, at least
+min_size bytes. Anything else, including downloads of images and archives,
+passes through untouched.
+
+Responses of known length up to max_buffer bytes are compressed in one go.
+Longer ones are compressed chunk by chunk as they are sent, so they are not
+held in memory whole, and lose their Content-Length. Streamed responses are
+compressed chunk by chunk too, with a flush after each chunk, so they keep
+streaming.
+
+Compressed responses get weak ETags, as they are a different entity, except
+for static files (paths under static_prefix): Flask only answers those with
+a 304 when their strong ETag comes back.
+"""
+
+from __future__ import absolute_import
+
+import zlib
+
+COMPRESSIBLE_TYPES = (
+  "text/",
+  "application/json",
+  "application/javascript",
+  "application/x-javascript",
+  "application/xml",
+  "image/svg+xml",
+)
+
+# gzip and zlib ("deflate" in HTTP) streams, by window bits.
+_WBITS = {
+  "gzip": 16 + zlib.MAX_WBITS,
+  "deflate": zlib.MAX_WBITS,
+}
+
+
+def parse_accept_encoding(value):
+  """Returns the encoding to use for a request with this Accept-Encoding,
+  gzip before deflate, or None."""
+  accepted = {}
+  for part in value.split(","):
+    name, _, params = part.strip().partition(";")
+    name = name.strip().lower()
+    q = 1.0
+    params = params.strip()
+    if params.startswith("q="):
+      try:
+        q = float(params[2:])
+      except ValueError:
+        q = 0.0
+    if name:
+      accepted[name] = q
+
+  for encoding in ("gzip", "deflate"):
+    if accepted.get(encoding, accepted.get("*", 0)) > 0:
+      return encoding
+  return None
+
+
+def _header(headers, name):
+  name = name.lower()
+  for key, value in headers:
+    if key.lower() == name:
+      return value
+  return None
+
+
+class CompressionMiddleware(object):
+  def __init__(self, app, level=6, min_size=1024, max_buffer=1024 * 1024, static_prefix="/static/"):
+    self.app = app
+    self.level = level
+    self.min_size = min_size
+    self.max_buffer = max_buffer
+    self.static_prefix = static_prefix
+
+  def should_compress(self, status, headers):
+    code = int(status.split(" ", 1)[0])
+    if code < 200 or code in (204, 206, 304):
+      return False
+    if _header(headers, "Content-Encoding") is not None:
+      return False
+
+    content_type = (_header(headers, "Content-Type") or "").lower()
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+      return False
+    # Event streams are held open by many idle clients. A compressor for
+    # each would cost far more memory than their few bytes are worth.
+    if content_type.startswith("text/event-stream"):
+      return False
+
+    length = _header(headers, "Content-Length")
+    return length is None or int(length) >= self.min_size
+
+  def __call__(self, environ, start_response):
+    encoding = parse_accept_encoding(environ.get("HTTP_ACCEPT_ENCODING", ""))
+    if encoding is None or environ.get("REQUEST_METHOD") == "HEAD":
+      return self.app(environ, start_response)
+
+    started = []
+    buffered = []
+
+    def capture(status, headers, exc_info=None):
+      started[:] = [status, headers, exc_info]
+      return buffered.append
+
+    app_iter = self.app(environ, capture)
+    chunks = iter(app_iter)
+    # Some applications only call start_response with their first chunk.
+    while not started:
+      try:
+        buffered.append(next(chunks))
+      except StopIteration:
+        break
+
+    status, headers, exc_info = started
+    if not self.should_compress(status, headers):
+      start_response(status, headers, exc_info)
+      if not buffered:
+        # Untouched, so file wrappers keep working.
+        return app_iter
+      return self._passthrough(app_iter, buffered, chunks)
+
+    headers = [(k, v) for k, v in headers if k.lower() not in ("content-length", "content-encoding")]
+    headers.append(("Content-Encoding", encoding))
+    vary = _header(headers, "Vary")
+    headers = [(k, v) for k, v in headers if k.lower() != "vary"]
+    headers.append(("Vary", vary + ", Accept-Encoding" if vary else "Accept-Encoding"))
+    # The compressed body is a different entity.
+    etag = _header(headers, "ETag")
+    static = environ.get("PATH_INFO", "").startswith(self.static_prefix)
+    if etag is not None and not etag.startswith("W/") and not static:
+      headers = [(k, v) if k.lower() != "etag" else (k, "W/" + v) for k, v in headers]
+
+    compressor = zlib.compressobj(self.level, zlib.DEFLATED, _WBITS[encoding])
+    length = _header(started[1], "Content-Length")
+    if length is not None and int(length) <= self.max_buffer:
+      try:
+        body = "".join(buffered) + "".join(chunks)
+      finally:
+        if hasattr(app_iter, "close"):
+          app_iter.close()
+      body = compressor.compress(body) + compressor.flush()
+      headers.append(("Content-Length", str(len(body))))
+      start_response(status, headers, exc_info)
+      return [body]
+
+    start_response(status, headers, exc_info)
+    return self._compress_stream(compressor, app_iter, buffered, chunks, flush=length is None)
+
+  @staticmethod
+  def _passthrough(app_iter, buffered, chunks):
+    try:
+      for chunk in buffered:
+        yield chunk
+      for chunk in chunks:
+        yield chunk
+    finally:
+      if hasattr(app_iter, "close"):
+        app_iter.close()
+
+  @staticmethod
+  def _compress_stream(compressor, app_iter, buffered, chunks, flush=True):
+    try:
+      for source in (buffered, chunks):
+        for chunk in source:
+          if not chunk:
+            continue
+          if flush:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+          else:
+            compressed = compressor.compress(chunk)
+            if compressed:
+              yield compressed
+      yield compressor.flush()
+    finally:
+      if hasattr(app_iter, "close"):
+        app_iter.close()
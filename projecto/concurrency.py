@@ -0,0 +1,82 @@
+"""Helpers to keep blocking work off the gevent hub.
+
+Under gevent, disk I/O blocks every greenlet of the process. Wrapping such
+calls in `blocking` runs them in a native threadpool once `setup_threadpool`
+has been called. Without it (development server, tests, scripts), calls simply
+run inline.
+"""
+
+from __future__ import absolute_import
+
+_threadpool = None
+
+
+def setup_threadpool(size):
+  """Routes `blocking` calls through a gevent threadpool with size threads.
+
+  Threads do not survive a fork, so this has to be called in the process that
+  serves requests, after any forking."""
+  global _threadpool
+  from gevent.threadpool import ThreadPool
+  _threadpool = ThreadPool(size)
+
+
+def blocking(fn, *args, **kwargs):
+  """Calls fn(*args, **kwargs) in the threadpool and waits for it without
+  blocking other greenlets.
+
+  Only hand it work that does not touch gevent objects (such as sockets of the
+  current request), as those cannot be used from another thread."""
+  if _threadpool is None:
+    return fn(*args, **kwargs)
+  return _threadpool.spawn(fn, *args, **kwargs).get()
+
+
+def _gevent_patched():
+  try:
+    from gevent import socket as gevent_socket
+  except ImportError:
+    return False
+
+  import socket
+  return socket.socket is gevent_socket.socket
+
+
+def new_event():
+  """A gevent Event when gevent has patched the process, or else a
+  threading.Event. Under gevent, waiting on a threading.Event with a timeout
+  polls, sleeping up to 50ms at a time, so every waiter would wake 20 times
+  a second."""
+  if _gevent_patched():
+    from gevent.event import Event
+    return Event()
+
+  import threading
+  return threading.Event()
+
+
+def batches(items, size):
+  """Yields lists of up to size consecutive items, reading items lazily."""
+  batch = []
+  for item in items:
+    batch.append(item)
+    if len(batch) >= size:
+      yield batch
+      batch = []
+
+  if batch:
+    yield batch
+
+
+def pmap(fn, items, size):
+  """Returns [fn(item) for item in items], making at most size calls at once.
+
+  Meant for network calls. Under gevent they run in a pool of greenlets, so
+  the waits overlap. Otherwise (development server, tests, scripts) they are
+  made one after another. An exception raised by any call is raised here."""
+  items = list(items)
+  if len(items) < 2 or not _gevent_patched():
+    return [fn(item) for item in items]
+
+  from gevent.pool import Pool
+  return Pool(size).map(fn, items)
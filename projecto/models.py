@@ -1,7 +1,10 @@
 from __future__ import absolute_import
 
-from hashlib import md5
+from hashlib import md5, sha256
+import os
+from uuid import uuid1
 
+from flask import g, has_app_context
 from flask.ext.login import UserMixin
 from kvkit import (
   Document, EmDocument,
@@ -9,11 +12,19 @@ from kvkit import (
   DateTimeProperty,
   ReferenceProperty,
   ListProperty,
+  DictProperty,
+  BooleanProperty,
+  NumberProperty,
 )
 from kvkit.backends import riak as riak_backend
-import riak
+from werkzeug.security import safe_str_cmp
 
-from settings import DATABASES, RIAK_NODES
+from .cache import cache, cache_options
+from .concurrency import batches, pmap
+from .riakpool import PooledRiakClient
+from .storage import codec, get_store, READ_QUORUMS, WRITE_QUORUMS, DELETE_QUORUMS, STREAM_PAGE_SIZE
+import settings
+from settings import DATABASES
 
 
 # Global models.py file.
@@ -23,27 +34,575 @@ from settings import DATABASES, RIAK_NODES
 #    doesn't have a module associated with.
 
 
+rc = PooledRiakClient(protocol="pbc", nodes=settings.RIAK_NODES,
+                      min_size=settings.RIAK_POOL_MIN_SIZE,
+                      max_size=settings.RIAK_POOL_MAX_SIZE,
+                      balancer=settings.RIAK_BALANCER,
+                      max_failures=settings.RIAK_MAX_FAILURES,
+                      eject_time=settings.RIAK_EJECT_TIME,
+                      health_check_interval=settings.RIAK_HEALTH_CHECK_INTERVAL)
+
+store = get_store(settings.STORAGE_BACKEND, riak_client=rc, sqlite_path=settings.SQLITE_PATH,
+                  concurrency=settings.MULTIGET_CONCURRENCY)
+
+
+def bucket(name):
+  """The bucket for one of the DATABASES, in whatever form the store uses."""
+  return store.bucket(DATABASES[name])
+
+
+def reset_riak_connections():
+  """Forked workers call this before doing anything else, so they don't share
+  sockets with their parent."""
+  rc.reset()
+
+
+# Documents fetched at once while streaming an index query.
+INDEX_BATCH_SIZE = 100
+
+# Write quorums for changes that must not be lost or read back stale, like
+# who belongs to a project: a majority of primary replicas has the write on
+# disk before it is acknowledged.
+STRICT_WRITE = {"w": "quorum", "dw": "quorum", "pw": "quorum"}
+
+# Reads for lists that can be slightly stale: the first replica that has
+# the document is enough. Not found answers don't count, as a replica that
+# missed a write would otherwise hide the document.
+FAST_READ = {"r": 1, "notfound_ok": False}
+
+
+def read_fresh():
+  """Makes the rest of the current request read documents from the store
+  instead of the cache, for responses that have to be as new as the version
+  they are tagged with (see changes.conditional). What is read is still
+  cached for others."""
+  g.fresh_reads = True
+
+
+def _reading_fresh():
+  return has_app_context() and getattr(g, "fresh_reads", False)
+
+
+def _index_value(value):
+  # Index values are compared as bytes by every store, like Riak does.
+  if isinstance(value, unicode):
+    return value.encode("utf-8")
+  return value
+
+
 class BaseDocument(Document):
+  """Does all persistence through `store` rather than the kvkit backend, so
+  the storage backend can be picked in settings."""
   _backend = riak_backend
 
-rc = riak.RiakClient(protocol="pbc", nodes=RIAK_NODES)
+  # _riak_options can hold default quorums for the documents of a class next
+  # to the bucket: r, pr, notfound_ok and basic_quorum for reads, w, dw and
+  # pw for writes and rw for deletes. Any of them can be overridden per call
+  # with keyword arguments of get, get_many, index, save, delete and so on.
+
+  # Set to cache_options(...) to cache documents of the class read with get
+  # and get_many, see projecto.cache. Saves and deletes invalidate them.
+  # Documents served from the cache are saved with the vclock they were
+  # cached with.
+  _cache_options = None
+
+  # Set to True to store documents of the class as compressed msgpack
+  # instead of JSON when COMPACT_ENCODING is on, see projecto.storage.codec.
+  # Values are readable in either encoding, and scripts/tools/rewritedocuments.py
+  # converts existing ones.
+  _compact_encoding = False
+
+  @classmethod
+  def _indexed_fields(cls):
+    fields = cls.__dict__.get("_indexed_fields_cache")
+    if fields is None:
+      fields = []
+      seen = set()
+      for klass in cls.__mro__:
+        for name, value in vars(klass).iteritems():
+          if name in seen:
+            continue
+          seen.add(name)
+          if getattr(value, "index", False) is True:
+            fields.append(name)
+      cls._indexed_fields_cache = fields
+    return fields
+
+  def _index_entries(self, data):
+    entries = set()
+    for field in self._indexed_fields():
+      values = data.get(field)
+      if not isinstance(values, (list, tuple)):
+        values = [values]
+      for value in values:
+        if value is not None:
+          entries.add((field, _index_value(value)))
+    return entries
+
+  @classmethod
+  def _properties(cls):
+    """{name: kvkit property} of every field of the class."""
+    properties = cls.__dict__.get("_properties_cache")
+    if properties is None:
+      properties = {}
+      for klass in reversed(cls.__mro__):
+        for name, value in vars(klass).iteritems():
+          if hasattr(value, "to_db") and not isinstance(value, type):
+            properties[name] = value
+      cls._properties_cache = properties
+    return properties
+
+  @classmethod
+  def projection(cls, fields):
+    """The Projection class for fields of cls, see Projection."""
+    fields = tuple(fields)
+    projection = _projections.get((cls, fields))
+    if projection is None:
+      properties = cls._properties()
+      for field in fields:
+        if field not in properties or hasattr(Projection, field):
+          raise ValueError("Cannot project {} of {}".format(field, cls.__name__))
+
+      projection = type(cls.__name__ + "Projection", (Projection, ), {
+        "__slots__": fields,
+        "fields": fields,
+        "_field_properties": dict((field, properties[field]) for field in fields),
+      })
+      _projections[(cls, fields)] = projection
+    return projection
+
+  @classmethod
+  def serializer(cls, restricted=(), include_key=False):
+    """A function that returns what doc.serialize(restricted, include_key)
+    would for a document of cls, compiled once per class and arguments. It
+    reads the values of the document directly and only converts those that
+    need it, rather than going through every property on every call."""
+    serializers = cls.__dict__.get("_serializers_cache")
+    if serializers is None:
+      serializers = cls._serializers_cache = {}
+
+    restricted = tuple(restricted)
+    serializer = serializers.get((restricted, include_key))
+    if serializer is None:
+      serializer = serializers[(restricted, include_key)] = _compile_serializer(cls, restricted, include_key)
+    return serializer
+
+  @classmethod
+  def _from_store(cls, key, data, handle):
+    doc = cls(key=key)
+    doc.deserialize(data)
+    doc._store_handle = handle
+    return doc
+
+  @classmethod
+  def _cached_data(cls, key):
+    """(data, version) of the cached document, or None."""
+    if cls._cache_options and not _reading_fresh():
+      return cache.get(store.bucket_name(cls._riak_options["bucket"]), key, cls._cache_options)
+
+  @classmethod
+  def _cached(cls, key):
+    cached = cls._cached_data(key)
+    if cached is not None:
+      data, version = cached
+      bucket = cls._riak_options["bucket"]
+      return cls._from_store(key, data, store.handle(bucket, key, version) if version is not None else None)
+
+  @classmethod
+  def _cache_put(cls, key, data, handle):
+    if cls._cache_options:
+      cache.put(store.bucket_name(cls._riak_options["bucket"]), key, data, store.version(handle), cls._cache_options)
+
+  @classmethod
+  def _cache_invalidate(cls, key):
+    if cls._cache_options:
+      cache.invalidate(store.bucket_name(cls._riak_options["bucket"]), key, cls._cache_options)
+
+  @classmethod
+  def _quorum(cls, names, overrides):
+    quorum = dict((name, cls._riak_options[name]) for name in names if name in cls._riak_options)
+    for name, value in overrides.iteritems():
+      if name not in names:
+        raise TypeError("{} is not a quorum option of this request".format(name))
+      quorum[name] = value
+    return quorum
+
+  @classmethod
+  def get(cls, key, cached=True, **quorum):
+    """Reads the document of key. cached=False reads it from the store even
+    if it is cached, for reads that must not be stale (like access checks).
+    Other keyword arguments are read quorums."""
+    quorum = cls._quorum(READ_QUORUMS, quorum)
+    doc = cls._cached(key) if cached else None
+    if doc is not None:
+      return doc
+
+    data, handle = store.get(cls._riak_options["bucket"], key, **quorum)
+    cls._cache_put(key, data, handle)
+    return cls._from_store(key, data, handle)
+
+  @classmethod
+  def get_many(cls, keys, **quorum):
+    """Fetches the documents of keys concurrently. Keyword arguments are
+    read quorums, like for get.
+
+    Returns (documents, missing). documents is in the order of keys, with None
+    for keys that were not found, and missing lists those keys. Each key is
+    only fetched once, so a repeated key gives the same document."""
+    quorum = cls._quorum(READ_QUORUMS, quorum)
+    keys = list(keys)
+    found = {}
+    for key in keys:
+      if key not in found:
+        found[key] = cls._cached(key)
+
+    unique = [key for key, doc in found.iteritems() if doc is None]
+    missing = []
+    for key, result in zip(unique, store.get_many(cls._riak_options["bucket"], unique, **quorum)):
+      if result is None:
+        missing.append(key)
+      else:
+        cls._cache_put(key, *result)
+        found[key] = cls._from_store(key, *result)
+
+    return [found[key] for key in keys], missing
+
+  @classmethod
+  def get_many_projected(cls, keys, fields, **quorum):
+    """Like get_many, but returns projections of fields rather than
+    documents. Cached documents are used the same way."""
+    projection = cls.projection(fields)
+    quorum = cls._quorum(READ_QUORUMS, quorum)
+    keys = list(keys)
+    found = {}
+    for key in keys:
+      if key not in found:
+        cached = cls._cached_data(key)
+        found[key] = projection(key, cached[0]) if cached is not None else None
+
+    unique = [key for key, item in found.iteritems() if item is None]
+    missing = []
+    for key, result in zip(unique, store.get_many(cls._riak_options["bucket"], unique, **quorum)):
+      if result is None:
+        missing.append(key)
+      else:
+        cls._cache_put(key, *result)
+        found[key] = projection(key, result[0])
+
+    return [found[key] for key in keys], missing
+
+  def reload(self, **quorum):
+    data, handle = store.get(self._riak_options["bucket"], self.key, **self._quorum(READ_QUORUMS, quorum))
+    self.deserialize(data)
+    self._store_handle = handle
+    return self
+
+  @classmethod
+  def _content_type(cls):
+    if cls._compact_encoding and settings.COMPACT_ENCODING:
+      return codec.MSGPACK
+    return codec.JSON
+
+  def save(self, *args, **kwargs):
+    """Saves the document. Keyword arguments are write quorums (w, dw, pw)
+    for this write only, overriding those in _riak_options."""
+    if self.key is None:
+      self.key = uuid1().hex
+
+    data = self.serialize()
+    handle = getattr(self, "_store_handle", None)
+    self._store_handle = store.save(self._riak_options["bucket"], self.key, data, self._index_entries(data), handle=handle,
+                                     content_type=self._content_type(), **self._quorum(WRITE_QUORUMS, kwargs))
+    self._cache_invalidate(self.key)
+    return self
+
+  def delete(self, *args, **kwargs):
+    store.delete(self._riak_options["bucket"], self.key, **self._quorum(DELETE_QUORUMS, kwargs))
+    self._cache_invalidate(self.key)
+    self._store_handle = None
+
+  @classmethod
+  def delete_key(cls, key, **kwargs):
+    store.delete(cls._riak_options["bucket"], key, **cls._quorum(DELETE_QUORUMS, kwargs))
+    cls._cache_invalidate(key)
+
+  @staticmethod
+  def save_many(docs, **kwargs):
+    """Saves docs, up to BULK_WRITE_CONCURRENCY at a time, through their own
+    save methods. Keyword arguments are passed to every save, such as write
+    quorums for the whole batch.
+
+    Nothing is raised. Returns a list in the order of docs holding None for
+    every document that was saved and the exception for every one that
+    was not."""
+    def save(doc):
+      try:
+        doc.save(**kwargs)
+      except Exception as e:
+        return e
+
+    return pmap(save, docs, settings.BULK_WRITE_CONCURRENCY)
+
+  @classmethod
+  def delete_many(cls, items, **kwargs):
+    """Deletes items like save_many saves, returning errors the same way.
+
+    items can be documents, which are deleted through their own delete
+    methods (so that cascades happen), or keys of cls, which are deleted
+    without being fetched."""
+    def delete(item):
+      try:
+        if isinstance(item, basestring):
+          cls.delete_key(item, **kwargs)
+        else:
+          item.delete(**kwargs)
+      except Exception as e:
+        return e
+
+    return pmap(delete, items, settings.BULK_WRITE_CONCURRENCY)
+
+  @classmethod
+  def index_keys_only(cls, field, start_value, end_value=None, **kwargs):
+    return store.index_keys(cls._riak_options["bucket"], field, _index_value(start_value), _index_value(end_value))
+
+  @classmethod
+  def iterindex_keys(cls, field, start_value, end_value=None, page_size=STREAM_PAGE_SIZE):
+    """Yields what index_keys_only returns a page at a time, so that huge
+    results never have to be held in memory.
+
+    Every page is read to the end before its keys are yielded, so no
+    connection is held while the caller works through them. Callers do store
+    requests of their own meanwhile (index does a get_many per batch), and
+    streams held open across those could take every connection of the pool
+    and leave the requests waiting forever."""
+    bucket = cls._riak_options["bucket"]
+    start_value, end_value = _index_value(start_value), _index_value(end_value)
+    continuation = None
+    while True:
+      keys, continuation = store.index_page(bucket, field, start_value, end_value, max_results=page_size,
+                                            continuation=continuation)
+      for key in keys:
+        yield key
+
+      if continuation is None:
+        return
+
+  @classmethod
+  def index(cls, field, start_value, end_value=None, batch_size=INDEX_BATCH_SIZE, **quorum):
+    """Yields the documents matching the index query. Keys are streamed and
+    fetched batch_size at a time, so memory does not grow with the number of
+    matches as long as the caller doesn't keep them all. Keyword arguments
+    are read quorums for the fetches."""
+    for keys in batches(cls.iterindex_keys(field, start_value, end_value), batch_size):
+      docs, _ = cls.get_many(keys, **quorum)
+      for doc in docs:
+        # Skips documents deleted between the index query and the fetch.
+        if doc is not None:
+          yield doc
+
+  @classmethod
+  def index_projected(cls, field, start_value, end_value=None, fields=(), batch_size=INDEX_BATCH_SIZE, **quorum):
+    """Like index, but yields projections of fields rather than documents."""
+    for keys in batches(cls.iterindex_keys(field, start_value, end_value), batch_size):
+      items, _ = cls.get_many_projected(keys, fields, **quorum)
+      for item in items:
+        if item is not None:
+          yield item
+
+  @classmethod
+  def index_page(cls, field, start_value, end_value=None, max_results=100, continuation=None, **quorum):
+    """Returns (documents, continuation) for a page of at most max_results
+    index matches. Pass continuation back for the next page; it is None
+    after the last one. Raises ValueError for a bad continuation."""
+    keys, continuation = store.index_page(cls._riak_options["bucket"], field, _index_value(start_value), _index_value(end_value),
+                                          max_results=max_results, continuation=continuation)
+    docs, _ = cls.get_many(keys, **quorum)
+    return [doc for doc in docs if doc is not None], continuation
+
+  @classmethod
+  def keys(cls):
+    return store.keys(cls._riak_options["bucket"])
+
+
+class Projection(object):
+  """A read-only view of some fields of a stored document, made with
+  BaseDocument.projection(fields). Nothing is validated or loaded and values
+  are as stored: dates are strings and references are keys. That makes
+  projections much cheaper to build than documents, for lists that only need
+  a few fields of every row.
+
+  Fields missing from the stored document get the default of their property,
+  as they would in a document."""
+  __slots__ = ("key", )
+  fields = ()
+  _field_properties = {}
+
+  def __init__(self, key, data):
+    setattr_ = object.__setattr__
+    setattr_(self, "key", key)
+    for field in self.fields:
+      if field in data:
+        setattr_(self, field, data[field])
+      else:
+        setattr_(self, field, _stored_default(self._field_properties[field]))
+
+  def __setattr__(self, name, value):
+    raise AttributeError("Projections are read-only")
+
+  def serialize(self, include_key=False):
+    """What the document would serialize to, for the projected fields."""
+    item = dict((field, getattr(self, field)) for field in self.fields)
+    if include_key:
+      item["key"] = self.key
+    return item
+
+
+# (document class, fields) -> Projection class
+_projections = {}
+
+
+def _reference_to_db(value):
+  return value.key if isinstance(value, Document) else value
+
+
+def _compile_serializer(cls, restricted, include_key):
+  # Generates a function building the whole dict in one expression, so that
+  # serializing a document is one call and a lookup per field.
+  namespace = {}
+  entries = []
+  for i, (name, prop) in enumerate(sorted(cls._properties().iteritems())):
+    if name in restricted:
+      continue
+
+    if isinstance(prop, ReferenceProperty):
+      convert = _reference_to_db
+    elif isinstance(prop, (StringProperty, ListProperty, DictProperty, BooleanProperty, NumberProperty)):
+      # Stored as they are.
+      convert = None
+    else:
+      convert = prop.to_db
+
+    value = "data.get({!r})".format(name)
+    if convert is not None:
+      namespace["convert{}".format(i)] = convert
+      value = "_convert(convert{}, {})".format(i, value)
+    entries.append("{!r}: {}".format(name, value))
+
+  if include_key:
+    entries.append("'key': doc.key")
+
+  namespace["_convert"] = _convert
+  source = "def serialize(doc):\n  data = doc._data\n  return {{{}}}\n".format(", ".join(entries))
+  exec compile(source, "<serializer of {}>".format(cls.__name__), "exec") in namespace
+  return namespace["serialize"]
+
+
+def _convert(convert, value):
+  return convert(value) if value is not None else None
+
+
+def _stored_default(prop):
+  default = getattr(prop, "default", None)
+  if callable(default):
+    default = default()
+  return prop.to_db(default) if default is not None else None
+
+
+def raise_errors(errors):
+  """Raises the first error returned by save_many or delete_many, if any."""
+  for error in errors:
+    if error is not None:
+      raise error
+
+
+def archive_many(docs, archived_cls):
+  """Does what the archive methods of feed items and todos do for all of
+  docs, with bulk writes: each one is copied into archived_cls and deleted
+  once its copy is saved. Returns errors in the order of docs, like
+  save_many."""
+  docs = list(docs)
+  errors = BaseDocument.save_many([archived_cls(key=doc.key, data=doc) for doc in docs])
+
+  archived = [i for i, error in enumerate(errors) if error is None]
+  for i, error in zip(archived, BaseDocument.delete_many([docs[i] for i in archived])):
+    errors[i] = error
+  return errors
+
+
+def _reference_key(doc, field):
+  """The key a ReferenceProperty holds, if it has not been loaded yet."""
+  value = doc._data.get(field)
+  return value if isinstance(value, basestring) else None
+
+
+def prefetch(docs, field, cls):
+  """Loads the field reference (to a cls document) of all docs with a single
+  get_many, instead of one get per document when each is first accessed.
+  References to missing documents are left alone."""
+  docs = [doc for doc in docs if doc is not None]
+  keys = [_reference_key(doc, field) for doc in docs]
+  loaded, _ = cls.get_many(key for key in keys if key is not None)
+  loaded = dict((doc.key, doc) for doc in loaded if doc is not None)
+
+  for doc, key in zip(docs, keys):
+    if key in loaded:
+      setattr(doc, field, loaded[key])
+  return docs
+
+
+def load_users(users, keys):
+  """Reads the users with keys that are not in users yet, a dict of user keys
+  to Users (None for those that do not exist), with a single get_many, and
+  adds them. Returns users."""
+  missing = list(set(key for key in keys if key and key not in users))
+  if missing:
+    found, _ = User.get_many(missing)
+    users.update(zip(missing, found))
+  return users
+
+
+def request_users():
+  """The users read for the current request so far, for load_users, so that
+  the access check and the handler share them. Outside of a request, a new
+  dict every time."""
+  if not has_app_context():
+    return {}
+
+  users = getattr(g, "loaded_users", None)
+  if users is None:
+    users = g.loaded_users = {}
+  return users
 
 
 class Signup(BaseDocument):
-  _riak_options = {"bucket": rc.bucket(DATABASES["signups"])}
+  _riak_options = {"bucket": bucket("signups")}
 
   date = DateTimeProperty()
 
 
 class User(BaseDocument, UserMixin):
-  _riak_options = {"bucket": rc.bucket(DATABASES["users"])}
+  _riak_options = {"bucket": bucket("users")}
+  _cache_options = cache_options(size=5000)
 
   name = StringProperty(default="A New User :)")
   emails = ListProperty(index=True)
   avatar = StringProperty()
 
+  # sha256 of the password used by WebDAV clients, which cannot do Persona.
+  dav_token = StringProperty()
+
   def serialize_for_client(self):
-    return self.serialize(restricted=("emails", ), include_key=True)
+    return self.serializer(("emails", "dav_token"), include_key=True)(self)
+
+  def new_dav_token(self):
+    """Generates a new WebDAV password for this user and returns it. Only its
+    hash is kept, so it cannot be shown again."""
+    token = os.urandom(16).encode("hex")
+    self.dav_token = sha256(token).hexdigest()
+    return token
+
+  def check_dav_token(self, token):
+    return bool(self.dav_token) and safe_str_cmp(self.dav_token, sha256(token).hexdigest())
 
   @classmethod
   def register_or_login(cls, email):
@@ -61,7 +620,7 @@ class User(BaseDocument, UserMixin):
 
 
 class Project(BaseDocument):
-  _riak_options = {"bucket": rc.bucket(DATABASES["projects"])}
+  _riak_options = {"bucket": bucket("projects")}
 
   name = StringProperty()
   desc = StringProperty()
@@ -81,18 +640,65 @@ class Content(EmDocument):
 
 
 class Comment(BaseDocument, Content):
-  _riak_options = {"bucket": rc.bucket(DATABASES["comments"])}
+  _riak_options = {"bucket": bucket("comments")}
 
 
 class CommentParentMixin(object):
+  @classmethod
+  def list_fields(cls):
+    """The fields of serialize_for_client, for projections in lists."""
+    return sorted(field for field in cls._properties() if field != "parent")
+
+  @classmethod
+  def client_fields(cls):
+    """What can be asked for with ?fields= in lists."""
+    return cls.list_fields() + ["children"]
+
+  @classmethod
+  def projected_fields(cls, fields, needed=()):
+    """The fields to project for a list asked for fields (None for all of
+    them), plus those needed to filter and sort it."""
+    if fields is None:
+      return cls.list_fields()
+    return sorted((set(fields) & set(cls.list_fields())) | set(needed))
+
+  @staticmethod
+  def serialize_projections_for_client(items, include_comments="keys", users=None):
+    """What serialize_for_client returns for every one of items, which are
+    projections of list_fields() or some of them. Comments can only be
+    included as keys.
+
+    users maps user keys to Users, see load_users. Lists serialized for the
+    same response can share it, so that each author is read once."""
+    if users is None:
+      users = {}
+    authors = {}
+    if items and "author" in items[0].fields:
+      keys = set(item.author for item in items if item.author)
+      load_users(users, keys)
+      authors = dict((key, users[key].serialize_for_client()) for key in keys if users[key] is not None)
+
+    serialized = []
+    for item in items:
+      s = item.serialize(include_key=True)
+      if "author" in s:
+        s["author"] = authors.get(item.author)
+      if include_comments == "keys":
+        s["children"] = list(Comment.index_keys_only("parent", item.key))
+      serialized.append(s)
+    return serialized
+
   def serialize_for_client(self, include_comments="expand"):
-    item = self.serialize(restricted=("parent", "author"), include_key=True)
+    item = self.serializer(("parent", "author"), include_key=True)(self)
     item["author"] = self.author.serialize_for_client()
 
     if include_comments == "expand":
       item["children"] = children = []
-      for comment in Comment.index("parent", self.key):
-        serialized_comment = comment.serialize(restricted=("parent", "author"), include_key=True)
+      comments = list(Comment.index("parent", self.key))
+      prefetch(comments, "author", User)
+      serialize = Comment.serializer(("parent", "author"), include_key=True)
+      for comment in comments:
+        serialized_comment = serialize(comment)
         serialized_comment["author"] = comment.author.serialize_for_client()
         children.append(serialized_comment)
         children.sort(key=lambda x: x["date"])
@@ -101,7 +707,7 @@ class CommentParentMixin(object):
     return item
 
   def delete(self, *args, **kwargs):
-    for comment in Comment.index("parent", self.key):
-      comment.delete()
+    for keys in batches(Comment.iterindex_keys("parent", self.key), INDEX_BATCH_SIZE):
+      raise_errors(Comment.delete_many(keys, **kwargs))
 
-    return Document.delete(self, *args, **kwargs)
+    return BaseDocument.delete(self, *args, **kwargs)
@@ -0,0 +1,221 @@
+"""A small pre-fork supervisor for the gevent server.
+
+The arbiter loads the app once, then forks a number of workers that each run a
+gevent WSGIServer. Workers either share the arbiter's listening socket or, with
+reuseport, bind their own with SO_REUSEPORT and let the kernel balance between
+them.
+
+Signals handled by the arbiter:
+
+  - SIGHUP: rolling restart. A replacement is started and ready before each old
+    worker is asked to finish its requests and exit. As the app is loaded
+    before forking, this does not pick up code changes.
+  - SIGTERM, SIGINT: graceful shutdown of all workers.
+
+Workers exit on their own after max_requests requests (if set), and the arbiter
+replaces any worker that exits.
+
+gevent must have patched the standard library before this module is imported.
+"""
+
+from __future__ import absolute_import
+
+import errno
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import time
+
+import gevent
+from gevent.wsgi import WSGIServer
+
+from .models import reset_riak_connections
+
+BACKLOG = 1024
+
+# Not exposed by the socket module of python 2.7. This is the Linux value.
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", 15)
+
+# How long to wait for a new worker to report that it is accepting requests.
+READY_TIMEOUT = 30
+
+
+class Arbiter(object):
+  def __init__(self, app, host, port, workers, max_requests=0, reuseport=False, graceful_timeout=30, post_fork=None):
+    self.app = app
+    self.address = (host, int(port))
+    self.num_workers = workers
+    self.max_requests = max_requests
+    self.reuseport = reuseport
+    self.graceful_timeout = graceful_timeout
+    self.post_fork = post_fork
+
+    self.listener = None
+    self.workers = set()
+    self.retiring = set()
+    self.signals = []
+
+  # Arbiter
+
+  def run(self):
+    if not self.reuseport:
+      self.listener = self._bind()
+
+    for signum in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT):
+      signal.signal(signum, self._queue_signal)
+
+    self.log("Starting {} workers on {}:{}".format(self.num_workers, *self.address))
+    while True:
+      self._reap()
+
+      while self.signals:
+        signum = self.signals.pop(0)
+        if signum == signal.SIGHUP:
+          self.reload()
+        else:
+          return self.shutdown()
+
+      while len(self.workers - self.retiring) < self.num_workers:
+        self.spawn()
+
+      time.sleep(0.5)
+
+  def spawn(self):
+    r, w = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+      # Whatever happens, the worker must never return into the arbiter loop.
+      status = 1
+      try:
+        os.close(r)
+        self._run_worker(w)
+        status = 0
+      except:
+        sys.excepthook(*sys.exc_info())
+      finally:
+        os._exit(status)
+
+    os.close(w)
+    self.workers.add(pid)
+    try:
+      deadline = time.time() + READY_TIMEOUT
+      while True:
+        try:
+          ready, _, _ = select.select([r], [], [], max(0, deadline - time.time()))
+          break
+        except select.error as e:
+          if e.args[0] != errno.EINTR:
+            raise
+
+      if not ready or not os.read(r, 1):
+        self.log("Worker {} did not become ready".format(pid))
+    finally:
+      os.close(r)
+    return pid
+
+  def reload(self):
+    self.log("Rolling restart of {} workers".format(len(self.workers)))
+    for pid in list(self.workers - self.retiring):
+      self.spawn()
+      self._retire(pid)
+
+  def shutdown(self):
+    self.log("Shutting down")
+    for pid in list(self.workers):
+      self._retire(pid)
+
+    deadline = time.time() + self.graceful_timeout + 5
+    while self.workers and time.time() < deadline:
+      time.sleep(0.2)
+      self._reap()
+
+    for pid in list(self.workers):
+      self._kill(pid, signal.SIGKILL)
+
+  def _retire(self, pid):
+    self.retiring.add(pid)
+    self._kill(pid, signal.SIGTERM)
+
+  def _kill(self, pid, signum):
+    try:
+      os.kill(pid, signum)
+    except OSError as e:
+      if e.errno != errno.ESRCH:
+        raise
+
+  def _reap(self):
+    while True:
+      try:
+        pid, status = os.waitpid(-1, os.WNOHANG)
+      except OSError as e:
+        if e.errno == errno.ECHILD:
+          return
+        raise
+
+      if pid == 0:
+        return
+
+      if pid not in self.retiring and os.WEXITSTATUS(status) != 0:
+        self.log("Worker {} died with status {}".format(pid, status))
+
+      self.workers.discard(pid)
+      self.retiring.discard(pid)
+
+  def _queue_signal(self, signum, frame):
+    self.signals.append(signum)
+
+  def _bind(self):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if self.reuseport:
+      sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+    sock.bind(self.address)
+    sock.listen(BACKLOG)
+    return sock
+
+  def log(self, message):
+    sys.stderr.write("[{}] {}\n".format(os.getpid(), message))
+
+  # Worker
+
+  def _run_worker(self, ready_fd):
+    self.signals = []
+    for signum in (signal.SIGHUP, signal.SIGINT):
+      signal.signal(signum, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    reset_riak_connections()
+    if self.post_fork is not None:
+      self.post_fork()
+
+    listener = self.listener if self.listener is not None else self._bind()
+
+    # Jitter so workers started together don't all recycle together.
+    max_requests = self.max_requests
+    if max_requests:
+      max_requests += random.randint(0, max_requests // 10)
+
+    state = {"requests": 0, "stopping": False}
+
+    def stop():
+      if not state["stopping"]:
+        state["stopping"] = True
+        gevent.spawn(server.stop, timeout=self.graceful_timeout)
+
+    def app(environ, start_response):
+      state["requests"] += 1
+      if max_requests and state["requests"] >= max_requests:
+        stop()
+      return self.app(environ, start_response)
+
+    server = WSGIServer(listener, app)
+    gevent.signal(signal.SIGTERM, stop)
+    server.start()
+
+    os.write(ready_fd, "1")
+    os.close(ready_fd)
+
+    server.serve_forever()
@@ -0,0 +1,229 @@
+"""Publish/subscribe for connections that wait on notifications, like the
+event streams of /projects/<id>/events.
+
+Every worker has a Hub that keeps the subscriptions of the connections it
+serves. Messages are published through a transport, which hands them to the
+hubs that should see them:
+
+  - LocalTransport: only the hub of the publishing process. Enough with a
+    single worker.
+  - RedisTransport: the hubs of every worker on every machine, through
+    PUBLISH and PSUBSCRIBE on the Redis server in PUBSUB_REDIS.
+
+Any object with the listen and publish methods of these can be a transport.
+
+A worker may hold thousands of idle subscriptions, so they are small: an
+event (a gevent one under gevent, which waits without polling) and a bounded
+deque of pending messages. A subscriber that falls behind loses its oldest
+messages. Messages should
+therefore say where things are (like a version) rather than what happened.
+
+Delivery is best effort. A transport that is down loses messages rather
+than failing the requests that publish them.
+"""
+
+from __future__ import absolute_import
+
+from collections import deque
+import socket
+import threading
+import time
+
+import ujson
+
+from .concurrency import new_event
+from settings import PUBSUB_REDIS, PUBSUB_QUEUE_SIZE
+
+
+class Subscription(object):
+  __slots__ = ("hub", "channel", "messages", "ready")
+
+  def __init__(self, hub, channel, queue_size):
+    self.hub = hub
+    self.channel = channel
+    self.messages = deque(maxlen=queue_size)
+    self.ready = new_event()
+
+  def put(self, message):
+    self.messages.append(message)
+    self.ready.set()
+
+  def get(self, timeout=None):
+    """Returns the pending messages, oldest first, after waiting up to
+    timeout seconds for one. Returns [] if none came."""
+    if not self.ready.wait(timeout):
+      return []
+
+    # Cleared before draining: a message put meanwhile sets it again.
+    self.ready.clear()
+    messages = []
+    while self.messages:
+      messages.append(self.messages.popleft())
+    return messages
+
+  def close(self):
+    self.hub.unsubscribe(self)
+
+
+class Hub(object):
+  def __init__(self, transport, queue_size=16):
+    self.transport = transport
+    self.queue_size = queue_size
+    self.lock = threading.Lock()
+    # channel -> set of subscriptions
+    self.channels = {}
+    self.listening = False
+
+  def subscribe(self, channel):
+    subscription = Subscription(self, channel, self.queue_size)
+    with self.lock:
+      if not self.listening:
+        # Only once something subscribes, so that it happens in the worker
+        # and not before forking, which threads don't survive.
+        self.transport.listen(self.deliver)
+        self.listening = True
+      self.channels.setdefault(channel, set()).add(subscription)
+    return subscription
+
+  def unsubscribe(self, subscription):
+    with self.lock:
+      subscriptions = self.channels.get(subscription.channel)
+      if subscriptions is not None:
+        subscriptions.discard(subscription)
+        if not subscriptions:
+          del self.channels[subscription.channel]
+
+  def subscribers(self, channel):
+    return len(self.channels.get(channel, ()))
+
+  def publish(self, channel, message):
+    """Publishes message, anything ujson can encode, on channel."""
+    self.transport.publish(channel, message)
+
+  def deliver(self, channel, message):
+    """Called by the transport for every message published on a channel."""
+    with self.lock:
+      subscriptions = list(self.channels.get(channel, ()))
+
+    for subscription in subscriptions:
+      subscription.put(message)
+
+
+class LocalTransport(object):
+  def __init__(self):
+    self.deliver = None
+
+  def listen(self, deliver):
+    self.deliver = deliver
+
+  def publish(self, channel, message):
+    if self.deliver is not None:
+      self.deliver(channel, message)
+
+
+def encode_command(*args):
+  """A command in the Redis protocol."""
+  parts = ["*{}\r\n".format(len(args))]
+  for arg in args:
+    parts.append("${}\r\n{}\r\n".format(len(arg), arg))
+  return "".join(parts)
+
+
+def read_reply(f):
+  """Reads one reply in the Redis protocol from a file. Raises IOError when
+  the connection is closed and ValueError for error replies."""
+  line = f.readline()
+  if not line.endswith("\r\n"):
+    raise IOError("connection closed")
+
+  kind, line = line[0], line[1:-2]
+  if kind == "+":
+    return line
+  elif kind == "-":
+    raise ValueError(line)
+  elif kind == ":":
+    return int(line)
+  elif kind == "$":
+    length = int(line)
+    if length < 0:
+      return None
+    data = f.read(length + 2)
+    if len(data) != length + 2:
+      raise IOError("connection closed")
+    return data[:-2]
+  elif kind == "*":
+    length = int(line)
+    if length < 0:
+      return None
+    return [read_reply(f) for _ in xrange(length)]
+
+  raise ValueError("unexpected reply {!r}".format(kind + line))
+
+
+class RedisTransport(object):
+  """Just enough of the Redis protocol for PUBLISH and PSUBSCRIBE. Channels
+  are prefixed so that one Redis can serve several deployments. Publishes
+  while the server is failing are dropped for retry_after seconds, and the
+  subscriber reconnects after as long."""
+
+  def __init__(self, address, prefix="projecto:", timeout=0.2, retry_after=5):
+    self.address = address
+    self.prefix = prefix
+    self.timeout = timeout
+    self.retry_after = retry_after
+    self.lock = threading.Lock()
+    self.conn = None
+    self.dead_until = 0
+    self.errors = 0
+
+  def publish(self, channel, message):
+    if self.dead_until > time.time():
+      return
+
+    command = encode_command("PUBLISH", self.prefix + channel, ujson.dumps(message))
+    with self.lock:
+      try:
+        if self.conn is None:
+          sock = socket.create_connection(self.address, self.timeout)
+          self.conn = (sock, sock.makefile("rb"))
+        self.conn[0].sendall(command)
+        read_reply(self.conn[1])
+      except (socket.error, IOError, ValueError):
+        self.errors += 1
+        self.dead_until = time.time() + self.retry_after
+        if self.conn is not None:
+          self.conn[0].close()
+          self.conn = None
+
+  def listen(self, deliver):
+    thread = threading.Thread(target=self._listen, args=(deliver, ))
+    thread.daemon = True
+    thread.start()
+
+  def _listen(self, deliver):
+    while True:
+      sock = None
+      try:
+        sock = socket.create_connection(self.address, self.timeout)
+        # Subscribers wait for as long as nothing is published.
+        sock.settimeout(None)
+        f = sock.makefile("rb")
+        sock.sendall(encode_command("PSUBSCRIBE", self.prefix + "*"))
+        while True:
+          reply = read_reply(f)
+          if isinstance(reply, list) and reply[0] == "pmessage":
+            deliver(reply[2][len(self.prefix):], ujson.loads(reply[3]))
+      except (socket.error, IOError, ValueError):
+        self.errors += 1
+        if sock is not None:
+          sock.close()
+        time.sleep(self.retry_after)
+
+
+def get_transport(redis_address=None):
+  if redis_address:
+    return RedisTransport(redis_address)
+  return LocalTransport()
+
+
+hub = Hub(get_transport(PUBSUB_REDIS), PUBSUB_QUEUE_SIZE)
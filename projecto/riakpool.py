@@ -0,0 +1,281 @@
+"""A Riak client that spreads load over the nodes of a cluster.
+
+The stock client picks a random node for every new connection and lets its
+connection pools grow without bound. PooledRiakClient changes that:
+
+  - At most max_size connections are in use at once per process. Further
+    requests wait for a connection to be released.
+  - Nodes are chosen round robin, or by lowest recent latency weighted by
+    requests in flight ("least_latency").
+  - A node that fails max_failures requests in a row is ejected for
+    eject_time seconds. A background checker pings every node over protocol
+    buffers and puts ejected nodes back as soon as they answer.
+  - stats() reports all of the above for monitoring.
+
+State is per process. After forking, call reset() in the child.
+"""
+
+from __future__ import absolute_import
+
+from contextlib import contextmanager
+import itertools
+import socket
+import struct
+import sys
+import threading
+import time
+
+import riak
+from riak.transports.pool import BadResource
+
+ROUND_ROBIN = "round_robin"
+LEAST_LATENCY = "least_latency"
+
+# Weight of the newest sample in the moving average of latencies.
+LATENCY_DECAY = 0.2
+
+# RpbPingReq: a message of length 1 with message code 1. The answer is a
+# RpbPingResp, message code 2.
+PING_REQUEST = struct.pack("!iB", 1, 1)
+PING_RESPONSE_CODE = 2
+
+
+class NodeStats(object):
+  def __init__(self, node):
+    self.node = node
+    self.in_flight = 0
+    self.requests = 0
+    self.failures = 0
+    self.consecutive_failures = 0
+    self.latency = None
+    self.ejected_until = 0
+
+  @property
+  def ejected(self):
+    return self.ejected_until > time.time()
+
+  def record_success(self, elapsed):
+    self.requests += 1
+    self.consecutive_failures = 0
+    if self.latency is None:
+      self.latency = elapsed
+    else:
+      self.latency += LATENCY_DECAY * (elapsed - self.latency)
+
+  def record_failure(self, max_failures, eject_time):
+    self.requests += 1
+    self.failures += 1
+    self.consecutive_failures += 1
+    if self.consecutive_failures >= max_failures:
+      self.ejected_until = time.time() + eject_time
+
+  def reinstate(self):
+    self.consecutive_failures = 0
+    self.ejected_until = 0
+
+  def score(self):
+    return (self.latency or 0) * (self.in_flight + 1)
+
+  def serialize(self):
+    return {
+      "host": self.node.host,
+      "pb_port": self.node.pb_port,
+      "in_flight": self.in_flight,
+      "requests": self.requests,
+      "failures": self.failures,
+      "latency_ms": round(self.latency * 1000, 2) if self.latency is not None else None,
+      "ejected": self.ejected,
+    }
+
+
+class BoundedPool(object):
+  """Wraps a connection pool of the client so that at most max_size
+  connections are in use at once, connections to ejected nodes are skipped,
+  and every request is timed against its node.
+
+  The client checks connections out with take(), so that is what is wrapped.
+  Everything else goes to the pool."""
+
+  def __init__(self, client, pool, max_size):
+    self._client = client
+    self._pool = pool
+    self._semaphore = threading.BoundedSemaphore(max_size)
+    self.in_use = 0
+
+  def __getattr__(self, name):
+    return getattr(self._pool, name)
+
+  def __iter__(self):
+    return iter(self._pool)
+
+  @contextmanager
+  def take(self, _filter=None, default=None):
+    client = self._client
+
+    def usable(transport):
+      if client.node_stats(transport._node).ejected:
+        return False
+      return _filter is None or _filter(transport)
+
+    with self._semaphore:
+      self.in_use += 1
+      try:
+        with self._pool.take(_filter=usable, default=default) as transport:
+          stats = client.node_stats(transport._node)
+          stats.in_flight += 1
+          start = time.time()
+          try:
+            yield transport
+          except (BadResource, socket.error, IOError):
+            client.record_failure(stats)
+            raise
+          else:
+            stats.record_success(time.time() - start)
+          finally:
+            stats.in_flight -= 1
+      finally:
+        self.in_use -= 1
+
+
+class PooledRiakClient(riak.RiakClient):
+  def __init__(self, protocol="pbc", nodes=None, min_size=1, max_size=32, balancer=ROUND_ROBIN,
+               max_failures=3, eject_time=30, health_check_interval=5, **kwargs):
+    if balancer not in (ROUND_ROBIN, LEAST_LATENCY):
+      raise ValueError("unknown balancer {!r}".format(balancer))
+
+    riak.RiakClient.__init__(self, protocol=protocol, nodes=nodes, **kwargs)
+    self.min_size = min_size
+    self.max_size = max_size
+    self.balancer = balancer
+    self.max_failures = max_failures
+    self.eject_time = eject_time
+    self.health_check_interval = health_check_interval
+    self._transport_options = kwargs.get("transport_options", {})
+    self.reset()
+
+  def reset(self):
+    """Drops all connections and statistics. Sockets must not be shared
+    between processes, so forked workers call this before doing anything
+    else."""
+    for name in ("_pb_pool", "_http_pool"):
+      pool = getattr(self, name, None)
+      if pool is None:
+        continue
+      if isinstance(pool, BoundedPool):
+        pool = pool._pool
+      # Not closing the old connections, as they belong to the parent.
+      fresh = pool.__class__(self, **self._transport_options)
+      setattr(self, name, BoundedPool(self, fresh, self.max_size))
+
+    self._stats = dict((node, NodeStats(node)) for node in self.nodes)
+    self._round_robin = itertools.cycle(self.nodes)
+    self._lock = threading.Lock()
+    self._checker = None
+
+  # Node selection
+
+  def node_stats(self, node):
+    return self._stats[node]
+
+  def healthy_nodes(self, nodes=None):
+    return [n for n in (nodes or self.nodes) if not self._stats[n].ejected]
+
+  def _choose_node(self, nodes=None):
+    self._ensure_checker()
+
+    candidates = self.healthy_nodes(nodes)
+    if not candidates:
+      # Everything is ejected. Trying a node beats failing outright.
+      candidates = list(nodes or self.nodes)
+
+    if self.balancer == LEAST_LATENCY:
+      return min(candidates, key=lambda n: self._stats[n].score())
+
+    with self._lock:
+      for _ in xrange(len(self.nodes)):
+        node = next(self._round_robin)
+        if node in candidates:
+          return node
+    return candidates[0]
+
+  def record_failure(self, stats):
+    stats.record_failure(self.max_failures, self.eject_time)
+    stats.node.error_rate.incr(1)
+
+  # Health checks
+
+  def _ensure_checker(self):
+    # Started lazily so it runs in the process that uses the client, not in a
+    # parent that forks afterwards.
+    if self._checker is not None:
+      return
+    with self._lock:
+      if self._checker is not None:
+        return
+      self._checker = threading.Thread(target=self._check_forever)
+      self._checker.daemon = True
+      self._checker.start()
+
+  def _check_forever(self):
+    self.warm()
+    while True:
+      time.sleep(self.health_check_interval)
+      self.check_nodes()
+
+  def warm(self):
+    """Opens min_size connections ahead of the first requests. Nodes that
+    cannot be reached count as failures."""
+    pool = self._choose_pool()
+    taken = []
+    try:
+      for _ in xrange(min(self.min_size, self.max_size)):
+        context = pool.take()
+        transport = context.__enter__()
+        taken.append(context)
+        try:
+          transport.ping()
+        except (socket.error, IOError):
+          # Counted by take() as it sees the error go by.
+          context.__exit__(*sys.exc_info())
+          taken.pop()
+    finally:
+      for context in reversed(taken):
+        context.__exit__(None, None, None)
+
+  def ping_node(self, node, timeout=2):
+    try:
+      sock = socket.create_connection((node.host, node.pb_port), timeout)
+      try:
+        sock.sendall(PING_REQUEST)
+        response = ""
+        while len(response) < 5:
+          chunk = sock.recv(5 - len(response))
+          if not chunk:
+            return False
+          response += chunk
+      finally:
+        sock.close()
+    except (socket.error, IOError):
+      return False
+
+    return ord(response[4]) == PING_RESPONSE_CODE
+
+  def check_nodes(self):
+    for node in self.nodes:
+      stats = self._stats[node]
+      if self.ping_node(node):
+        if stats.consecutive_failures:
+          stats.reinstate()
+      else:
+        self.record_failure(stats)
+
+  # Monitoring
+
+  def stats(self):
+    pool = self._choose_pool()
+    return {
+      "balancer": self.balancer,
+      "max_size": self.max_size,
+      "in_use": pool.in_use,
+      "nodes": [self._stats[node].serialize() for node in self.nodes],
+    }
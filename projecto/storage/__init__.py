@@ -0,0 +1,169 @@
+"""Where documents are kept.
+
+A store saves a serialized document together with its index entries under a
+key in a bucket, and answers exact or range queries on those index entries.
+BaseDocument does all of its persistence through the store selected with
+STORAGE_BACKEND:
+
+  - riak: the Riak cluster in RIAK_NODES. The default.
+  - sqlite: a single SQLite file at SQLITE_PATH, for small deployments on one
+    box that don't need a cluster.
+  - memory: a dict in the current process, for tests and benchmarks. Nothing
+    survives a restart and workers don't see each other's writes.
+
+Stores deal in buckets returned by their own `bucket`, in dictionaries that
+can be encoded as JSON and in index entries given as (field, value) pairs,
+where values are strings or integers.
+
+Besides documents, stores keep counters: integers that are only ever
+incremented, atomically, so concurrent requests never hand out the same
+value twice.
+"""
+
+from __future__ import absolute_import
+
+import base64
+import binascii
+
+from kvkit import NotFoundError
+
+from .codec import JSON
+
+# Keys per page when a store streams an index query page by page.
+STREAM_PAGE_SIZE = 1000
+
+# The Riak quorum options each kind of request takes. Stores without
+# replicas ignore them.
+READ_QUORUMS = ("r", "pr", "notfound_ok", "basic_quorum")
+WRITE_QUORUMS = ("w", "dw", "pw")
+DELETE_QUORUMS = ("rw", "r", "w", "pr", "pw", "dw")
+
+
+def _bytes(s):
+  return s.encode("utf-8") if isinstance(s, unicode) else s
+
+
+def encode_continuation(value, key):
+  """A continuation token for stores that page by the last (value, key) they
+  returned. Tokens come from clients, so they are hex, not pickles."""
+  if isinstance(value, (int, long)):
+    value = "i" + str(value)
+  else:
+    value = "s" + binascii.hexlify(_bytes(value))
+  return base64.urlsafe_b64encode(value + ":" + binascii.hexlify(_bytes(key)))
+
+
+def decode_continuation(token):
+  """Returns (value, key), or raises ValueError for a bad token."""
+  try:
+    value, key = base64.urlsafe_b64decode(str(token)).split(":")
+    key = binascii.unhexlify(key)
+    if value.startswith("i"):
+      return int(value[1:]), key
+    elif value.startswith("s"):
+      return binascii.unhexlify(value[1:]), key
+  except (TypeError, ValueError, UnicodeError):
+    pass
+
+  raise ValueError("Bad continuation {!r}".format(token))
+
+
+class Store(object):
+  def bucket(self, name):
+    """Returns what the other methods take as bucket."""
+    raise NotImplementedError
+
+  def bucket_name(self, bucket):
+    return bucket
+
+  def version(self, handle):
+    """Identifies the stored version a handle came from, if the store can."""
+    return None
+
+  def handle(self, bucket, key, version):
+    """A handle for saving key as the version `version` returned for a
+    handle of the same key, without reading it again."""
+    return None
+
+  def get(self, bucket, key, **quorum):
+    """Returns (data, handle), or raises NotFoundError. handle is passed back
+    to save when the document is saved again, so the store can keep whatever
+    it needs to know about the stored version (a vclock for Riak). quorum
+    holds READ_QUORUMS."""
+    raise NotImplementedError
+
+  def get_many(self, bucket, keys, **quorum):
+    """Returns what get would for every key, in the same order, with None
+    for keys that are not found."""
+    results = []
+    for key in keys:
+      try:
+        results.append(self.get(bucket, key, **quorum))
+      except NotFoundError:
+        results.append(None)
+    return results
+
+  def save(self, bucket, key, data, indexes, handle=None, content_type=JSON, **quorum):
+    """Replaces key with data and indexes. Returns a new handle. data is
+    encoded as content_type (see codec) and quorum holds WRITE_QUORUMS."""
+    raise NotImplementedError
+
+  def delete(self, bucket, key, **quorum):
+    """Deletes key. Deleting a key that does not exist is not an error.
+    quorum holds DELETE_QUORUMS."""
+    raise NotImplementedError
+
+  def index_keys(self, bucket, field, start, end=None):
+    """Yields the keys with an entry for field equal to start or, if end is
+    given, between start and end inclusively. Keys come ordered by value and
+    then by key, and each key only once per distinct value."""
+    raise NotImplementedError
+
+  def index_page(self, bucket, field, start, end=None, max_results=STREAM_PAGE_SIZE, continuation=None):
+    """Returns (keys, continuation) for at most max_results keys of what
+    index_keys would return, starting after the page continuation came
+    from. continuation is None after the last page. Raises ValueError for a
+    bad continuation."""
+    raise NotImplementedError
+
+  def stream_index(self, bucket, field, start, end=None):
+    """Yields what index_keys would, without holding all of it in memory."""
+    continuation = None
+    while True:
+      keys, continuation = self.index_page(bucket, field, start, end, continuation=continuation)
+      for key in keys:
+        yield key
+
+      if continuation is None:
+        return
+
+  def counter(self, bucket, key):
+    """Returns the value of a counter, 0 if it was never incremented."""
+    raise NotImplementedError
+
+  def increment(self, bucket, key, amount=1):
+    """Adds amount to a counter atomically and returns its new value."""
+    raise NotImplementedError
+
+  def keys(self, bucket):
+    """Yields every key of the bucket, in no particular order."""
+    raise NotImplementedError
+
+  def clear(self, bucket):
+    """Deletes everything in the bucket. Meant for tests."""
+    for key in list(self.keys(bucket)):
+      self.delete(bucket, key)
+
+
+def get_store(backend, riak_client=None, sqlite_path=None, concurrency=10):
+  if backend == "riak":
+    from .riak import RiakStore
+    return RiakStore(riak_client, concurrency)
+  elif backend == "sqlite":
+    from .sqlite import SQLiteStore
+    return SQLiteStore(sqlite_path)
+  elif backend == "memory":
+    from .memory import MemoryStore
+    return MemoryStore()
+
+  raise ValueError("Unknown storage backend {!r}".format(backend))
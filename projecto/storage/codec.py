@@ -0,0 +1,86 @@
+"""How documents are encoded in stores.
+
+Every stored value carries its content type, so values written with either
+encoding can be read no matter which one is used for writing:
+
+  - JSON, what kvkit always used.
+  - msgpack, which is smaller and faster to decode. String fields of at least
+    COMPRESS_MIN_SIZE bytes (such as the html and markdown of a todo) are
+    zlib compressed on top of that, as a msgpack extension type.
+
+msgpack is optional. It is only needed to write or read compact values.
+"""
+
+from __future__ import absolute_import
+
+import zlib
+
+import ujson
+
+try:
+  import msgpack
+except ImportError:
+  msgpack = None
+
+JSON = "application/json"
+MSGPACK = "application/x-msgpack"
+
+COMPRESS_MIN_SIZE = 1024
+
+# msgpack extension type of a zlib compressed utf-8 string.
+_COMPRESSED_STRING = 1
+
+
+def _require_msgpack():
+  if msgpack is None:
+    raise RuntimeError("msgpack is needed for {} values".format(MSGPACK))
+
+
+def _compress_strings(value):
+  if isinstance(value, basestring):
+    if len(value) < COMPRESS_MIN_SIZE:
+      return value
+    encoded = value.encode("utf-8") if isinstance(value, unicode) else value
+    compressed = zlib.compress(encoded)
+    if len(compressed) >= len(encoded):
+      return value
+    return msgpack.ExtType(_COMPRESSED_STRING, compressed)
+  elif isinstance(value, dict):
+    return dict((k, _compress_strings(v)) for k, v in value.iteritems())
+  elif isinstance(value, (list, tuple)):
+    return [_compress_strings(v) for v in value]
+  return value
+
+
+def _ext_hook(code, data):
+  if code == _COMPRESSED_STRING:
+    return zlib.decompress(data).decode("utf-8")
+  return msgpack.ExtType(code, data)
+
+
+def encode_msgpack(data):
+  _require_msgpack()
+  # Strings are packed as msgpack strings, so they come back as unicode like
+  # they do from JSON.
+  return msgpack.packb(_compress_strings(data), encoding="utf-8")
+
+
+def decode_msgpack(encoded):
+  _require_msgpack()
+  return msgpack.unpackb(encoded, encoding="utf-8", ext_hook=_ext_hook)
+
+
+def encode(data, content_type=JSON):
+  if content_type == MSGPACK:
+    return encode_msgpack(data)
+  elif content_type == JSON:
+    return ujson.dumps(data)
+  raise ValueError("Unknown content type {!r}".format(content_type))
+
+
+def decode(encoded, content_type=JSON):
+  if content_type == MSGPACK:
+    return decode_msgpack(encoded)
+  elif content_type == JSON:
+    return ujson.loads(encoded)
+  raise ValueError("Unknown content type {!r}".format(content_type))
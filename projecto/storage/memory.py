@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+
+import bisect
+from collections import defaultdict
+import threading
+
+from kvkit import NotFoundError
+
+from . import codec, Store, STREAM_PAGE_SIZE, encode_continuation, decode_continuation
+
+
+class MemoryStore(Store):
+  def __init__(self):
+    self.lock = threading.Lock()
+    # bucket -> key -> (content type, encoded data, indexes)
+    self.objects = defaultdict(dict)
+    # (bucket, field) -> sorted list of (value, key)
+    self.indexes = defaultdict(list)
+    # (bucket, key) -> value
+    self.counters = defaultdict(int)
+
+  def bucket(self, name):
+    return name
+
+  def get(self, bucket, key, **quorum):
+    try:
+      content_type, encoded, _ = self.objects[bucket][key]
+    except KeyError:
+      raise NotFoundError("{} not found in {}".format(key, bucket))
+    # Decoding a copy every time keeps callers from changing what's stored,
+    # like they couldn't with a real database.
+    return codec.decode(encoded, content_type), None
+
+  def save(self, bucket, key, data, indexes, handle=None, content_type=codec.JSON, **quorum):
+    entries = set(indexes)
+    encoded = codec.encode(data, content_type)
+    with self.lock:
+      self._remove(bucket, key)
+      self.objects[bucket][key] = (content_type, encoded, entries)
+      for field, value in entries:
+        bisect.insort(self.indexes[(bucket, field)], (value, key))
+
+  def delete(self, bucket, key, **quorum):
+    with self.lock:
+      self._remove(bucket, key)
+
+  def _remove(self, bucket, key):
+    stored = self.objects[bucket].pop(key, None)
+    if stored is None:
+      return
+
+    for field, value in stored[2]:
+      entries = self.indexes[(bucket, field)]
+      del entries[bisect.bisect_left(entries, (value, key))]
+
+  def index_keys(self, bucket, field, start, end=None):
+    if end is None:
+      end = start
+
+    with self.lock:
+      entries = self.indexes[(bucket, field)]
+      i = bisect.bisect_left(entries, (start, ))
+      keys = []
+      while i < len(entries) and entries[i][0] <= end:
+        keys.append(entries[i][1])
+        i += 1
+
+    return iter(keys)
+
+  def index_page(self, bucket, field, start, end=None, max_results=STREAM_PAGE_SIZE, continuation=None):
+    if end is None:
+      end = start
+
+    with self.lock:
+      entries = self.indexes[(bucket, field)]
+      i = bisect.bisect_left(entries, (start, ))
+      if continuation is not None:
+        i = max(i, bisect.bisect_right(entries, decode_continuation(continuation)))
+
+      page = []
+      while i < len(entries) and entries[i][0] <= end and len(page) < max_results + 1:
+        page.append(entries[i])
+        i += 1
+
+    # One more than asked for tells whether there is a next page.
+    if len(page) <= max_results:
+      return [key for _, key in page], None
+
+    page = page[:max_results]
+    return [key for _, key in page], encode_continuation(*page[-1])
+
+  def counter(self, bucket, key):
+    with self.lock:
+      return self.counters.get((bucket, key), 0)
+
+  def increment(self, bucket, key, amount=1):
+    with self.lock:
+      self.counters[(bucket, key)] += amount
+      return self.counters[(bucket, key)]
+
+  def keys(self, bucket):
+    with self.lock:
+      return iter(list(self.objects[bucket]))
+
+  def clear(self, bucket):
+    with self.lock:
+      self.objects.pop(bucket, None)
+      for index in [index for index in self.indexes if index[0] == bucket]:
+        del self.indexes[index]
+      for counter in [counter for counter in self.counters if counter[0] == bucket]:
+        del self.counters[counter]
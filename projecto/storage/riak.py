@@ -0,0 +1,114 @@
+from __future__ import absolute_import
+
+from contextlib import closing
+
+from kvkit import NotFoundError
+from riak.riak_object import VClock
+
+from ..concurrency import pmap
+from . import codec, Store, STREAM_PAGE_SIZE
+
+
+def index_name(field, value):
+  """Riak needs to know the type of a secondary index from its name."""
+  return field + ("_int" if isinstance(value, (int, long)) else "_bin")
+
+
+class RiakStore(Store):
+  def __init__(self, client, concurrency=10):
+    self.client = client
+    self.concurrency = concurrency
+    # Buckets known to allow counters.
+    self.counter_buckets = set()
+    # Riak keeps the content type of every value and decodes obj.data with
+    # the decoder registered for it.
+    client.set_encoder(codec.MSGPACK, codec.encode_msgpack)
+    client.set_decoder(codec.MSGPACK, codec.decode_msgpack)
+
+  def bucket(self, name):
+    return self.client.bucket(name)
+
+  def bucket_name(self, bucket):
+    return bucket.name
+
+  def version(self, handle):
+    vclock = getattr(handle, "vclock", None)
+    if vclock is None:
+      return None
+    return vclock.encode("base64").replace("\n", "")
+
+  def handle(self, bucket, key, version):
+    obj = bucket.new(key)
+    obj.vclock = VClock(version, "base64")
+    return obj
+
+  def get(self, bucket, key, **quorum):
+    obj = bucket.get(key, **quorum)
+    if not obj.exists:
+      raise NotFoundError("{} not found in {}".format(key, bucket.name))
+    return obj.data, obj
+
+  def get_many(self, bucket, keys, **quorum):
+    def get(key):
+      obj = bucket.get(key, **quorum)
+      return (obj.data, obj) if obj.exists else None
+
+    # Every fetch takes its own connection from the pool of the client.
+    return pmap(get, keys, self.concurrency)
+
+  def save(self, bucket, key, data, indexes, handle=None, content_type=codec.JSON, **quorum):
+    # Reusing the object we read keeps its vclock, so Riak knows which
+    # version this write replaces.
+    obj = handle if handle is not None else bucket.new(key)
+    obj.content_type = content_type
+    obj.data = data
+    obj.remove_index()
+    for field, value in indexes:
+      obj.add_index(index_name(field, value), value)
+    obj.store(**quorum)
+    return obj
+
+  def delete(self, bucket, key, **quorum):
+    bucket.delete(key, **quorum)
+
+  def index_keys(self, bucket, field, start, end=None):
+    return iter(bucket.get_index(index_name(field, start), start, end))
+
+  def index_page(self, bucket, field, start, end=None, max_results=STREAM_PAGE_SIZE, continuation=None):
+    page = bucket.get_index(index_name(field, start), start, end, max_results=max_results, continuation=continuation)
+    keys = list(page)
+    # Riak hands out a continuation whenever the page is full, even if
+    # nothing comes after it.
+    return keys, page.continuation if len(keys) >= max_results else None
+
+  def stream_index(self, bucket, field, start, end=None):
+    with closing(bucket.stream_index(index_name(field, start), start, end)) as stream:
+      for result in stream:
+        # Results arrive in batches.
+        if isinstance(result, list):
+          for key in result:
+            yield key
+        else:
+          yield result
+
+  def _counter_bucket(self, bucket):
+    # Riak counters only work in buckets with allow_mult. It is in
+    # BUCKET_PROPERTIES, but counters must not depend on someone having run
+    # provisionbuckets.py, so it is set the first time a process uses the
+    # bucket.
+    if bucket.name not in self.counter_buckets:
+      if not bucket.allow_mult:
+        bucket.allow_mult = True
+      self.counter_buckets.add(bucket.name)
+    return bucket
+
+  def counter(self, bucket, key):
+    return self._counter_bucket(bucket).get_counter(key) or 0
+
+  def increment(self, bucket, key, amount=1):
+    return self._counter_bucket(bucket).update_counter(key, amount, returnvalue=True)
+
+  def keys(self, bucket):
+    for keys in bucket.stream_keys():
+      for key in keys:
+        yield key
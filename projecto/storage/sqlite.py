@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+
+import sqlite3
+import threading
+
+from kvkit import NotFoundError
+
+from . import codec, Store, STREAM_PAGE_SIZE, encode_continuation, decode_continuation
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+  bucket TEXT NOT NULL,
+  key TEXT NOT NULL,
+  data BLOB NOT NULL,
+  content_type TEXT NOT NULL DEFAULT 'application/json',
+  PRIMARY KEY (bucket, key)
+);
+
+CREATE TABLE IF NOT EXISTS indexes (
+  bucket TEXT NOT NULL,
+  field TEXT NOT NULL,
+  value NOT NULL,
+  key TEXT NOT NULL,
+  PRIMARY KEY (bucket, field, value, key)
+);
+
+CREATE INDEX IF NOT EXISTS indexes_by_key ON indexes (bucket, key);
+
+CREATE TABLE IF NOT EXISTS counters (
+  bucket TEXT NOT NULL,
+  key TEXT NOT NULL,
+  value INTEGER NOT NULL,
+  PRIMARY KEY (bucket, key)
+);
+"""
+
+
+class SQLiteStore(Store):
+  """Keeps everything in one SQLite database. Writes go through one
+  connection guarded by a lock, which is plenty for a single box. Index values
+  are compared bytewise like Riak does."""
+
+  def __init__(self, path):
+    self.lock = threading.Lock()
+    self.conn = sqlite3.connect(path, check_same_thread=False)
+    self.conn.text_factory = str
+    self.conn.execute("PRAGMA journal_mode=WAL")
+    self.conn.execute("PRAGMA synchronous=NORMAL")
+    self.conn.executescript(SCHEMA)
+
+    # Databases created before values carried a content type only hold JSON.
+    columns = [row[1] for row in self.conn.execute("PRAGMA table_info(objects)")]
+    if "content_type" not in columns:
+      self.conn.execute("ALTER TABLE objects ADD COLUMN content_type TEXT NOT NULL DEFAULT 'application/json'")
+
+  def bucket(self, name):
+    return name
+
+  def get(self, bucket, key, **quorum):
+    with self.lock:
+      row = self.conn.execute("SELECT data, content_type FROM objects WHERE bucket = ? AND key = ?", (bucket, key)).fetchone()
+
+    if row is None:
+      raise NotFoundError("{} not found in {}".format(key, bucket))
+    return codec.decode(str(row[0]), row[1]), None
+
+  def get_many(self, bucket, keys, **quorum):
+    keys = list(keys)
+    found = {}
+    with self.lock:
+      # SQLite allows at most 999 parameters per statement.
+      for i in xrange(0, len(keys), 500):
+        chunk = keys[i:i+500]
+        rows = self.conn.execute(
+          "SELECT key, data, content_type FROM objects WHERE bucket = ? AND key IN ({})".format(", ".join("?" * len(chunk))),
+          [bucket] + chunk
+        )
+        found.update((key, (data, content_type)) for key, data, content_type in rows)
+
+    return [(codec.decode(str(found[key][0]), found[key][1]), None) if key in found else None for key in keys]
+
+  def save(self, bucket, key, data, indexes, handle=None, content_type=codec.JSON, **quorum):
+    # msgpack is binary, so values go in as blobs. Older JSON values are
+    # text, which str() reads back the same.
+    encoded = sqlite3.Binary(codec.encode(data, content_type))
+    with self.lock, self.conn:
+      self.conn.execute("INSERT OR REPLACE INTO objects (bucket, key, data, content_type) VALUES (?, ?, ?, ?)",
+                        (bucket, key, encoded, content_type))
+      self.conn.execute("DELETE FROM indexes WHERE bucket = ? AND key = ?", (bucket, key))
+      self.conn.executemany(
+        "INSERT OR IGNORE INTO indexes (bucket, field, value, key) VALUES (?, ?, ?, ?)",
+        [(bucket, field, value, key) for field, value in indexes]
+      )
+
+  def delete(self, bucket, key, **quorum):
+    with self.lock, self.conn:
+      self.conn.execute("DELETE FROM objects WHERE bucket = ? AND key = ?", (bucket, key))
+      self.conn.execute("DELETE FROM indexes WHERE bucket = ? AND key = ?", (bucket, key))
+
+  def index_keys(self, bucket, field, start, end=None):
+    if end is None:
+      end = start
+
+    with self.lock:
+      rows = self.conn.execute(
+        "SELECT key FROM indexes WHERE bucket = ? AND field = ? AND value BETWEEN ? AND ? ORDER BY value, key",
+        (bucket, field, start, end)
+      ).fetchall()
+    return (row[0] for row in rows)
+
+  def index_page(self, bucket, field, start, end=None, max_results=STREAM_PAGE_SIZE, continuation=None):
+    if end is None:
+      end = start
+
+    query = "SELECT value, key FROM indexes WHERE bucket = ? AND field = ? AND value BETWEEN ? AND ?"
+    params = [bucket, field, start, end]
+    if continuation is not None:
+      value, key = decode_continuation(continuation)
+      query += " AND (value > ? OR (value = ? AND key > ?))"
+      params += [value, value, key]
+    query += " ORDER BY value, key LIMIT ?"
+    # One more than asked for tells whether there is a next page.
+    params.append(max_results + 1)
+
+    with self.lock:
+      page = self.conn.execute(query, params).fetchall()
+
+    if len(page) <= max_results:
+      return [page_key for _, page_key in page], None
+
+    page = page[:max_results]
+    return [page_key for _, page_key in page], encode_continuation(*page[-1])
+
+  def counter(self, bucket, key):
+    with self.lock:
+      row = self.conn.execute("SELECT value FROM counters WHERE bucket = ? AND key = ?", (bucket, key)).fetchone()
+    return row[0] if row is not None else 0
+
+  def increment(self, bucket, key, amount=1):
+    with self.lock, self.conn:
+      self.conn.execute("INSERT OR IGNORE INTO counters (bucket, key, value) VALUES (?, ?, 0)", (bucket, key))
+      self.conn.execute("UPDATE counters SET value = value + ? WHERE bucket = ? AND key = ?", (amount, bucket, key))
+      return self.conn.execute("SELECT value FROM counters WHERE bucket = ? AND key = ?", (bucket, key)).fetchone()[0]
+
+  def keys(self, bucket):
+    with self.lock:
+      rows = self.conn.execute("SELECT key FROM objects WHERE bucket = ?", (bucket, )).fetchall()
+    return (row[0] for row in rows)
+
+  def clear(self, bucket):
+    with self.lock, self.conn:
+      self.conn.execute("DELETE FROM objects WHERE bucket = ?", (bucket, ))
+      self.conn.execute("DELETE FROM indexes WHERE bucket = ?", (bucket, ))
+      self.conn.execute("DELETE FROM counters WHERE bucket = ?", (bucket, ))
@@ -1,7 +1,7 @@
 import errno
 import os
 
-from flask import current_app, abort
+from flask import current_app, abort, request, stream_with_context
 import ujson
 import werkzeug.utils
 
@@ -24,25 +24,116 @@ def jsonify(**params):
   return response
 
 
+# Bytes of JSON gathered before a streamed response writes them out.
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def _stream_json(params):
+  chunk = []
+  size = 0
+  for part in _json_parts(params):
+    chunk.append(part)
+    size += len(part)
+    if size >= STREAM_CHUNK_SIZE:
+      yield "".join(chunk)
+      chunk = []
+      size = 0
+
+  if chunk:
+    yield "".join(chunk)
+
+
+def _json_parts(params):
+  yield "{"
+  for i, (name, value) in enumerate(params.iteritems()):
+    yield ("," if i else "") + ujson.dumps(name) + ":"
+    # Iterators, not lists: those are encoded in one go like jsonify does.
+    if hasattr(value, "next"):
+      yield "["
+      for j, item in enumerate(value):
+        yield ("," if j else "") + ujson.dumps(item)
+      yield "]"
+    else:
+      yield ujson.dumps(value)
+  yield "}"
+
+
+def stream_jsonify(**params):
+  """Like jsonify, but values that are iterators (such as generators over
+  index queries) are encoded as lists one item at a time, while the response
+  is being sent. Neither the items nor their JSON have to be held in memory
+  at once and the first bytes go out before the last items are read.
+
+  The status is sent before the iterators run, so an error in one of them
+  can only cut the response short. Check what can fail (permissions, 404s)
+  before returning."""
+  return current_app.response_class(stream_with_context(_stream_json(params)), mimetype="application/json")
+
+
+def requested_fields(available):
+  """The set of fields asked for with ?fields=a,b,c, or None when the
+  parameter is not given (and so everything is wanted). Aborts with 400 for
+  fields not in available."""
+  fields = request.args.get("fields")
+  if fields is None:
+    return None
+
+  fields = set(field.strip() for field in fields.split(",") if field.strip())
+  if not fields <= set(available):
+    return abort(400)
+  return fields
+
+
+def select_fields(items, fields):
+  """Strips items (dicts) down to fields and their key. fields of None keeps
+  everything."""
+  if fields is None:
+    return items
+  return [dict((name, value) for name, value in item.iteritems() if name in fields or name == "key") for item in items]
+
+
 # Project access control helpers
 
 from functools import wraps
 from kvkit import NotFoundError
 from flask.ext.login import current_user
-from .models import Project, User
+from .changes import record
+from .models import Project, STRICT_WRITE, load_users, raise_errors, request_users
 
 
 def hook_user_to_projects(user):
+  changed = {}
   for email in user.emails:
     for project in Project.index("unregistered_owners", email):
+      project = changed.setdefault(project.key, project)
       project.unregistered_owners.remove(email)
       project.owners.append(user.key)
-      project.save()
 
     for project in Project.index("unregistered_collaborators", email):
+      project = changed.setdefault(project.key, project)
       project.unregistered_collaborators.remove(email)
       project.collaborators.append(user.key)
-      project.save()
+
+  raise_errors(Project.save_many(changed.values(), **STRICT_WRITE))
+  for key in changed:
+    record(key, "project", key, "save")
+
+
+def is_project_member(user, project, owners_only=False):
+  """Checks if user is an owner (or a collaborator, unless owners_only) of
+  project."""
+  userkeys = project.owners if owners_only else project.owners + project.collaborators
+  if user.key in userkeys:
+    return True
+
+  members = load_users(request_users(), userkeys)
+  emails = set(user.emails)
+  for key in userkeys:
+    member = members.get(key)
+    if member is not None and emails.intersection(member.emails):
+      return True
+
+  return False
 
 
 def project_access_required(fn):
@@ -65,19 +156,12 @@ def project_access_required(fn):
       return abort(403)
 
     try:
-      project = Project.get(project_id)
+      project = Project.get(project_id, cached=False)
     except NotFoundError:
       return abort(404)
 
-    # Move users from unregistered to registered if found.
-    for email in current_user.emails:
-      for userkey in project.owners:
-        if email in User.get(userkey).emails:
-          return fn(project=project, *args, **kwargs)
-
-      for userkey in project.collaborators:
-        if email in User.get(userkey).emails:
-          return fn(project=project, *args, **kwargs)
+    if is_project_member(current_user, project):
+      return fn(project=project, *args, **kwargs)
 
     return abort(403)
   return wrapped
@@ -92,19 +176,16 @@ def project_managers_required(fn):
       return abort(403)
 
     try:
-      project = Project.get(project_id)
+      project = Project.get(project_id, cached=False)
     except NotFoundError:
       return abort(404)
 
-    for email in current_user.emails:
-      for userkey in project.owners:
-        if email in User.get(userkey).emails:
-          return fn(project=project, *args, **kwargs)
+    if is_project_member(current_user, project, owners_only=True):
+      return fn(project=project, *args, **kwargs)
 
     return abort(403)
   return wrapped
 
-from flask import request
 from kvkit import ValidationError
 
 def ensure_good_request(required_parameters, accepted_parameters=None, allow_json_none=False):
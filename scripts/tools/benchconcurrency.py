@@ -0,0 +1,115 @@
+"""Measures how throughput of a running server changes with in-flight requests.
+
+Each concurrency level keeps that many requests in flight (one keep-alive
+connection per client thread) for a fixed duration, then reports requests per
+second and latency percentiles. Point it at an endpoint that talks to Riak:
+
+  python scripts/tools/benchconcurrency.py \\
+      http://127.0.0.1:8800/api/v1/projects/ --cookie "session=..."
+
+A cooperative server shows requests per second growing with concurrency until
+Riak or the CPU saturates. A server that blocks on its sockets stays flat and
+only gets slower per request.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import httplib
+import sys
+import threading
+import time
+import urlparse
+
+
+def percentile(sorted_values, p):
+  if not sorted_values:
+    return 0.0
+  return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def client(url, headers, deadline, latencies, errors):
+  conn_cls = httplib.HTTPSConnection if url.scheme == "https" else httplib.HTTPConnection
+  conn = None
+  path = url.path or "/"
+  if url.query:
+    path += "?" + url.query
+
+  while time.time() < deadline:
+    if conn is None:
+      conn = conn_cls(url.hostname, url.port, timeout=30)
+
+    start = time.time()
+    try:
+      conn.request("GET", path, headers=headers)
+      response = conn.getresponse()
+      response.read()
+    except (httplib.HTTPException, IOError):
+      errors.append(1)
+      conn.close()
+      conn = None
+      continue
+
+    if response.status >= 400:
+      errors.append(1)
+    else:
+      latencies.append(time.time() - start)
+
+  if conn is not None:
+    conn.close()
+
+
+def run_level(url, headers, concurrency, duration):
+  latencies = []
+  errors = []
+  deadline = time.time() + duration
+  threads = [threading.Thread(target=client, args=(url, headers, deadline, latencies, errors)) for _ in xrange(concurrency)]
+
+  start = time.time()
+  for t in threads:
+    t.daemon = True
+    t.start()
+  for t in threads:
+    t.join()
+  elapsed = time.time() - start
+
+  latencies.sort()
+  return {
+    "concurrency": concurrency,
+    "rps": len(latencies) / elapsed,
+    "p50": percentile(latencies, 0.5) * 1000,
+    "p99": percentile(latencies, 0.99) * 1000,
+    "errors": len(errors),
+  }
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Benchmarks throughput against in-flight requests.")
+  parser.add_argument("url")
+  parser.add_argument("--levels", default="1,2,4,8,16,32,64", help="comma separated concurrency levels")
+  parser.add_argument("--duration", type=float, default=10.0, help="seconds per level")
+  parser.add_argument("--cookie", help="Cookie header to send, e.g. a logged in session")
+  args = parser.parse_args()
+
+  url = urlparse.urlparse(args.url)
+  headers = {"Connection": "keep-alive"}
+  if args.cookie:
+    headers["Cookie"] = args.cookie
+
+  results = []
+  print "{:>11} {:>10} {:>10} {:>10} {:>8}".format("concurrency", "req/s", "p50 ms", "p99 ms", "errors")
+  for level in [int(l) for l in args.levels.split(",")]:
+    r = run_level(url, headers, level, args.duration)
+    results.append(r)
+    print "{concurrency:>11} {rps:>10.1f} {p50:>10.1f} {p99:>10.1f} {errors:>8}".format(**r)
+
+  if len(results) > 1 and results[0]["rps"] > 0:
+    print
+    print "Throughput at {} in flight is {:.1f}x that of {} in flight.".format(
+      results[-1]["concurrency"], results[-1]["rps"] / results[0]["rps"], results[0]["concurrency"])
+
+  return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
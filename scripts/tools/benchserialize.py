@@ -0,0 +1,79 @@
+"""Measures what serializing todos for the client costs per todo.
+
+Builds --count todos in memory (nothing is stored, but settings are loaded,
+so run it with STORAGE_BACKEND=memory) and times three ways of turning them
+into what the todo lists send, per todo:
+
+  - kvkit: doc.serialize(restricted=..., include_key=True)
+  - compiled: the serializer of the class, see BaseDocument.serializer
+  - projection: Projection.serialize, what the list endpoints use
+
+  STORAGE_BACKEND=memory python scripts/tools/benchserialize.py --count 1000
+"""
+
+from __future__ import absolute_import
+
+import argparse
+from datetime import datetime
+import sys
+import time
+
+from projecto.apiv1.todos.models import Todo
+from projecto.models import User
+
+RESTRICTED = ("parent", "author")
+
+
+def make_todos(count):
+  author = User(key="author", data={"name": "Author", "emails": ["author@example.com"]})
+  todos = []
+  for i in xrange(count):
+    todo = Todo(key="todo{}".format(i), data={
+      "title": "Todo number {}".format(i),
+      "content": {"markdown": "Some *markdown*", "html": "<p>Some <em>markdown</em></p>"},
+      "date": datetime.now(),
+      "tags": ["a", "b"],
+      "done": i % 2 == 0,
+      "parent": "project",
+    })
+    todo.author = author
+    todos.append(todo)
+  return todos
+
+
+def timed(fn, items, repeat):
+  best = None
+  for _ in xrange(repeat):
+    start = time.time()
+    for item in items:
+      fn(item)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Times serializing todos for the client.")
+  parser.add_argument("--count", type=int, default=1000)
+  parser.add_argument("--repeat", type=int, default=5, help="runs per method, the best one counts (default: 5)")
+  args = parser.parse_args()
+
+  todos = make_todos(args.count)
+  compiled = Todo.serializer(RESTRICTED, include_key=True)
+  projection = Todo.projection(Todo.list_fields())
+  projections = [projection(todo.key, todo.serialize()) for todo in todos]
+
+  results = [
+    ("kvkit", timed(lambda todo: todo.serialize(restricted=RESTRICTED, include_key=True), todos, args.repeat)),
+    ("compiled", timed(compiled, todos, args.repeat)),
+    ("projection", timed(lambda item: item.serialize(include_key=True), projections, args.repeat)),
+  ]
+
+  print "{} todos, best of {} runs:".format(args.count, args.repeat)
+  for name, elapsed in results:
+    print "  {:<12}{:>10.2f} us/todo{:>10.1f} ms total".format(name, elapsed / args.count * 1e6, elapsed * 1000)
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
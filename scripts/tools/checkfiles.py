@@ -0,0 +1,202 @@
+"""Checks that the files bucket and FILES_FOLDER agree with each other.
+
+Bucket keys are streamed from the store while FILES_FOLDER is walked at the same
+time. Both sides are fed through bounded queues into pools of checkers, so
+memory use does not depend on how many files there are.
+
+  - dangling: metadata in the bucket without anything on disk.
+  - orphan: something on disk without metadata in the bucket.
+
+With --repair, dangling metadata is deleted and orphans are adopted by the
+first owner of their project. Orphans of projects that no longer exist are
+moved into FILES_FOLDER/.lost+found.
+
+With --reindex, the search fields of every file that checks out are rewritten.
+This is needed once for files saved before the filename search existed.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import os
+import Queue
+import sys
+import threading
+
+from kvkit import NotFoundError
+
+from projecto.models import Project, User
+from projecto.apiv1.files.models import File
+import settings
+
+QUEUE_SIZE = 1000
+LOST_AND_FOUND = ".lost+found"
+
+_DONE = object()
+
+
+class Checker(object):
+  def __init__(self, files_folder, workers=8, repair=False, reindex=False, out=sys.stdout):
+    self.files_folder = files_folder
+    self.workers = workers
+    self.repair = repair
+    self.reindex = reindex
+    self.out = out
+
+    self.lock = threading.Lock()
+    self.counts = {"keys": 0, "paths": 0, "dangling": 0, "orphan": 0, "repaired": 0, "reindexed": 0, "error": 0}
+
+  def report(self, kind, item, repaired=False):
+    with self.lock:
+      self.counts[kind] += 1
+      if repaired:
+        self.counts["repaired"] += 1
+      self.out.write("{}{} {}\n".format(kind, " (repaired)" if repaired else "", item))
+
+  def count(self, kind):
+    with self.lock:
+      self.counts[kind] += 1
+
+  # Producers
+
+  def stream_keys(self, q):
+    try:
+      for key in File.keys():
+        q.put(key)
+    finally:
+      for _ in xrange(self.workers):
+        q.put(_DONE)
+
+  def walk_files_folder(self, q):
+    try:
+      for project_key in os.listdir(self.files_folder):
+        # Skips version history and the lost and found.
+        if project_key.startswith("."):
+          continue
+
+        base_dir = os.path.join(self.files_folder, project_key)
+        if not os.path.isdir(base_dir):
+          continue
+
+        l = len(base_dir)
+        for root, subdirs, filenames in os.walk(base_dir):
+          root = root[l:]
+          for dirname in subdirs:
+            q.put((project_key, root + "/" + dirname + "/"))
+          for fname in filenames:
+            q.put((project_key, root + "/" + fname))
+    finally:
+      for _ in xrange(self.workers):
+        q.put(_DONE)
+
+  # Consumers
+
+  def _exists_on_disk(self, project_key, path):
+    fspath = os.path.join(self.files_folder, project_key, path[1:])
+    if path.endswith("/"):
+      return os.path.isdir(fspath)
+    return os.path.isfile(fspath)
+
+  def _exists_in_bucket(self, key):
+    try:
+      File.get(key)
+    except NotFoundError:
+      return False
+    return True
+
+  def check_key(self, key):
+    self.count("keys")
+    project_key, _, path = key.partition("`")
+    if project_key and path.startswith("/") and self._exists_on_disk(project_key, path):
+      if self.reindex:
+        File.get(key).reindex()
+        self.count("reindexed")
+      return
+
+    # Check again in case we raced with a save or a delete.
+    repaired = False
+    if self.repair and self._exists_in_bucket(key) and not (project_key and self._exists_on_disk(project_key, path)):
+      File.delete_key(key)
+      repaired = True
+
+    self.report("dangling", key, repaired)
+
+  def check_path(self, project_key, path):
+    self.count("paths")
+    key = project_key + "`" + path
+    if self._exists_in_bucket(key):
+      return
+
+    repaired = False
+    if self.repair and self._exists_on_disk(project_key, path) and not self._exists_in_bucket(key):
+      self.adopt(project_key, path, key)
+      repaired = True
+
+    self.report("orphan", key, repaired)
+
+  def adopt(self, project_key, path, key):
+    try:
+      project = Project.get(project_key)
+      author = User.get(project.owners[0])
+    except (NotFoundError, IndexError):
+      fspath = os.path.join(self.files_folder, project_key, path[1:])
+      os.renames(fspath, os.path.join(self.files_folder, LOST_AND_FOUND, project_key, path[1:]))
+    else:
+      File(key=key, data={"project": project, "author": author}).save()
+
+  def consume(self, q, fn):
+    while True:
+      item = q.get()
+      if item is _DONE:
+        return
+
+      try:
+        if isinstance(item, tuple):
+          fn(*item)
+        else:
+          fn(item)
+      except Exception as e:
+        self.report("error", "{!r}: {}".format(item, e))
+
+  def run(self):
+    keys = Queue.Queue(maxsize=QUEUE_SIZE)
+    paths = Queue.Queue(maxsize=QUEUE_SIZE)
+
+    threads = [
+      threading.Thread(target=self.stream_keys, args=(keys, )),
+      threading.Thread(target=self.walk_files_folder, args=(paths, )),
+    ]
+    for _ in xrange(self.workers):
+      threads.append(threading.Thread(target=self.consume, args=(keys, self.check_key)))
+      threads.append(threading.Thread(target=self.consume, args=(paths, self.check_path)))
+
+    for t in threads:
+      t.daemon = True
+      t.start()
+
+    for t in threads:
+      # join with a timeout so KeyboardInterrupt still works.
+      while t.is_alive():
+        t.join(1)
+
+    return self.counts
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Checks the files bucket against FILES_FOLDER.")
+  parser.add_argument("--repair", action="store_true", help="fix mismatches instead of only reporting them")
+  parser.add_argument("--reindex", action="store_true", help="rewrite the filename search fields of every file")
+  parser.add_argument("--workers", type=int, default=8, help="concurrent checkers per side (default: 8)")
+  parser.add_argument("--files-folder", default=settings.FILES_FOLDER)
+  args = parser.parse_args()
+
+  File.FILES_FOLDER = args.files_folder
+  counts = Checker(args.files_folder, workers=args.workers, repair=args.repair, reindex=args.reindex).run()
+
+  print "Checked {keys} keys and {paths} paths: {dangling} dangling, {orphan} orphans, {error} errors, {repaired} repaired, {reindexed} reindexed.".format(**counts)
+  problems = counts["dangling"] + counts["orphan"] + counts["error"] - counts["repaired"]
+  return 1 if problems else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -1,12 +1,8 @@
-import riak
-import settings
+from projecto.models import Signup
 
 if __name__ == "__main__":
-  rc = riak.RiakClient(protocol="pbc", nodes=settings.RIAK_NODES)
-  signup_bucket = rc.bucket(settings.DATABASES["signups"])
-
   l = 0
-  for email in signup_bucket.stream_keys():
+  for email in Signup.keys():
     print email
     l += 1
 
@@ -0,0 +1,81 @@
+"""Compares the properties of the Riak buckets with BUCKET_PROPERTIES in
+settings and, with --apply, sets the ones that differ.
+
+Every difference is printed as
+
+  <bucket> <property>: <live value> -> <wanted value>
+
+and the exit status is 1 as long as differences remain, so this can also be
+used to check a cluster.
+
+Changing the n_val of a bucket that holds data leaves existing objects with
+fewer (or more) replicas than reads expect until they are rewritten, so n_val
+is only changed with --allow-n-val.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import sys
+
+from projecto.models import rc
+import settings
+
+
+def diff_properties(wanted, live):
+  """Returns {property: (live value, wanted value)} for everything in wanted
+  that the live properties don't match."""
+  changes = {}
+  for name, value in sorted(wanted.iteritems()):
+    if live.get(name) != value:
+      changes[name] = (live.get(name), value)
+  return changes
+
+
+def provision(client, apply=False, allow_n_val=False, out=sys.stdout):
+  """Returns the number of differences left on the cluster."""
+  remaining = 0
+  for name, wanted in sorted(settings.BUCKET_PROPERTIES.iteritems()):
+    bucket = client.bucket(settings.DATABASES[name])
+    changes = diff_properties(wanted, bucket.get_properties())
+
+    for prop, (live, value) in sorted(changes.iteritems()):
+      out.write("{} {}: {!r} -> {!r}\n".format(bucket.name, prop, live, value))
+
+    if apply and "n_val" in changes and not allow_n_val:
+      out.write("{} n_val: not changed without --allow-n-val\n".format(bucket.name))
+      remaining += 1
+      del changes["n_val"]
+
+    if not changes:
+      continue
+
+    if apply:
+      bucket.set_properties(dict((prop, value) for prop, (_, value) in changes.iteritems()))
+      out.write("{}: applied\n".format(bucket.name))
+    else:
+      remaining += len(changes)
+
+  return remaining
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Diffs (and applies) BUCKET_PROPERTIES against the Riak cluster.")
+  parser.add_argument("--apply", action="store_true", help="set the properties that differ")
+  parser.add_argument("--allow-n-val", action="store_true", help="also change n_val of existing buckets")
+  args = parser.parse_args()
+
+  if settings.STORAGE_BACKEND != "riak":
+    print "STORAGE_BACKEND is {!r}, there are no buckets to provision.".format(settings.STORAGE_BACKEND)
+    return 0
+
+  remaining = provision(rc, apply=args.apply, allow_n_val=args.allow_n_val)
+  if remaining:
+    print "{} differences left.".format(remaining)
+  else:
+    print "All buckets are up to date."
+  return 1 if remaining else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,89 @@
+"""Rewrites stored documents in the encoding their class currently uses.
+
+Run this after turning COMPACT_ENCODING on (or off) to convert existing
+values. Documents are read and written back unchanged, apart from the
+encoding. Keys are streamed and handled --batch-size at a time, with a
+--pause between batches to keep the load on the cluster down, so this can
+run in the background against a live site.
+
+Every document is written back right after it is read, with the vclock it
+was read with. A save made by the site in between can still be lost, so
+prefer quiet hours for busy buckets.
+"""
+
+from __future__ import absolute_import
+
+import argparse
+import sys
+import time
+
+from kvkit import NotFoundError
+
+from projecto.concurrency import batches, pmap
+from projecto.models import BaseDocument, store
+from projecto.apiv1.files.models import File
+from projecto.apiv1.todos.models import Todo, ArchivedTodo
+import settings
+
+MODELS = {
+  "todos": Todo,
+  "archived_todos": ArchivedTodo,
+  "files": File,
+}
+
+
+def rewrite(cls, batch_size=100, pause=0.0, out=sys.stdout):
+  """Returns (rewritten, errors)."""
+  rewritten = errors = 0
+  bucket = cls._riak_options["bucket"]
+
+  def rewrite_key(key):
+    try:
+      # Straight from the store rather than cls.get, so that a cached
+      # document doesn't lose its vclock.
+      doc = cls._from_store(key, *store.get(bucket, key))
+      # Not doc.save, which can do more than store the document (File.save
+      # touches the file system).
+      BaseDocument.save(doc)
+    except NotFoundError:
+      return None
+    except Exception as e:
+      out.write("error {}: {}\n".format(key, e))
+      return False
+    return True
+
+  for keys in batches(cls.keys(), batch_size):
+    results = pmap(rewrite_key, keys, settings.BULK_WRITE_CONCURRENCY)
+    rewritten += results.count(True)
+    errors += results.count(False)
+
+    out.write("{}: {} rewritten, {} errors\n".format(store.bucket_name(bucket), rewritten, errors))
+    if pause:
+      time.sleep(pause)
+
+  return rewritten, errors
+
+
+def main():
+  parser = argparse.ArgumentParser(description="Rewrites documents in the encoding their class uses now.")
+  parser.add_argument("models", nargs="*", metavar="model",
+                      help="any of {} (default: all)".format(", ".join(sorted(MODELS))))
+  parser.add_argument("--batch-size", type=int, default=100)
+  parser.add_argument("--pause", type=float, default=0.5, help="seconds to wait between batches (default: 0.5)")
+  args = parser.parse_args()
+  for name in args.models:
+    if name not in MODELS:
+      parser.error("unknown model {!r}".format(name))
+
+  failed = 0
+  for name in args.models or sorted(MODELS):
+    cls = MODELS[name]
+    print "Rewriting {} as {}.".format(name, cls._content_type())
+    _, errors = rewrite(cls, batch_size=args.batch_size, pause=args.pause)
+    failed += errors
+
+  return 1 if failed else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
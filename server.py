@@ -1,14 +1,35 @@
 from __future__ import absolute_import
 
+from settings import (
+  DEBUG, HOST, PORT, FS_THREADPOOL_SIZE,
+  WORKERS, WORKER_MAX_REQUESTS, GRACEFUL_TIMEOUT, REUSEPORT,
+)
+
+if __name__ == "__main__" and not DEBUG:
+  # This has to happen before anything imports socket, threading or ssl.
+  # Otherwise the Riak client and requests (used for Persona) keep blocking
+  # sockets and every call they make stalls the whole worker.
+  from gevent import monkey
+  monkey.patch_all()
+
 from projecto import app
-from settings import DEBUG, HOST, PORT
+from projecto.concurrency import setup_threadpool
 
 if __name__ == "__main__":
   if DEBUG:
     app.run(debug=True, host="", port=PORT)
   else:
-    from gevent.wsgi import WSGIServer
     from werkzeug.contrib.fixers import ProxyFix
     app.wsgi_app = ProxyFix(app.wsgi_app)
-    server = WSGIServer((HOST, PORT), app)
-    server.serve_forever()
+    if WORKERS > 1 or WORKER_MAX_REQUESTS:
+      from projecto.prefork import Arbiter
+      Arbiter(app, HOST, PORT, WORKERS,
+              max_requests=WORKER_MAX_REQUESTS,
+              reuseport=REUSEPORT,
+              graceful_timeout=GRACEFUL_TIMEOUT,
+              post_fork=lambda: setup_threadpool(FS_THREADPOOL_SIZE)).run()
+    else:
+      from gevent.wsgi import WSGIServer
+      setup_threadpool(FS_THREADPOOL_SIZE)
+      server = WSGIServer((HOST, PORT), app)
+      server.serve_forever()
@@ -9,17 +9,100 @@ SERVER_MODE = os.environ.get("SERVER_MODE", "dev")
 HOST = os.environ.get("HOST", "127.0.0.1")
 PORT = os.environ.get("PORT", 8800)
 
+# Threads used by the production server for blocking file system calls, so
+# that slow disks don't stall every other request in the worker.
+FS_THREADPOOL_SIZE = int(os.environ.get("FS_THREADPOOL_SIZE", 10))
+
+# Pre-fork server mode (production only). With more than one worker, each one
+# is a separate process running its own gevent server. Workers are replaced
+# after WORKER_MAX_REQUESTS requests (0 to never replace them) and have
+# GRACEFUL_TIMEOUT seconds to finish in-flight requests on restart. With
+# REUSEPORT, workers bind their own sockets with SO_REUSEPORT instead of
+# sharing one.
+WORKERS = int(os.environ.get("WORKERS", 1))
+WORKER_MAX_REQUESTS = int(os.environ.get("WORKER_MAX_REQUESTS", 0))
+GRACEFUL_TIMEOUT = int(os.environ.get("GRACEFUL_TIMEOUT", 30))
+REUSEPORT = bool(int(os.environ.get("REUSEPORT", 0)))
+
+# gzip/deflate level of responses (1-9, 0 turns compression off) and the
+# smallest response worth compressing, in bytes.
+COMPRESSION_LEVEL = int(os.environ.get("COMPRESSION_LEVEL", 6))
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", 1024))
+# Responses longer than this many bytes are compressed as they are sent
+# instead of in one go.
+COMPRESSION_MAX_BUFFER = int(os.environ.get("COMPRESSION_MAX_BUFFER", 1024 * 1024))
+
 APP_FOLDER = os.path.dirname(os.path.abspath(__file__))
 STATIC_FOLDER = os.path.join(APP_FOLDER, "static")
 TEMPLATES_FOLDER = os.path.join(APP_FOLDER, "templates")
 FILES_FOLDER = os.path.join(APP_FOLDER, "userfiles")
 
+# Where documents are stored: "riak", "sqlite" (a single file at SQLITE_PATH,
+# for small deployments on one box) or "memory" (for tests and benchmarks,
+# nothing is kept across restarts).
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "riak")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(APP_FOLDER, "projecto.sqlite3"))
+
+# A comma separated list of host:pb_port in the environment overrides this.
 RIAK_NODES = [
   {
     "host": "127.0.0.1",
     "pb_port": 8087
   }
 ]
+if os.environ.get("RIAK_NODES"):
+  RIAK_NODES = [
+    {"host": host, "pb_port": int(port)}
+    for host, _, port in (n.strip().partition(":") for n in os.environ["RIAK_NODES"].split(","))
+  ]
+
+# Connections to Riak, per worker process. RIAK_BALANCER is "round_robin" or
+# "least_latency". A node is ejected for RIAK_EJECT_TIME seconds after
+# RIAK_MAX_FAILURES failures in a row and every node is pinged every
+# RIAK_HEALTH_CHECK_INTERVAL seconds.
+RIAK_POOL_MIN_SIZE = int(os.environ.get("RIAK_POOL_MIN_SIZE", 1))
+RIAK_POOL_MAX_SIZE = int(os.environ.get("RIAK_POOL_MAX_SIZE", 32))
+RIAK_BALANCER = os.environ.get("RIAK_BALANCER", "round_robin")
+RIAK_MAX_FAILURES = 3
+RIAK_EJECT_TIME = 30
+RIAK_HEALTH_CHECK_INTERVAL = 5
+
+# When set, /_status/* answers requests with this in an X-Status-Token
+# header. When not, only direct (not proxied) requests from the same box.
+STATUS_TOKEN = os.environ.get("STATUS_TOKEN")
+
+# Documents fetched at once by a single get_many, and written at once by a
+# single save_many or delete_many.
+MULTIGET_CONCURRENCY = int(os.environ.get("MULTIGET_CONCURRENCY", 10))
+BULK_WRITE_CONCURRENCY = int(os.environ.get("BULK_WRITE_CONCURRENCY", 10))
+
+# memcached servers shared by all workers for the document cache, given as a
+# comma separated list of host:port in the environment. Without any, nothing
+# is cached.
+CACHE_SHARED_SERVERS = [
+  (host, int(port))
+  for host, _, port in (s.strip().partition(":") for s in os.environ.get("CACHE_SHARED_SERVERS", "").split(",") if s.strip())
+]
+CACHE_SHARED_TIMEOUT = 0.2
+
+# Redis server (host:port) through which workers pass change notifications on
+# to each other's event stream subscribers. Without one, subscribers only
+# hear about changes made in their own worker, which is enough with a single
+# worker.
+PUBSUB_REDIS = None
+if os.environ.get("PUBSUB_REDIS"):
+  _host, _, _port = os.environ["PUBSUB_REDIS"].strip().partition(":")
+  PUBSUB_REDIS = (_host, int(_port or 6379))
+# Messages kept for a subscriber that has yet to read them.
+PUBSUB_QUEUE_SIZE = 16
+# Seconds between keepalive comments on idle event streams, as proxies close
+# connections that stay silent for too long.
+EVENTS_KEEPALIVE = 25
+
+# Store documents of the classes that opt in (todos and files) as compressed
+# msgpack rather than JSON. Needs msgpack installed on every server, as
+# those values can't be read without it.
+COMPACT_ENCODING = bool(int(os.environ.get("COMPACT_ENCODING", 0)))
 
 DATABASE_NAMES = (
     "USERS",
@@ -30,15 +113,62 @@ DATABASE_NAMES = (
     "ARCHIVED_FEED",
     "ARCHIVED_TODOS",
     "FILES",
-    "SIGNUPS"
+    "FILE_VERSIONS",
+    "SIGNUPS",
+    "COUNTERS",
+    "CHANGES",
 )
 
 DATABASE_PREFIX = "test_" if TESTING else ""
 
+# Riak bucket properties for every database, applied to the cluster with
+# scripts/tools/provisionbuckets.py. Siblings are never wanted, as documents
+# are saved with the vclock they were read with. Documents that are written
+# once (or where the last write may simply win) skip vclock resolution with
+# last_write_wins. Add "backend" to put a bucket on a named backend of a
+# multi-backend cluster.
+_DEFAULT_BUCKET_PROPERTIES = {"n_val": 3, "allow_mult": False, "last_write_wins": False, "search": False}
+_WRITE_ONCE_BUCKET_PROPERTIES = dict(_DEFAULT_BUCKET_PROPERTIES, last_write_wins=True)
+BUCKET_PROPERTIES = {
+  "users": _DEFAULT_BUCKET_PROPERTIES,
+  "projects": _DEFAULT_BUCKET_PROPERTIES,
+  "feed": _DEFAULT_BUCKET_PROPERTIES,
+  "comments": _DEFAULT_BUCKET_PROPERTIES,
+  "todos": _DEFAULT_BUCKET_PROPERTIES,
+  "archived_feed": _WRITE_ONCE_BUCKET_PROPERTIES,
+  "archived_todos": _WRITE_ONCE_BUCKET_PROPERTIES,
+  "files": _DEFAULT_BUCKET_PROPERTIES,
+  "file_versions": _WRITE_ONCE_BUCKET_PROPERTIES,
+  "signups": _WRITE_ONCE_BUCKET_PROPERTIES,
+  # Riak counters are kept as siblings that are merged on read.
+  "counters": dict(_DEFAULT_BUCKET_PROPERTIES, allow_mult=True),
+  "changes": _WRITE_ONCE_BUCKET_PROPERTIES,
+}
+
 MAX_CONTENT_LENGTH = 20 * 1024 * 1024
+
+# File history stores a delta for every update and a full copy of the file
+# every this many versions. This bounds how many deltas have to be applied to
+# rebuild an old version.
+FILE_SNAPSHOT_INTERVAL = 10
+# Versions of files larger than this (before or after the update), or of
+# binary files, are always full copies. Diffing them costs too much for what
+# it saves.
+FILE_DELTA_MAX_SIZE = 512 * 1024
+
+# Changes journaled per project for /projects/<id>/changes. Clients further
+# behind than that refetch everything.
+CHANGES_JOURNAL_SIZE = 1000
+# Seconds a change that was counted but never journaled holds back the ones
+# after it, see projecto.changes.
+CHANGES_GAP_WAIT = 10
+
 SECRET_KEY = None
 SITE_URL = "http://dev.getprojecto.ml"
 
+# Seconds to wait on the Persona verifier before giving up on a login.
+PERSONA_VERIFIER_TIMEOUT = 10
+
 # To be removed when we are ready.
 DISABLE_SIGNUP = False
 
@@ -0,0 +1,136 @@
+from __future__ import absolute_import
+
+import unittest
+
+from projecto.cache import LRUCache, DocumentCache, cache_options
+from projecto.models import User
+from .utils import FlaskTestCase
+
+
+class FakeMemcache(object):
+  def __init__(self):
+    self.data = {}
+    self.errors = 0
+
+  def get(self, key):
+    return self.data.get(key)
+
+  def set(self, key, value, ttl):
+    self.data[key] = value
+    return True
+
+  def add(self, key, value, ttl):
+    if key in self.data:
+      return False
+    self.data[key] = value
+    return True
+
+  def delete(self, key):
+    self.data.pop(key, None)
+
+
+class LRUCacheTests(unittest.TestCase):
+  def test_evicts_least_recently_used(self):
+    lru = LRUCache(2, 60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    lru.get("a")
+    lru.set("c", 3)
+
+    self.assertEquals(1, lru.get("a"))
+    self.assertEquals(None, lru.get("b"))
+    self.assertEquals(3, lru.get("c"))
+
+  def test_expires(self):
+    lru = LRUCache(2, -1)
+    lru.set("a", 1)
+    self.assertEquals(None, lru.get("a"))
+    self.assertEquals(0, len(lru))
+
+
+class DocumentCacheTests(unittest.TestCase):
+  def setUp(self):
+    self.options = cache_options()
+
+  def test_nothing_cached_without_shared_tier(self):
+    cache = DocumentCache()
+    cache.put("b", "k", {"name": "x"}, "v1", self.options)
+    self.assertEquals(None, cache.get("b", "k", self.options))
+    self.assertEquals(1, cache.report()["buckets"]["b"]["misses"])
+
+  def test_shared(self):
+    cache = DocumentCache(FakeMemcache())
+    self.assertEquals(None, cache.get("b", "k", self.options))
+    cache.put("b", "k", {"name": "x"}, "v1", self.options)
+
+    data, version = cache.get("b", "k", self.options)
+    self.assertEquals({"name": "x"}, data)
+    self.assertEquals("v1", version)
+    # Callers get their own copy.
+    data["name"] = "y"
+    self.assertEquals({"name": "x"}, cache.get("b", "k", self.options)[0])
+
+    cache.invalidate("b", "k", self.options)
+    self.assertEquals(None, cache.get("b", "k", self.options))
+
+    stats = cache.report()["buckets"]["b"]
+    self.assertEquals(2, stats["local_hits"])
+    self.assertEquals(2, stats["misses"])
+    self.assertEquals(1, stats["invalidations"])
+    self.assertEquals(0.5, stats["hit_rate"])
+
+  def test_stores_without_versions(self):
+    cache = DocumentCache(FakeMemcache())
+    cache.put("b", "k", {"name": "x"}, None, self.options)
+    self.assertEquals(({"name": "x"}, None), cache.get("b", "k", self.options))
+
+  def test_shared_invalidation_reaches_other_workers(self):
+    shared = FakeMemcache()
+    worker1 = DocumentCache(shared)
+    worker2 = DocumentCache(shared)
+
+    worker1.put("b", "k", {"name": "x"}, "v1", self.options)
+    self.assertEquals({"name": "x"}, worker2.get("b", "k", self.options)[0])
+    self.assertEquals(1, worker2.report()["buckets"]["b"]["shared_hits"])
+
+    # worker2 now has it locally, but a save in worker1 must still win.
+    worker1.invalidate("b", "k", self.options)
+    self.assertEquals(None, worker2.get("b", "k", self.options))
+
+  def test_slow_reads_cant_undo_saves(self):
+    shared = FakeMemcache()
+    cache = DocumentCache(shared)
+    # Read before the save, put after it.
+    cache.invalidate("b", "k", self.options)
+    cache.put("b", "k", {"name": "old"}, "v1", self.options)
+    self.assertEquals(None, cache.get("b", "k", self.options))
+
+    # Once the fence is gone, reads are cached again.
+    shared.data.clear()
+    cache.put("b", "k", {"name": "new"}, "v2", self.options)
+    self.assertEquals(({"name": "new"}, "v2"), cache.get("b", "k", self.options))
+
+
+class ModelCacheTests(FlaskTestCase):
+  def test_save_invalidates(self):
+    user = User.get(self.user.key)
+    self.assertEquals(self.user.name, user.name)
+
+    user.name = "changed"
+    user.save()
+    self.assertEquals("changed", User.get(self.user.key).name)
+
+    users, missing = User.get_many([self.user.key])
+    self.assertEquals("changed", users[0].name)
+
+  def test_delete_invalidates(self):
+    user = User.register_or_login("test2@test.com")
+    User.get(user.key)
+    user.delete()
+
+    users, missing = User.get_many([user.key])
+    self.assertEquals([user.key], missing)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,212 @@
+from __future__ import absolute_import
+
+import unittest
+
+from projecto import changes
+from projecto.models import bucket, store
+from projecto.pubsub import hub
+import settings
+
+from .utils import ProjectTestCase, new_feeditem, new_todo
+
+
+class TestConditionalGets(ProjectTestCase):
+  def base_url(self, postfix):
+    return "/api/v1/projects/{}/todos{}".format(self.project.key, postfix)
+
+  def test_not_modified(self):
+    self.login()
+    new_todo(self.user, self.project, title="todo", save=True)
+    response = self.get(self.base_url("/"))
+    self.assertStatus(200, response)
+    etag = response.headers["ETag"]
+
+    response = self.get(self.base_url("/"), headers={"If-None-Match": etag})
+    self.assertStatus(304, response)
+    self.assertEquals(etag, response.headers["ETag"])
+    self.assertEquals("", response.data)
+
+    # Compressed responses carry weak ETags.
+    response = self.get(self.base_url("/"), headers={"If-None-Match": "W/" + etag})
+    self.assertStatus(304, response)
+
+    # Another query is another ETag.
+    response = self.get(self.base_url("/?showdone=1"), headers={"If-None-Match": etag})
+    self.assertStatus(200, response)
+
+  def test_changes_bump_the_version(self):
+    self.login()
+    version = changes.version(self.project.key)
+    response = self.get(self.base_url("/"))
+    etag = response.headers["ETag"]
+
+    response, data = self.postJSON(self.base_url("/"), data={"title": "todo"})
+    self.assertStatus(200, response)
+    self.assertEquals(version + 1, changes.version(self.project.key))
+
+    response, data = self.getJSON(self.base_url("/"), headers={"If-None-Match": etag})
+    self.assertStatus(200, response)
+    self.assertEquals(1, len(data["todos"]))
+    self.assertNotEquals(etag, response.headers["ETag"])
+
+  def test_failed_changes_dont_bump_the_version(self):
+    self.login()
+    version = changes.version(self.project.key)
+    response = self.post(self.base_url("/"), data={})
+    self.assertStatus(400, response)
+    self.assertEquals(version, changes.version(self.project.key))
+
+  def test_access_is_checked_first(self):
+    self.login()
+    etag = self.get(self.base_url("/")).headers["ETag"]
+    self.logout()
+
+    user2 = self.create_user("test2@test.com")
+    self.login(user2)
+    response = self.get(self.base_url("/"), headers={"If-None-Match": etag})
+    self.assertStatus(403, response)
+
+
+class TestChangesAPI(ProjectTestCase):
+  def setUp(self):
+    ProjectTestCase.setUp(self)
+    self.journal_size = settings.CHANGES_JOURNAL_SIZE
+    self.gap_wait = settings.CHANGES_GAP_WAIT
+
+  def tearDown(self):
+    settings.CHANGES_JOURNAL_SIZE = self.journal_size
+    settings.CHANGES_GAP_WAIT = self.gap_wait
+    ProjectTestCase.tearDown(self)
+
+  def changes(self, since=None):
+    url = "/api/v1/projects/{}/changes".format(self.project.key)
+    response, data = self.getJSON(url, query_string={} if since is None else {"since": since})
+    self.assertStatus(200, response)
+    return response, data
+
+  def test_changes(self):
+    self.login()
+    _, data = self.changes()
+    since = data["since"]
+    self.assertEquals(changes.version(self.project.key), since)
+
+    todo_url = "/api/v1/projects/{}/todos/".format(self.project.key)
+    _, todo = self.postJSON(todo_url, data={"title": "todo"})
+    self.postJSON("/api/v1/projects/{}/comments/{}/".format(self.project.key, todo["key"]), data={"content": "comment"})
+    feeditem = new_feeditem(self.user, self.project, content="post", save=True)
+    self.delete("/api/v1/projects/{}/feed/{}".format(self.project.key, feeditem.key))
+
+    response, data = self.changes(since)
+    self.assertEquals(since + 3, data["since"])
+    self.assertFalse(data["more"])
+    self.assertFalse(data["reset"])
+    self.assertEquals([since + 1, since + 2, since + 3], [change["seq"] for change in data["changes"]])
+    self.assertEquals({"seq": since + 1, "type": "todo", "key": todo["key"], "op": "save", "parent": None}, data["changes"][0])
+    self.assertEquals(("comment", "save", todo["key"]), (data["changes"][1]["type"], data["changes"][1]["op"], data["changes"][1]["parent"]))
+    self.assertEquals({"seq": since + 3, "type": "feeditem", "key": feeditem.key, "op": "delete", "parent": None}, data["changes"][2])
+
+    # Nothing new.
+    response, data = self.changes(since + 3)
+    self.assertEquals([], data["changes"])
+    self.assertEquals(since + 3, data["since"])
+    url = "/api/v1/projects/{}/changes?since={}".format(self.project.key, since + 3)
+    self.assertStatus(304, self.get(url, headers={"If-None-Match": response.headers["ETag"]}))
+
+  def test_gaps(self):
+    self.login()
+    since = changes.version(self.project.key)
+    # Counted, but not journaled yet.
+    store.increment(bucket("counters"), self.project.key)
+    changes.record(self.project.key, "todo", "a", "save")
+
+    response, data = self.changes(since)
+    self.assertEquals([], data["changes"])
+    self.assertEquals(since, data["since"])
+    self.assertTrue(response.cache_control.no_store)
+    self.assertTrue("ETag" not in response.headers)
+
+    # Taken as lost.
+    settings.CHANGES_GAP_WAIT = -1
+    response, data = self.changes(since)
+    self.assertEquals(["a"], [change["key"] for change in data["changes"]])
+    self.assertEquals(since + 2, data["since"])
+    self.assertTrue("ETag" in response.headers)
+
+  def test_gaps_at_the_end(self):
+    self.login()
+    since = changes.version(self.project.key)
+    store.increment(bucket("counters"), self.project.key)
+
+    response, data = self.changes(since)
+    self.assertEquals(since, data["since"])
+    self.assertTrue(response.cache_control.no_store)
+
+    settings.CHANGES_GAP_WAIT = -1
+    response, data = self.changes(since)
+    self.assertEquals([], data["changes"])
+    self.assertEquals(since + 1, data["since"])
+    self.assertFalse(data["reset"])
+    self.assertTrue("ETag" in response.headers)
+    self.assertTrue(self.project.key not in changes._tail_gaps)
+
+  def test_reset_and_trim(self):
+    self.login()
+    settings.CHANGES_JOURNAL_SIZE = 50
+    since = changes.version(self.project.key)
+    changes.record_many(self.project.key, [("todo", str(i), "save", None) for i in xrange(120)])
+
+    _, data = self.changes(since)
+    self.assertTrue(data["reset"])
+    self.assertEquals(since + 120, data["since"])
+
+    _, data = self.changes(since + 70)
+    self.assertFalse(data["reset"])
+    self.assertEquals([str(i) for i in xrange(70, 120)], [change["key"] for change in data["changes"]])
+
+    self.assertTrue(len(list(changes.Change.index_keys_only("position", changes._position(self.project.key, 0),
+                                                            changes._position(self.project.key, since + 120)))) <= 50)
+
+  def test_event_stream(self):
+    stream = changes.event_stream(self.project.key)
+    current = changes.version(self.project.key)
+    first = next(stream)
+    self.assertTrue(first.startswith("retry: "))
+    self.assertTrue("id: {}\nevent: version\ndata: {{\"version\":{}}}\n\n".format(current, current) in first)
+    self.assertEquals(1, hub.subscribers(self.project.key))
+
+    changes.record(self.project.key, "todo", "a", "save")
+    changes.record(self.project.key, "todo", "b", "save")
+    # Only the newest version is sent.
+    self.assertEquals("id: {0}\nevent: version\ndata: {{\"version\":{0}}}\n\n".format(current + 2), next(stream))
+
+    stream.close()
+    self.assertEquals(0, hub.subscribers(self.project.key))
+
+  def test_events_need_access(self):
+    response = self.get("/api/v1/projects/{}/events".format(self.project.key))
+    self.assertStatus(403, response)
+
+  def test_failed_counts_dont_fail_writes(self):
+    self.login()
+    errors = changes.errors
+
+    def increment(*args, **kwargs):
+      raise IOError("counters are down")
+
+    store.increment, original = increment, store.increment
+    try:
+      response, _ = self.postJSON("/api/v1/projects/{}/todos/".format(self.project.key), data={"title": "todo"})
+    finally:
+      store.increment = original
+
+    self.assertStatus(200, response)
+    self.assertEquals(errors + 1, changes.errors)
+
+  def test_bad_since(self):
+    self.login()
+    response = self.get("/api/v1/projects/{}/changes?since=abc".format(self.project.key))
+    self.assertStatus(400, response)
+
+
+if __name__ == "__main__":
+  unittest.main()
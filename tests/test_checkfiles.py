@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+
+from cStringIO import StringIO
+import os
+import unittest
+
+from kvkit import NotFoundError
+
+from projecto.apiv1.files.models import File
+from projecto.models import BaseDocument
+from .utils import ProjectTestCase, load_tool, new_file, new_project
+
+checkfiles = load_tool("checkfiles")
+
+
+class TestCheckFiles(ProjectTestCase):
+  def setUp(self):
+    ProjectTestCase.setUp(self)
+    self.reset_database()
+
+  def tearDown(self):
+    self.reset_database()
+    ProjectTestCase.tearDown(self)
+
+  def check(self, **kwargs):
+    self.out = StringIO()
+    return checkfiles.Checker(File.FILES_FOLDER, workers=2, out=self.out, **kwargs).run()
+
+  def write(self, project_key, path):
+    fspath = os.path.join(File.FILES_FOLDER, project_key, path)
+    if not os.path.isdir(os.path.dirname(fspath)):
+      os.makedirs(os.path.dirname(fspath))
+    with open(fspath, "w") as f:
+      f.write("orphan")
+    return fspath
+
+  def test_dangling_and_orphans(self):
+    new_file(self.user, self.project, path="/ok.txt", save=True)
+    dangling = new_file(self.user, self.project, path="/dangling.txt", save=True)
+    os.remove(dangling.fspath)
+    self.write(self.project.key, "orphan.txt")
+
+    counts = self.check()
+    self.assertEquals(2, counts["keys"])
+    self.assertEquals(2, counts["paths"])
+    self.assertEquals(1, counts["dangling"])
+    self.assertEquals(1, counts["orphan"])
+    self.assertEquals(0, counts["repaired"])
+    self.assertEquals(0, counts["error"])
+    self.assertTrue("dangling " + dangling.key in self.out.getvalue())
+    self.assertTrue("orphan " + self.project.key + "`/orphan.txt" in self.out.getvalue())
+
+    # Only reported.
+    File.get(dangling.key)
+    with self.assertRaises(NotFoundError):
+      File.get_by_project_path(self.project, "/orphan.txt")
+
+  def test_repair(self):
+    dangling = new_file(self.user, self.project, path="/dangling.txt", save=True)
+    os.remove(dangling.fspath)
+    self.write(self.project.key, "orphan.txt")
+    lost = self.write("nosuchproject", "lost.txt")
+
+    counts = self.check(repair=True)
+    self.assertEquals(3, counts["repaired"])
+
+    with self.assertRaises(NotFoundError):
+      File.get(dangling.key)
+
+    adopted = File.get_by_project_path(self.project, "/orphan.txt")
+    self.assertEquals(self.user.key, adopted.author.key)
+    self.assertEquals("orphan", adopted.content)
+
+    self.assertFalse(os.path.exists(lost))
+    self.assertTrue(os.path.exists(os.path.join(File.FILES_FOLDER, checkfiles.LOST_AND_FOUND, "nosuchproject", "lost.txt")))
+
+    counts = self.check()
+    self.assertEquals(0, counts["dangling"] + counts["orphan"])
+
+  def test_reindex(self):
+    f = new_file(self.user, self.project, path="/report.txt", save=True)
+    other = new_project(self.user, save=True)
+    new_file(self.user, other, path="/notes.txt", save=True)
+    # Saved before search existed.
+    f.name_index = None
+    f.path_trigrams = []
+    BaseDocument.save(f)
+    self.assertEquals([], File.search(self.project, "report"))
+
+    counts = self.check(reindex=True)
+    self.assertEquals(2, counts["reindexed"])
+    self.assertEquals(["/report.txt"], File.search(self.project, "report"))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,93 @@
+from __future__ import absolute_import
+
+import gzip
+from cStringIO import StringIO
+import unittest
+import zlib
+
+from projecto.compression import CompressionMiddleware, parse_accept_encoding
+
+
+def make_app(body, content_type="application/json", length=True, status="200 OK", headers=()):
+  def app(environ, start_response):
+    h = [("Content-Type", content_type)] + list(headers)
+    if length:
+      h.append(("Content-Length", str(sum(len(chunk) for chunk in body))))
+    start_response(status, h)
+    return iter(body)
+  return app
+
+
+class TestCompression(unittest.TestCase):
+  def call(self, app, accept="gzip, deflate", method="GET", path="/"):
+    started = []
+    middleware = CompressionMiddleware(app, level=6, min_size=100, max_buffer=5000)
+    environ = {"REQUEST_METHOD": method, "HTTP_ACCEPT_ENCODING": accept, "PATH_INFO": path}
+    chunks = list(middleware(environ, lambda status, headers, exc_info=None: started.extend([status, dict(headers)])))
+    return started[1], chunks
+
+  def test_parse_accept_encoding(self):
+    self.assertEquals("gzip", parse_accept_encoding("gzip, deflate"))
+    self.assertEquals("deflate", parse_accept_encoding("gzip;q=0, deflate"))
+    self.assertEquals("gzip", parse_accept_encoding("*"))
+    self.assertEquals(None, parse_accept_encoding("identity"))
+    self.assertEquals(None, parse_accept_encoding(""))
+
+  def test_gzip(self):
+    body = ["x" * 1000]
+    headers, chunks = self.call(make_app(body, headers=[("ETag", '"abc"')]))
+    self.assertEquals("gzip", headers["Content-Encoding"])
+    self.assertEquals("Accept-Encoding", headers["Vary"])
+    self.assertEquals('W/"abc"', headers["ETag"])
+    self.assertEquals(str(len("".join(chunks))), headers["Content-Length"])
+    self.assertEquals(body[0], gzip.GzipFile(fileobj=StringIO("".join(chunks))).read())
+
+  def test_deflate(self):
+    headers, chunks = self.call(make_app(["x" * 1000]), accept="deflate")
+    self.assertEquals("deflate", headers["Content-Encoding"])
+    self.assertEquals("x" * 1000, zlib.decompress("".join(chunks)))
+
+  def test_streams_stay_streams(self):
+    body = ["a" * 10, "b" * 10, "c" * 10]
+    headers, chunks = self.call(make_app(body, length=False))
+    self.assertTrue("Content-Length" not in headers)
+    self.assertEquals(4, len(chunks))
+
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    # Every chunk can be decoded as soon as it arrives.
+    self.assertEquals("a" * 10, decompressor.decompress(chunks[0]))
+    self.assertEquals("".join(body[1:]), "".join(decompressor.decompress(c) for c in chunks[1:]))
+
+  def test_long_responses_are_not_buffered(self):
+    body = ["x" * 4000] * 5
+    headers, chunks = self.call(make_app(body))
+    self.assertEquals("gzip", headers["Content-Encoding"])
+    self.assertTrue("Content-Length" not in headers)
+    self.assertEquals("".join(body), zlib.decompress("".join(chunks), 16 + zlib.MAX_WBITS))
+
+  def test_static_files_keep_strong_etags(self):
+    headers, chunks = self.call(make_app(["x" * 1000], content_type="text/css", headers=[("ETag", '"abc"')]),
+                                path="/static/css/app.css")
+    self.assertEquals("gzip", headers["Content-Encoding"])
+    self.assertEquals('"abc"', headers["ETag"])
+
+  def test_passthrough(self):
+    cases = [
+      (make_app(["x" * 1000], content_type="image/png"), "gzip"),
+      (make_app(["x" * 1000], content_type="application/zip"), "gzip"),
+      (make_app(["x" * 10]), "gzip"),
+      (make_app(["x" * 1000], headers=[("Content-Encoding", "gzip")]), "gzip"),
+      (make_app([], status="304 Not Modified"), "gzip"),
+      (make_app(["x" * 1000]), "identity"),
+    ]
+    for app, accept in cases:
+      headers, chunks = self.call(app, accept=accept)
+      self.assertTrue(headers.get("Content-Encoding") in (None, "gzip"))
+      self.assertTrue("Vary" not in headers)
+
+    headers, chunks = self.call(make_app(["x" * 1000]), method="HEAD")
+    self.assertTrue("Content-Encoding" not in headers)
+
+
+if __name__ == "__main__":
+  unittest.main()
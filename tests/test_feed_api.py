@@ -134,6 +134,19 @@ class TestFeedAPI(ProjectTestCase):
       self.assertEquals(keys[i], item["key"])
       self.assertEquals("content" + str(9 - i), item["content"])
 
+  def test_index_feeditems_with_fields(self):
+    self.reset_database()
+    now = datetime.now()
+    keys = [new_feeditem(self.user, project=self.project, content=str(i), date=now + timedelta(i), save=True).key for i in xrange(3)]
+
+    self.login()
+    response, data = self.getJSON(self.base_url("/?fields=content"))
+    self.assertStatus(200, response)
+    self.assertEquals([{"key": key, "content": str(2 - i)} for i, key in enumerate(reversed(keys))], data["feed"])
+
+    response, _ = self.getJSON(self.base_url("/?fields=nope"))
+    self.assertStatus(400, response)
+
   def test_index_feeditems_will_archive_oldones(self):
     self.reset_database()
     for i in xrange(250):
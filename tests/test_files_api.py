@@ -2,13 +2,15 @@ from __future__ import absolute_import
 
 from cStringIO import StringIO
 import os
+import unittest
 
 from kvkit import NotFoundError
 import ujson as json
 from werkzeug.datastructures import FileStorage
 
-from projecto.apiv1.files.models import File
-from .utils import ProjectTestCase, new_file, new_directory
+from projecto.apiv1.files import delta, models
+from projecto.apiv1.files.models import File, FileVersion
+from .utils import ProjectTestCase, new_file, new_directory, new_project
 
 test_file = lambda filename: (StringIO("hello world"), filename)
 
@@ -66,6 +68,16 @@ class FileModelTests(ProjectTestCase):
 
     self.assertEquals(os.path.join(File.FILES_FOLDER, self.project.key, "evil/path"), f.fspath)
 
+  def test_backticks_stay_in_the_project(self):
+    for path in ("/a`X../otherproj/secret.txt", "/don`t.txt"):
+      f = File.create(data={"project": self.project, "path": path})
+      self.assertEquals(path, f.path)
+      self.assertEquals(os.path.join(File.FILES_FOLDER, self.project.key, path[1:]), f.fspath)
+
+    f = new_file(self.user, self.project, path="/don`t.txt", save=True)
+    self.assertEquals(f.key, File.get_by_project_path(self.project, "/don`t.txt").key)
+    self.assertEquals(["/don`t.txt"], File.search(self.project, "don`t"))
+
   def test_create_file_missing_intermediate_directories(self):
     with self.assertRaises(NotFoundError):
       new_file(self.user, self.project, path="/does/not/exist.txt", save=True)
@@ -109,6 +121,125 @@ class FileModelTests(ProjectTestCase):
     self.assertEquals("yay!", g.content)
     self.assertNotEquals(now, g.date)
 
+  def test_first_version_is_copied(self):
+    read_file = models._read_file
+    # Fails if the new file is read back to snapshot it.
+    models._read_file = None
+    try:
+      f = new_file(self.user, self.project, save=True)
+    finally:
+      models._read_file = read_file
+
+    self.assertEquals(1, f.version)
+    self.assertTrue(list(f.versions())[0].snapshot)
+    self.assertEquals(11, list(f.versions())[0].size)
+    self.assertEquals("hello world", f.version_content(1))
+
+  def test_update_file_upload(self):
+    text = "".join("line {}\n".format(i) for i in xrange(100))
+    f = new_file(self.user, self.project, save=True)
+    f.update_upload(FileStorage(StringIO(text)))
+    f.update_upload(FileStorage(StringIO(text + "appended")))
+
+    g = File.get_by_project_path(self.project, f.path)
+    self.assertEquals(text + "appended", g.content)
+    self.assertEquals(3, g.version)
+    self.assertFalse(list(g.versions())[2].snapshot)
+    # Only the versions are left in the history.
+    self.assertEquals(["1.snapshot", "2.snapshot", "3.delta"], sorted(os.listdir(g.history_dir)))
+
+    big = "x" * (models.FILE_DELTA_MAX_SIZE + 1)
+    g.update_upload(FileStorage(StringIO(big)))
+    self.assertEquals(big, g.content)
+    self.assertTrue(list(g.versions())[3].snapshot)
+    self.assertEquals(big, g.version_content(4))
+    self.assertEquals(text + "appended", g.version_content(3))
+
+  def test_file_names_are_kept(self):
+    f = new_file(self.user, self.project, path="/my file.txt", save=True)
+    self.assertEquals("/my file.txt", f.path)
+    self.assertTrue(os.path.exists(os.path.join(File.FILES_FOLDER, self.project.key, "my file.txt")))
+    self.assertEquals("/.hidden", File.create(data={"project": self.project, "path": "/.hidden"}).path)
+
+  def test_file_versions(self):
+    f = new_file(self.user, self.project, save=True)
+    self.assertEquals(1, f.version)
+
+    contents = ["hello world"]
+    for i in xrange(25):
+      contents.append(contents[-1] + " edit {}".format(i))
+      f.update_content(contents[-1])
+
+    g = File.get_by_project_path(self.project, f.path)
+    self.assertEquals(len(contents), g.version)
+
+    versions = list(g.versions())
+    self.assertEquals(range(1, len(contents) + 1), [v.number for v in versions])
+    self.assertTrue(versions[0].snapshot)
+    self.assertTrue(versions[10].snapshot)
+    self.assertFalse(versions[11].snapshot)
+
+    for i, content in enumerate(contents):
+      self.assertEquals(content, g.version_content(i + 1))
+
+    with self.assertRaises(NotFoundError):
+      g.version_content(len(contents) + 1)
+
+  def test_file_versions_survive_move(self):
+    f = new_file(self.user, self.project, save=True)
+    f.update_content("yay!")
+    f.move("/moved_file.txt")
+
+    g = File.get_by_project_path(self.project, "/moved_file.txt")
+    self.assertEquals("hello world", g.version_content(1))
+    self.assertEquals("yay!", g.version_content(2))
+
+  def test_delete_file_removes_versions(self):
+    f = new_file(self.user, self.project, save=True)
+    f.update_content("yay!")
+    history_dir = f.history_dir
+    self.assertTrue(os.path.exists(history_dir))
+
+    f.delete()
+    self.assertFalse(os.path.exists(history_dir))
+
+    with self.assertRaises(NotFoundError):
+      FileVersion.get(FileVersion.keygen(f.history, 1))
+
+  def test_search(self):
+    new_directory(self.user, self.project, path="/docs/", save=True)
+    new_file(self.user, self.project, path="/docs/Report-2014.txt", save=True)
+    new_file(self.user, self.project, path="/docs/notes.txt", save=True)
+    f = new_file(self.user, self.project, path="/report.txt", save=True)
+
+    self.assertEquals(["/docs/Report-2014.txt", "/report.txt"], File.search(self.project, "report"))
+    self.assertEquals(["/docs/Report-2014.txt"], File.search(self.project, "port-20"))
+    self.assertEquals(["/docs/", "/docs/Report-2014.txt", "/docs/notes.txt"], File.search(self.project, "docs/"))
+    self.assertEquals(["/docs/notes.txt"], File.search(self.project, "no", prefix_only=True))
+    self.assertEquals([], File.search(self.project, "txt", prefix_only=True))
+    self.assertEquals([], File.search(self.project, "nothing"))
+
+    f.move("/moved.txt")
+    self.assertEquals(["/docs/Report-2014.txt"], File.search(self.project, "report"))
+    self.assertEquals(["/moved.txt"], File.search(self.project, "moved"))
+
+    File.get_by_project_path(self.project, "/docs/").delete()
+    self.assertEquals([], File.search(self.project, "report"))
+
+  def test_search_non_ascii(self):
+    new_file(self.user, self.project, path=u"/R\xe9sum\xe9 \xdcbersicht.txt", save=True)
+    new_file(self.user, self.project, path="/resume.txt", save=True)
+
+    self.assertEquals([u"/R\xe9sum\xe9 \xdcbersicht.txt"], File.search(self.project, u"\xe9sum\xe9"))
+    self.assertEquals([u"/R\xe9sum\xe9 \xdcbersicht.txt"], File.search(self.project, u"\xfcbers"))
+    # UTF-8 encoded queries too.
+    self.assertEquals([u"/R\xe9sum\xe9 \xdcbersicht.txt"], File.search(self.project, "r\xc3\xa9", prefix_only=True))
+    self.assertEquals(["/resume.txt"], File.search(self.project, "resu"))
+
+  def test_search_stays_in_project(self):
+    new_file(self.user, self.project, path="/report.txt", save=True)
+    self.assertEquals([], File.search(new_project(self.user, save=True), "report"))
+
   def test_list_directory(self):
     d = new_directory(self.user, self.project, path="/directory/", save=True)
     new_file(self.user, self.project, path="/directory/file1.txt", save=True)
@@ -305,6 +436,31 @@ class FileModelTests(ProjectTestCase):
     self.assertTrue("/dir1/" in paths)
     self.assertTrue("/test.file" in paths)
 
+class FileDeltaTests(unittest.TestCase):
+  def test_roundtrip(self):
+    source = "".join("line {}\n".format(i) for i in xrange(1000))
+    target = source[:500] + "inserted\n" + source[600:] + "appended"
+    d = delta.diff(source, target)
+    self.assertTrue(len(d) < len(target) // 10)
+    self.assertEquals(target, delta.patch(source, d))
+
+  def test_roundtrip_edge_cases(self):
+    for source, target in (("", ""), ("", "abc"), ("abc", ""), ("a" * 100, "a" * 100)):
+      self.assertEquals(target, delta.patch(source, delta.diff(source, target)))
+
+  def test_gives_up_on_new_content(self):
+    source = "".join("line {}\n".format(i) for i in xrange(1000))
+    self.assertEquals(None, delta.diff(source, os.urandom(len(source)), len(source) // 2))
+    self.assertEquals(None, delta.diff(source, source[:100] + os.urandom(len(source)), len(source) // 2))
+
+    target = source + "appended"
+    self.assertEquals(target, delta.patch(source, delta.diff(source, target, len(target) // 2)))
+
+  def test_corrupt_delta(self):
+    with self.assertRaises(delta.CorruptDelta):
+      delta.patch("abc", "garbage")
+
+
 class TestFilesAPI(ProjectTestCase):
   def setUp(self):
     ProjectTestCase.setUp(self)
@@ -543,6 +699,60 @@ class TestFilesAPI(ProjectTestCase):
     self.assertStatus(200, response)
     self.assertEquals("abc", f.content)
 
+  def test_file_versions(self):
+    f = new_file(self.user, self.project, path="/test.txt", save=True)
+    self._c.append(f)
+
+    self.login()
+    response = self.put(self.base_url(), query_string={"path": "/test.txt"}, data={"file": (StringIO("abc"), "meh")})
+    self.assertStatus(200, response)
+
+    response, data = self.getJSON(self.base_url("versions"), query_string={"path": "/test.txt"})
+    self.assertStatus(200, response)
+    self.assertEquals([2, 1], [v["number"] for v in data["versions"]])
+    self.assertEquals(self.user.key, data["versions"][0]["author"]["key"])
+
+    response = self.get(self.base_url("versions/1"), query_string={"path": "/test.txt"})
+    self.assertStatus(200, response)
+    self.assertEquals("hello world", response.data)
+
+    response = self.get(self.base_url("versions/2"), query_string={"path": "/test.txt"})
+    self.assertStatus(200, response)
+    self.assertEquals("abc", response.data)
+
+    response = self.get(self.base_url("versions/3"), query_string={"path": "/test.txt"})
+    self.assertStatus(404, response)
+
+  def test_file_versions_reject_permission(self):
+    f = new_file(self.user, self.project, path="/test.txt", save=True)
+    self._c.append(f)
+
+    response = self.get(self.base_url("versions"), query_string={"path": "/test.txt"})
+    self.assertStatus(403, response)
+
+    response = self.get(self.base_url("versions/1"), query_string={"path": "/test.txt"})
+    self.assertStatus(403, response)
+
+  def test_search(self):
+    self._c.append(new_file(self.user, self.project, path="/report.txt", save=True))
+    self._c.append(new_file(self.user, self.project, path="/notes.txt", save=True))
+
+    self.login()
+    response, data = self.getJSON(self.base_url("search"), query_string={"q": "port"})
+    self.assertStatus(200, response)
+    self.assertEquals(["/report.txt"], data["results"])
+
+    response, data = self.getJSON(self.base_url("search"), query_string={"q": "port", "prefix": "1"})
+    self.assertStatus(200, response)
+    self.assertEquals([], data["results"])
+
+    response, data = self.getJSON(self.base_url("search"), query_string={"q": " "})
+    self.assertStatus(400, response)
+
+  def test_search_reject_permission(self):
+    response = self.get(self.base_url("search"), query_string={"q": "port"})
+    self.assertStatus(403, response)
+
   def test_update_file_reject_notfound(self):
     self.login()
     response = self.put(self.base_url(), query_string={"path": "/test.txt"}, data={"file": (StringIO("abc"), "meh")})
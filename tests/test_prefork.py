@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+
+import os
+import signal
+import time
+import unittest
+import urllib2
+
+from projecto.prefork import Arbiter
+
+
+def app(environ, start_response):
+  start_response("200 OK", [("Content-Type", "text/plain")])
+  return [str(os.getpid())]
+
+
+class TestArbiter(unittest.TestCase):
+  def arbiter(self, **kwargs):
+    arbiter = Arbiter(app, "127.0.0.1", 0, 1, graceful_timeout=1, **kwargs)
+    self.messages = []
+    arbiter.log = self.messages.append
+    arbiter.listener = arbiter._bind()
+    self.port = arbiter.listener.getsockname()[1]
+    self.addCleanup(self.cleanup, arbiter)
+    return arbiter
+
+  def cleanup(self, arbiter):
+    for pid in list(arbiter.workers):
+      arbiter._kill(pid, signal.SIGKILL)
+    self.reap(arbiter)
+    arbiter.listener.close()
+
+  def reap(self, arbiter, until=frozenset(), timeout=5):
+    deadline = time.time() + timeout
+    while arbiter.workers != until and time.time() < deadline:
+      time.sleep(0.05)
+      arbiter._reap()
+
+  def get(self):
+    return urllib2.urlopen("http://127.0.0.1:{}/".format(self.port), timeout=5).read()
+
+  def test_recycles_after_max_requests(self):
+    arbiter = self.arbiter(max_requests=2)
+    pid = arbiter.spawn()
+    self.assertEquals(set([pid]), arbiter.workers)
+
+    self.assertEquals(str(pid), self.get())
+    self.assertEquals(str(pid), self.get())
+    self.reap(arbiter)
+    self.assertEquals(set(), arbiter.workers)
+    # It exited on its own, not with an error.
+    self.assertEquals([], [m for m in self.messages if "died" in m])
+
+  def test_reload(self):
+    arbiter = self.arbiter()
+    old = arbiter.spawn()
+    arbiter.reload()
+
+    new = arbiter.workers - set([old])
+    self.assertEquals(1, len(new))
+    self.assertEquals(set([old]), arbiter.retiring)
+
+    self.reap(arbiter, until=new)
+    self.assertEquals(new, arbiter.workers)
+    self.assertEquals(set(), arbiter.retiring)
+    self.assertEquals(str(list(new)[0]), self.get())
+
+  def test_shutdown(self):
+    arbiter = self.arbiter()
+    arbiter.spawn()
+    arbiter.spawn()
+    arbiter.shutdown()
+    self.assertEquals(set(), arbiter.workers)
+
+
+if __name__ == "__main__":
+  unittest.main()
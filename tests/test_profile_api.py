@@ -23,5 +23,19 @@ class TestProfileAPI(FlaskTestCase):
     response, data = self.postJSON("/api/v1/profile/changename", data={"name": "a name", "invalid": "invalid"})
     self.assertStatus(400, response)
 
+  def test_davtoken(self):
+    self.login()
+    response, data = self.postJSON("/api/v1/profile/davtoken")
+    self.assertStatus(200, response)
+    self.assertTrue(data["token"])
+
+    self.user.reload()
+    self.assertTrue(self.user.check_dav_token(data["token"]))
+    self.assertFalse(self.user.check_dav_token("wrong"))
+
+  def test_davtoken_reject_permission(self):
+    response, data = self.postJSON("/api/v1/profile/davtoken")
+    self.assertStatus(403, response)
+
 if __name__ == "__main__":
   unittest.main()
\ No newline at end of file
@@ -1,7 +1,9 @@
 from __future__ import absolute_import
 
 import unittest
-from .utils import FlaskTestCase, new_project
+
+from projecto import changes
+from .utils import FlaskTestCase, ProjectTestCase, new_feeditem, new_project, new_todo
 
 # TODO: needs to code in participants
 
@@ -99,6 +101,18 @@ class TestProjectsAPI(FlaskTestCase):
     self.assertEquals(0, len(data["owned"]))
     self.assertEquals(0, len(data["participating"]))
 
+  def test_list_my_projects_with_fields(self):
+    self.reset_database()
+    self.login()
+    key = new_project(user=self.user, name="p", desc="d", save=True).key
+
+    response, data = self.getJSON("/api/v1/projects/?fields=name")
+    self.assertStatus(200, response)
+    self.assertEquals([{"key": key, "name": "p"}], data["owned"])
+
+    response, _ = self.getJSON("/api/v1/projects/?fields=name,owners")
+    self.assertStatus(400, response)
+
   def test_list_reject_not_logged_in(self):
     response, _ = self.getJSON("/api/v1/projects/")
     self.assertStatus(403, response)
@@ -133,6 +147,17 @@ class TestProjectsAPI(FlaskTestCase):
     self.assertEquals(1, len(data["unregistered_owners"]))
     self.assertEquals("unregistered@owners.com", data["unregistered_owners"][0])
 
+  def test_list_members_skips_missing_users(self):
+    project = new_project(self.user, name="project", save=True)
+    project.collaborators.append("deleted-user")
+    project.save()
+
+    self.login()
+    response, data = self.getJSON("/api/v1/projects/{}/members".format(project.key))
+    self.assertStatus(200, response)
+    self.assertEquals(1, len(data["owners"]))
+    self.assertEquals(0, len(data["collaborators"]))
+
   def test_list_members_reject_permission(self):
     project = new_project(self.user, name="project", save=True)
     response, data = self.getJSON("/api/v1/projects/{}/members".format(project.key))
@@ -358,5 +383,63 @@ class TestProjectsAPI(FlaskTestCase):
     response, data = self.postJSON("/api/v1/projects/{}/removecollaborators".format(project.key), data={"emails": ["test2@test.com"], "invalid": "invalid"})
     self.assertStatus(400, response)
 
+
+class TestBootstrap(ProjectTestCase):
+  def base_url(self, postfix=""):
+    return "/api/v1/projects/{}{}".format(self.project.key, postfix)
+
+  def test_bootstrap_as_owner(self):
+    user2 = self.create_user("test2@test.com")
+    self.project.collaborators.append(user2.key)
+    self.project.save()
+    new_feeditem(user2, self.project, content="post", save=True)
+    new_todo(self.user, self.project, title="done", tags=["a"], done=True, save=True)
+    new_todo(user2, self.project, title="todo", tags=["a", "b"], save=True)
+
+    self.login()
+    response, data = self.getJSON(self.base_url("/bootstrap"))
+    self.assertStatus(200, response)
+    self.assertEquals(changes.version(self.project.key), data["since"])
+    self.assertEquals(self.getJSON(self.base_url())[1], data["project"])
+    self.assertEquals(self.getJSON(self.base_url("/feed/"))[1]["feed"], data["feed"])
+
+    _, todos = self.getJSON(self.base_url("/todos/filter"), query_string={"tags": ["a", "b", " "]})
+    todos["tags"] = {"a": 2, "b": 1}
+    self.assertEquals(todos, data["todos"])
+
+    members = self.getJSON(self.base_url("/members"))[1]
+    members["count"] = 2
+    self.assertEquals(members, data["members"])
+
+  def test_bootstrap_as_collaborator(self):
+    user2 = self.create_user("test2@test.com")
+    self.project.collaborators.append(user2.key)
+    self.project.save()
+
+    self.login(user2)
+    response, data = self.getJSON(self.base_url("/bootstrap"))
+    self.assertStatus(200, response)
+    self.assertEquals({"count": 2}, data["members"])
+    self.assertEquals(self.getJSON(self.base_url())[1], data["project"])
+    self.assertTrue("owners" not in data["project"])
+
+  def test_bootstrap_is_conditional(self):
+    self.login()
+    response = self.get(self.base_url("/bootstrap"))
+    etag = response.headers["ETag"]
+    self.assertStatus(304, self.get(self.base_url("/bootstrap"), headers={"If-None-Match": etag}))
+
+    changes.record(self.project.key, "todo", "a", "save")
+    self.assertStatus(200, self.get(self.base_url("/bootstrap"), headers={"If-None-Match": etag}))
+
+  def test_bootstrap_reject_permission(self):
+    response = self.get(self.base_url("/bootstrap"))
+    self.assertStatus(403, response)
+
+    self.login(self.create_user("test2@test.com"))
+    response = self.get(self.base_url("/bootstrap"))
+    self.assertStatus(403, response)
+
+
 if __name__ == "__main__":
-  unittest.main()
\ No newline at end of file
+  unittest.main()
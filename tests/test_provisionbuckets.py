@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+
+from cStringIO import StringIO
+import unittest
+
+from .utils import load_tool
+import settings
+
+provisionbuckets = load_tool("provisionbuckets")
+
+
+class StubBucket(object):
+  def __init__(self, name, properties):
+    self.name = name
+    self.properties = properties
+    self.applied = []
+
+  def get_properties(self):
+    return dict(self.properties)
+
+  def set_properties(self, properties):
+    self.applied.append(properties)
+    self.properties.update(properties)
+
+
+class StubClient(object):
+  def __init__(self, **properties):
+    self.buckets = {}
+    for name in settings.DATABASES.itervalues():
+      live = dict(n_val=3, allow_mult=False, last_write_wins=False, search=False)
+      live.update(properties)
+      self.buckets[name] = StubBucket(name, live)
+
+  def bucket(self, name):
+    return self.buckets[name]
+
+
+class TestProvisionBuckets(unittest.TestCase):
+  def provision(self, client, **kwargs):
+    self.out = StringIO()
+    return provisionbuckets.provision(client, out=self.out, **kwargs)
+
+  def test_diff_properties(self):
+    self.assertEquals({"allow_mult": (False, True)},
+                      provisionbuckets.diff_properties({"allow_mult": True, "n_val": 3}, {"allow_mult": False, "n_val": 3}))
+
+  def test_check_only(self):
+    client = StubClient()
+    remaining = self.provision(client)
+    self.assertTrue(remaining > 0)
+    self.assertEquals([], [b for b in client.buckets.values() if b.applied])
+    counters = settings.DATABASES["counters"]
+    self.assertTrue("{} allow_mult: False -> True\n".format(counters) in self.out.getvalue())
+
+  def test_apply(self):
+    client = StubClient()
+    self.assertEquals(0, self.provision(client, apply=True))
+    for name, wanted in settings.BUCKET_PROPERTIES.iteritems():
+      bucket = client.buckets[settings.DATABASES[name]]
+      for prop, value in wanted.iteritems():
+        self.assertEquals(value, bucket.properties[prop])
+
+    # Only what differed is set.
+    self.assertEquals([], client.buckets[settings.DATABASES["users"]].applied)
+    self.assertEquals([{"allow_mult": True}], client.buckets[settings.DATABASES["counters"]].applied)
+    self.assertEquals([{"last_write_wins": True}], client.buckets[settings.DATABASES["changes"]].applied)
+
+    # Nothing left to do.
+    self.assertEquals(0, self.provision(client))
+    self.assertEquals("", self.out.getvalue())
+
+  def test_n_val_needs_allow(self):
+    client = StubClient(n_val=2)
+    remaining = self.provision(client, apply=True)
+    self.assertEquals(len(settings.BUCKET_PROPERTIES), remaining)
+    self.assertEquals(set([2]), set(b.properties["n_val"] for b in client.buckets.values()))
+
+    self.assertEquals(0, self.provision(client, apply=True, allow_n_val=True))
+    self.assertEquals(set([3]), set(b.properties["n_val"] for b in client.buckets.values()))
+
+
+if __name__ == "__main__":
+  unittest.main()
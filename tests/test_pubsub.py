@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+
+from cStringIO import StringIO
+import unittest
+
+from projecto.pubsub import Hub, LocalTransport, encode_command, read_reply
+
+
+class TestHub(unittest.TestCase):
+  def setUp(self):
+    self.hub = Hub(LocalTransport(), queue_size=3)
+
+  def test_publish(self):
+    a = self.hub.subscribe("a")
+    a2 = self.hub.subscribe("a")
+    b = self.hub.subscribe("b")
+
+    self.hub.publish("a", {"version": 1})
+    self.hub.publish("a", {"version": 2})
+    self.assertEquals([{"version": 1}, {"version": 2}], a.get(0))
+    self.assertEquals([{"version": 1}, {"version": 2}], a2.get(0))
+    self.assertEquals([], a.get(0))
+    self.assertEquals([], b.get(0))
+
+  def test_slow_subscribers_lose_old_messages(self):
+    a = self.hub.subscribe("a")
+    for i in xrange(5):
+      self.hub.publish("a", i)
+    self.assertEquals([2, 3, 4], a.get(0))
+
+  def test_close(self):
+    a = self.hub.subscribe("a")
+    a2 = self.hub.subscribe("a")
+    self.assertEquals(2, self.hub.subscribers("a"))
+
+    a.close()
+    self.hub.publish("a", 1)
+    self.assertEquals([], a.get(0))
+    self.assertEquals([1], a2.get(0))
+
+    a2.close()
+    self.assertEquals(0, self.hub.subscribers("a"))
+    self.assertEquals({}, self.hub.channels)
+
+
+class TestRedisProtocol(unittest.TestCase):
+  def test_encode_command(self):
+    self.assertEquals("*3\r\n$7\r\nPUBLISH\r\n$1\r\na\r\n$2\r\n{}\r\n", encode_command("PUBLISH", "a", "{}"))
+
+  def test_read_reply(self):
+    f = StringIO(":1\r\n+OK\r\n$-1\r\n*4\r\n$8\r\npmessage\r\n$3\r\np:*\r\n$3\r\np:a\r\n$13\r\n{\"version\":1}\r\n")
+    self.assertEquals(1, read_reply(f))
+    self.assertEquals("OK", read_reply(f))
+    self.assertEquals(None, read_reply(f))
+    self.assertEquals(["pmessage", "p:*", "p:a", '{"version":1}'], read_reply(f))
+    self.assertRaises(IOError, read_reply, f)
+
+  def test_error_reply(self):
+    self.assertRaises(ValueError, read_reply, StringIO("-ERR unknown command\r\n"))
+
+
+if __name__ == "__main__":
+  unittest.main()
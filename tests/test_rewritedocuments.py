@@ -0,0 +1,62 @@
+from __future__ import absolute_import
+
+from cStringIO import StringIO
+import unittest
+
+from projecto.apiv1.todos.models import Todo
+from projecto.models import store
+from projecto.storage import codec
+from projecto.storage.memory import MemoryStore
+from .utils import ProjectTestCase, load_tool, new_todo
+import settings
+
+rewritedocuments = load_tool("rewritedocuments")
+
+
+@unittest.skipUnless(isinstance(store, MemoryStore), "reads the encoded values of the memory store")
+class TestRewriteDocuments(ProjectTestCase):
+  def setUp(self):
+    ProjectTestCase.setUp(self)
+    self.reset_database()
+    self.compact_encoding = settings.COMPACT_ENCODING
+
+  def tearDown(self):
+    settings.COMPACT_ENCODING = self.compact_encoding
+    self.reset_database()
+    ProjectTestCase.tearDown(self)
+
+  def stored(self):
+    bucket = Todo._riak_options["bucket"]
+    content_types = set(content_type for content_type, _, _ in store.objects[bucket].itervalues())
+    documents = dict((key, store.get(bucket, key)[0]) for key in store.objects[bucket])
+    return content_types, documents
+
+  def rewrite(self):
+    out = StringIO()
+    result = rewritedocuments.rewrite(Todo, batch_size=2, out=out)
+    self.assertTrue(out.getvalue())
+    return result
+
+  def test_round_trip(self):
+    settings.COMPACT_ENCODING = False
+    for i in xrange(5):
+      new_todo(self.user, self.project, title="todo {}".format(i), content={"markdown": u"caf\xe9 " * 300}, save=True)
+
+    content_types, documents = self.stored()
+    self.assertEquals(set([codec.JSON]), content_types)
+
+    settings.COMPACT_ENCODING = True
+    self.assertEquals((5, 0), self.rewrite())
+    content_types, compact = self.stored()
+    self.assertEquals(set([codec.MSGPACK]), content_types)
+    self.assertEquals(documents, compact)
+
+    settings.COMPACT_ENCODING = False
+    self.assertEquals((5, 0), self.rewrite())
+    content_types, rewritten = self.stored()
+    self.assertEquals(set([codec.JSON]), content_types)
+    self.assertEquals(documents, rewritten)
+
+
+if __name__ == "__main__":
+  unittest.main()
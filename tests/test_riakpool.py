@@ -0,0 +1,152 @@
+from __future__ import absolute_import
+
+import errno
+import socket
+import threading
+import unittest
+
+from projecto.riakpool import PooledRiakClient, LEAST_LATENCY
+
+NODES = [
+  {"host": "10.0.0.1", "pb_port": 8087},
+  {"host": "10.0.0.2", "pb_port": 8087},
+  {"host": "10.0.0.3", "pb_port": 8087},
+]
+
+
+class PooledRiakClientTests(unittest.TestCase):
+  def client(self, **kwargs):
+    client = PooledRiakClient(nodes=NODES, max_failures=2, eject_time=60, **kwargs)
+    # Don't start the health checker against hosts that don't exist.
+    client._checker = object()
+    return client
+
+  def test_round_robin(self):
+    client = self.client()
+    chosen = [client._choose_node().host for _ in xrange(6)]
+    self.assertEquals(["10.0.0.1", "10.0.0.2", "10.0.0.3"] * 2, chosen)
+
+  def test_ejects_failing_node(self):
+    client = self.client()
+    stats = client.node_stats(client.nodes[1])
+    client.record_failure(stats)
+    self.assertFalse(stats.ejected)
+    client.record_failure(stats)
+    self.assertTrue(stats.ejected)
+
+    chosen = set(client._choose_node().host for _ in xrange(6))
+    self.assertEquals(set(["10.0.0.1", "10.0.0.3"]), chosen)
+
+    stats.reinstate()
+    chosen = set(client._choose_node().host for _ in xrange(6))
+    self.assertEquals(3, len(chosen))
+
+  def test_all_ejected_still_chooses(self):
+    client = self.client()
+    for node in client.nodes:
+      stats = client.node_stats(node)
+      client.record_failure(stats)
+      client.record_failure(stats)
+
+    self.assertTrue(client._choose_node() in client.nodes)
+
+  def test_least_latency(self):
+    client = self.client(balancer=LEAST_LATENCY)
+    client.node_stats(client.nodes[0]).record_success(0.05)
+    client.node_stats(client.nodes[1]).record_success(0.01)
+    client.node_stats(client.nodes[2]).record_success(0.02)
+    self.assertEquals("10.0.0.2", client._choose_node().host)
+
+    # Requests in flight count against a node.
+    client.node_stats(client.nodes[1]).in_flight = 3
+    self.assertEquals("10.0.0.3", client._choose_node().host)
+
+  def test_reset_clears_stats(self):
+    client = self.client()
+    client.node_stats(client.nodes[0]).record_success(0.01)
+    client.reset()
+    self.assertEquals(0, client.node_stats(client.nodes[0]).requests)
+    self.assertEquals(3, len(client.stats()["nodes"]))
+
+  def test_checkouts_are_bounded(self):
+    client = self.client(max_size=1)
+    taken = threading.Event()
+    release = threading.Event()
+
+    def hold():
+      with client._transport():
+        taken.set()
+        release.wait()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    self.addCleanup(release.set)
+    taken.wait()
+    self.assertEquals(1, client.stats()["in_use"])
+
+    waiter = threading.Thread(target=lambda: client._transport().__enter__())
+    waiter.daemon = True
+    waiter.start()
+    waiter.join(0.1)
+    # Waits for the held connection.
+    self.assertTrue(waiter.is_alive())
+
+    release.set()
+    holder.join()
+    waiter.join(1)
+    self.assertFalse(waiter.is_alive())
+
+  def test_checkouts_are_timed(self):
+    client = self.client()
+    pool = client._choose_pool()
+    node = client._with_retries(pool, lambda transport: transport._node)
+    stats = client.node_stats(node)
+    self.assertEquals(1, stats.requests)
+    self.assertTrue(stats.latency is not None)
+    self.assertEquals(0, client.stats()["in_use"])
+
+  def test_failed_checkouts_are_counted(self):
+    client = self.client()
+    pool = client._choose_pool()
+
+    def fail(transport):
+      raise socket.error(errno.ECONNRESET, "reset")
+
+    with self.assertRaises(socket.error):
+      client._with_retries(pool, fail)
+    # Retried on every node.
+    self.assertEquals([1, 1, 1], [client.node_stats(node).failures for node in client.nodes])
+
+  def test_checkouts_skip_ejected_nodes(self):
+    client = self.client()
+    pool = client._choose_pool()
+    # A connection to every node.
+    with client._transport():
+      with client._transport():
+        with client._transport():
+          pass
+    self.assertEquals(3, len(pool.elements))
+
+    ejected = client.nodes[0]
+    stats = client.node_stats(ejected)
+    client.record_failure(stats)
+    client.record_failure(stats)
+
+    for _ in xrange(6):
+      self.assertNotEquals(ejected, client._with_retries(pool, lambda transport: transport._node))
+
+  def test_warm_counts_unreachable_nodes(self):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    client = PooledRiakClient(nodes=[{"host": "127.0.0.1", "pb_port": port}], min_size=2)
+    client._checker = object()
+    client.warm()
+    self.assertEquals(2, client.node_stats(client.nodes[0]).failures)
+    self.assertEquals(0, client.stats()["in_use"])
+
+  def test_unknown_balancer(self):
+    with self.assertRaises(ValueError):
+      PooledRiakClient(nodes=NODES, balancer="random")
@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+
+import unittest
+
+from projecto.blueprints import v_status
+from .utils import FlaskTestCase
+
+
+class TestStatus(FlaskTestCase):
+  def setUp(self):
+    FlaskTestCase.setUp(self)
+    self.token = v_status.STATUS_TOKEN
+    v_status.STATUS_TOKEN = None
+
+  def tearDown(self):
+    v_status.STATUS_TOKEN = self.token
+    FlaskTestCase.tearDown(self)
+
+  def test_local_requests(self):
+    self.assertStatus(200, self.get("/_status/cache"))
+    self.assertStatus(404, self.get("/_status/cache", environ_base={"REMOTE_ADDR": "10.0.0.1"}))
+
+  def test_proxied_requests(self):
+    self.assertStatus(404, self.get("/_status/cache", headers={"X-Forwarded-For": "127.0.0.1"}))
+
+  def test_token(self):
+    v_status.STATUS_TOKEN = "secret"
+    self.assertStatus(404, self.get("/_status/cache"))
+    self.assertStatus(404, self.get("/_status/cache", headers={"X-Status-Token": "wrong"}))
+    response = self.get("/_status/cache", headers={"X-Status-Token": "secret"}, environ_base={"REMOTE_ADDR": "10.0.0.1"})
+    self.assertStatus(200, response)
+
+
+if __name__ == "__main__":
+  unittest.main()
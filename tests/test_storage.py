@@ -0,0 +1,361 @@
+from __future__ import absolute_import
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from kvkit import NotFoundError
+
+from projecto.apiv1.feed.models import ArchivedFeedItem
+from projecto.apiv1.todos.models import Todo
+from projecto.models import (
+    BaseDocument, Project, User, load_users, prefetch, request_users, store, FAST_READ, STRICT_WRITE
+)
+from projecto.storage import codec, READ_QUORUMS, WRITE_QUORUMS
+from projecto.storage.memory import MemoryStore
+from projecto.storage.sqlite import SQLiteStore
+from .utils import FlaskTestCase, new_project, new_todo
+
+
+class StoreTests(object):
+  def test_save_get_delete(self):
+    b = self.store.bucket("things")
+    self.store.save(b, "a", {"name": "A", "n": 1}, [])
+    data, _ = self.store.get(b, "a")
+    self.assertEquals("A", data["name"])
+    self.assertEquals(1, data["n"])
+
+    self.store.delete(b, "a")
+    with self.assertRaises(NotFoundError):
+      self.store.get(b, "a")
+
+    # Not an error.
+    self.store.delete(b, "a")
+
+  def test_get_many(self):
+    b = self.store.bucket("things")
+    self.store.save(b, "a", {"n": 1}, [])
+    self.store.save(b, "b", {"n": 2}, [])
+
+    results = self.store.get_many(b, ["b", "x", "a"])
+    self.assertEquals(3, len(results))
+    self.assertEquals(2, results[0][0]["n"])
+    self.assertEquals(None, results[1])
+    self.assertEquals(1, results[2][0]["n"])
+    self.assertEquals([], self.store.get_many(b, []))
+
+  def test_buckets_are_separate(self):
+    self.store.save(self.store.bucket("one"), "a", {}, [("f", "x")])
+    with self.assertRaises(NotFoundError):
+      self.store.get(self.store.bucket("two"), "a")
+    self.assertEquals([], list(self.store.index_keys(self.store.bucket("two"), "f", "x")))
+
+  def test_index_exact_and_range(self):
+    b = self.store.bucket("things")
+    self.store.save(b, "a", {}, [("tags", "x"), ("tags", "y")])
+    self.store.save(b, "b", {}, [("tags", "y")])
+    self.store.save(b, "c", {}, [("tags", "z"), ("n", 3)])
+
+    self.assertEquals(["a"], list(self.store.index_keys(b, "tags", "x")))
+    self.assertEquals(["a", "b"], list(self.store.index_keys(b, "tags", "y")))
+    self.assertEquals(["a", "a", "b", "c"], list(self.store.index_keys(b, "tags", "x", "z")))
+    self.assertEquals(["c"], list(self.store.index_keys(b, "n", 1, 5)))
+    self.assertEquals(["a", "b", "c"], list(self.store.index_keys(b, "tags", "y", "z")))
+
+  def test_index_page(self):
+    b = self.store.bucket("things")
+    for key in "abcde":
+      self.store.save(b, key, {}, [("parent", "p")])
+    self.store.save(b, "f", {}, [("parent", "q")])
+
+    keys, continuation = self.store.index_page(b, "parent", "p", max_results=2)
+    self.assertEquals(["a", "b"], keys)
+    pages = [keys]
+    while continuation is not None:
+      keys, continuation = self.store.index_page(b, "parent", "p", max_results=2, continuation=continuation)
+      pages.append(keys)
+    self.assertEquals([["a", "b"], ["c", "d"], ["e"]], pages)
+
+    # An exactly full last page has no continuation.
+    keys, continuation = self.store.index_page(b, "parent", "p", "q", max_results=6)
+    self.assertEquals(list("abcdef"), keys)
+    self.assertEquals(None, continuation)
+
+    with self.assertRaises(ValueError):
+      self.store.index_page(b, "parent", "p", continuation="garbage")
+
+  def test_index_page_skips_deleted_keys(self):
+    b = self.store.bucket("things")
+    for key in "abcd":
+      self.store.save(b, key, {}, [("n", 1)])
+
+    keys, continuation = self.store.index_page(b, "n", 1, max_results=2)
+    for key in keys:
+      self.store.delete(b, key)
+    keys, continuation = self.store.index_page(b, "n", 1, max_results=2, continuation=continuation)
+    self.assertEquals(["c", "d"], keys)
+    self.assertEquals(None, continuation)
+
+  def test_stream_index(self):
+    b = self.store.bucket("things")
+    keys = ["k{:04}".format(i) for i in xrange(2500)]
+    for key in keys:
+      self.store.save(b, key, {}, [("parent", "pr\xc3\xa9")])
+
+    self.assertEquals(keys, list(self.store.stream_index(b, "parent", "pr\xc3\xa9")))
+
+  def test_save_replaces_index_entries(self):
+    b = self.store.bucket("things")
+    self.store.save(b, "a", {}, [("tags", "x")])
+    self.store.save(b, "a", {}, [("tags", "y")])
+    self.assertEquals([], list(self.store.index_keys(b, "tags", "x")))
+    self.assertEquals(["a"], list(self.store.index_keys(b, "tags", "y")))
+
+    self.store.delete(b, "a")
+    self.assertEquals([], list(self.store.index_keys(b, "tags", "y")))
+
+  def test_prefix_range_with_bytes(self):
+    b = self.store.bucket("things")
+    self.store.save(b, "a", {}, [("name", "p`readme")])
+    self.store.save(b, "b", {}, [("name", "p`reports")])
+    self.store.save(b, "c", {}, [("name", "q`readme")])
+    self.assertEquals(["a", "b"], list(self.store.index_keys(b, "name", "p`re", "p`re\xff")))
+
+  def test_keys_and_clear(self):
+    b = self.store.bucket("things")
+    for key in ("a", "b", "c"):
+      self.store.save(b, key, {}, [("f", key)])
+    self.assertEquals(["a", "b", "c"], sorted(self.store.keys(b)))
+
+    self.store.clear(b)
+    self.assertEquals([], list(self.store.keys(b)))
+    self.assertEquals([], list(self.store.index_keys(b, "f", "a", "z")))
+
+  def test_counters(self):
+    b = self.store.bucket("things")
+    self.assertEquals(0, self.store.counter(b, "a"))
+    self.assertEquals(1, self.store.increment(b, "a"))
+    self.assertEquals(3, self.store.increment(b, "a", 2))
+    self.assertEquals(3, self.store.counter(b, "a"))
+    self.assertEquals(0, self.store.counter(b, "b"))
+    self.assertEquals(0, self.store.counter(self.store.bucket("others"), "a"))
+
+    self.store.clear(b)
+    self.assertEquals(0, self.store.counter(b, "a"))
+
+  def test_stored_data_is_a_copy(self):
+    b = self.store.bucket("things")
+    data = {"tags": ["x"]}
+    self.store.save(b, "a", data, [])
+    data["tags"].append("y")
+
+    got, _ = self.store.get(b, "a")
+    self.assertEquals(["x"], got["tags"])
+    got["tags"].append("z")
+    self.assertEquals(["x"], self.store.get(b, "a")[0]["tags"])
+
+  @unittest.skipIf(codec.msgpack is None, "msgpack is not installed")
+  def test_content_types(self):
+    b = self.store.bucket("things")
+    data = {"title": u"caf\xe9", "content": {"html": u"<p>x</p>" * 1000}, "tags": ["a"], "n": 1}
+    self.store.save(b, "json", data, [])
+    self.store.save(b, "msgpack", data, [], content_type=codec.MSGPACK)
+
+    self.assertEquals(data, self.store.get(b, "json")[0])
+    self.assertEquals(data, self.store.get(b, "msgpack")[0])
+    self.assertEquals([data, data], [r[0] for r in self.store.get_many(b, ["json", "msgpack"])])
+
+
+class CodecTests(unittest.TestCase):
+  def test_json(self):
+    self.assertEquals({"a": [1]}, codec.decode(codec.encode({"a": [1]})))
+    with self.assertRaises(ValueError):
+      codec.encode({}, "text/plain")
+
+  @unittest.skipIf(codec.msgpack is None, "msgpack is not installed")
+  def test_msgpack_compresses_large_strings(self):
+    data = {"small": u"x", "large": [u"\xe9" * codec.COMPRESS_MIN_SIZE]}
+    encoded = codec.encode(data, codec.MSGPACK)
+    self.assertTrue(len(encoded) < codec.COMPRESS_MIN_SIZE)
+
+    decoded = codec.decode(encoded, codec.MSGPACK)
+    self.assertEquals(data, decoded)
+    self.assertTrue(isinstance(decoded["small"], unicode))
+    self.assertTrue(isinstance(decoded["large"][0], unicode))
+
+
+class MemoryStoreTests(StoreTests, unittest.TestCase):
+  def setUp(self):
+    self.store = MemoryStore()
+
+
+class SQLiteStoreTests(StoreTests, unittest.TestCase):
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+    self.store = SQLiteStore(os.path.join(self.tmpdir, "test.sqlite3"))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_reads_databases_without_content_types(self):
+    path = os.path.join(self.tmpdir, "old.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE objects (bucket TEXT NOT NULL, key TEXT NOT NULL, data TEXT NOT NULL, PRIMARY KEY (bucket, key))")
+    conn.execute("INSERT INTO objects VALUES ('things', 'a', '{\"n\": 1}')")
+    conn.commit()
+    conn.close()
+
+    store = SQLiteStore(path)
+    self.assertEquals({"n": 1}, store.get("things", "a")[0])
+    store.save("things", "b", {"n": 2}, [])
+    self.assertEquals({"n": 2}, store.get("things", "b")[0])
+
+
+class DocumentIndexTests(FlaskTestCase):
+  def test_index_pages(self):
+    project = new_project(self.user, save=True)
+    keys = sorted(new_todo(self.user, project, title=str(i), save=True).key for i in xrange(5))
+
+    self.assertEquals(keys, list(Todo.iterindex_keys("parent", project.key, page_size=2)))
+    self.assertEquals(keys, sorted(todo.key for todo in Todo.index("parent", project.key, batch_size=2)))
+
+
+class TestBulkDocuments(FlaskTestCase):
+  def test_get_many(self):
+    user2 = self.create_user("test2@test.com")
+    users, missing = User.get_many([user2.key, "nope", self.user.key, user2.key])
+
+    self.assertEquals(4, len(users))
+    self.assertEquals(user2.key, users[0].key)
+    self.assertEquals("test2@test.com", users[0].emails[0])
+    self.assertEquals(None, users[1])
+    self.assertEquals(self.user.key, users[2].key)
+    self.assertEquals(user2.key, users[3].key)
+    self.assertEquals(["nope"], missing)
+
+  def test_get_many_empty(self):
+    self.assertEquals(([], []), User.get_many([]))
+
+  def test_prefetch(self):
+    project = new_project(self.user, save=True)
+    user2 = self.create_user("test2@test.com")
+    for u in (self.user, user2, self.user):
+      new_todo(u, project, title="t", save=True)
+
+    todos = list(Todo.index("parent", project.key))
+    prefetch(todos, "author", User)
+    self.assertEquals(sorted([self.user.key, self.user.key, user2.key]), sorted(t.author.key for t in todos))
+
+  def test_request_users(self):
+    self.assertEquals({}, request_users())
+    with self.app.test_request_context():
+      users = request_users()
+      load_users(users, [self.user.key])
+      self.assertTrue(request_users() is users)
+      self.assertEquals(self.user.key, request_users()[self.user.key].key)
+
+  def test_save_many(self):
+    projects = [new_project(self.user, name="p" + str(i)) for i in xrange(5)]
+    errors = BaseDocument.save_many(projects)
+    self.assertEquals([None] * 5, errors)
+
+    loaded, missing = Project.get_many([p.key for p in projects])
+    self.assertEquals([], missing)
+    self.assertEquals(["p0", "p1", "p2", "p3", "p4"], [p.name for p in loaded])
+
+  def test_save_many_reports_errors(self):
+    class Broken(Project):
+      def save(self, *args, **kwargs):
+        raise IOError("nope")
+
+    good = new_project(self.user, name="good")
+    errors = BaseDocument.save_many([good, Broken(data={"name": "broken"})])
+    self.assertEquals(None, errors[0])
+    self.assertTrue(isinstance(errors[1], IOError))
+    Project.get(good.key)
+
+  def test_delete_many(self):
+    projects = [new_project(self.user, save=True) for i in xrange(3)]
+    errors = Project.delete_many([projects[0], projects[1].key])
+    self.assertEquals([None, None], errors)
+
+    for p in projects[:2]:
+      with self.assertRaises(NotFoundError):
+        Project.get(p.key)
+    Project.get(projects[2].key)
+
+
+class TestQuorums(FlaskTestCase):
+  def test_class_defaults_and_overrides(self):
+    self.assertEquals({}, Project._quorum(READ_QUORUMS, {}))
+    self.assertEquals(STRICT_WRITE, Project._quorum(WRITE_QUORUMS, STRICT_WRITE))
+
+    self.assertEquals(FAST_READ, ArchivedFeedItem._quorum(READ_QUORUMS, {}))
+    self.assertEquals({"r": "quorum", "notfound_ok": False}, ArchivedFeedItem._quorum(READ_QUORUMS, {"r": "quorum"}))
+    # Read quorums are not for writes.
+    self.assertEquals({}, ArchivedFeedItem._quorum(WRITE_QUORUMS, {}))
+
+  def test_unknown_options_are_rejected(self):
+    project = new_project(self.user, save=True)
+    with self.assertRaises(TypeError):
+      project.save(r=1)
+    with self.assertRaises(TypeError):
+      Project.get(project.key, w=1)
+
+  def test_calls_with_quorums(self):
+    project = new_project(self.user, name="strict")
+    project.save(**STRICT_WRITE)
+    self.assertEquals("strict", Project.get(project.key, **FAST_READ).name)
+    docs, _ = Project.get_many([project.key], r=1)
+    self.assertEquals(project.key, docs[0].key)
+
+
+class TestProjections(FlaskTestCase):
+  def test_projection_matches_serialize(self):
+    project = new_project(self.user, name="p", desc="d", save=True)
+    items, missing = Project.get_many_projected([project.key, "nope"], ("name", "desc"))
+    self.assertEquals(["nope"], missing)
+    self.assertEquals(None, items[1])
+    self.assertEquals(project.key, items[0].key)
+    self.assertEquals("p", items[0].name)
+    self.assertEquals({"key": project.key, "name": "p", "desc": "d"}, items[0].serialize(include_key=True))
+
+  def test_projections_are_read_only(self):
+    new_project(self.user, name="p", save=True)
+    item = list(Project.index_projected("owners", self.user.key, fields=("name", )))[0]
+    with self.assertRaises(AttributeError):
+      item.name = "q"
+    with self.assertRaises(AttributeError):
+      item.desc
+
+  def test_unknown_fields(self):
+    with self.assertRaises(ValueError):
+      Project.projection(("nope", ))
+    with self.assertRaises(ValueError):
+      Project.projection(("serialize", ))
+
+  def test_missing_fields_get_defaults(self):
+    store.save(User._riak_options["bucket"], "old", {"emails": ["old@test.com"]}, [])
+    items, _ = User.get_many_projected(["old"], ("name", ))
+    self.assertEquals(User(data={}).name, items[0].name)
+
+  def test_todo_lists(self):
+    project = new_project(self.user, save=True)
+    todo = new_todo(self.user, project, title="t", tags=["a"], save=True)
+
+    items = list(Todo.index_projected("parent", project.key, fields=Todo.list_fields()))
+    self.assertEquals([todo.key], [item.key for item in items])
+    self.assertEquals([Todo.get(todo.key).serialize_for_client(include_comments="keys")],
+                      Todo.serialize_projections_for_client(items))
+
+  def test_serializer_matches_kvkit(self):
+    project = new_project(self.user, name="p", save=True)
+    todo = Todo.get(new_todo(self.user, project, title="t", tags=["a"], save=True).key)
+
+    for doc, restricted in ((todo, ("parent", "author")), (todo, ()), (self.user, ("emails", "dav_token"))):
+      self.assertEquals(doc.serialize(restricted=restricted, include_key=True), doc.serializer(restricted, include_key=True)(doc))
+      self.assertEquals(doc.serialize(restricted=restricted), doc.serializer(restricted)(doc))
+
+    self.assertTrue(Todo.serializer(("parent", )) is Todo.serializer(("parent", )))
@@ -216,6 +216,27 @@ class TestTodoAPI(ProjectTestCase):
 
     self.assertEquals(keys, k)
 
+  def test_index_todos_with_fields(self):
+    self.login()
+    todos = [new_todo(self.user, self.project, date=datetime.now() + timedelta(seconds=i), title=str(i), save=True) for i in xrange(3)]
+
+    response, data = self.getJSON(self.base_url("/?fields=title,done"))
+    self.assertStatus(200, response)
+    self.assertEquals([todo.key for todo in reversed(todos)], [t["key"] for t in data["todos"]])
+    for t in data["todos"]:
+      self.assertEquals({"key", "title", "done"}, set(t))
+
+    response, data = self.getJSON(self.base_url("/?fields=author,children"))
+    self.assertEquals({"key", "author", "children"}, set(data["todos"][0]))
+    self.assertEquals(self.user.key, data["todos"][0]["author"]["key"])
+
+    response, data = self.getJSON(self.base_url("/filter?tags=%20&fields=title"))
+    self.assertEquals(3, data["totalTodos"])
+    self.assertEquals({"key", "title"}, set(data["todos"][0]))
+
+    response, _ = self.getJSON(self.base_url("/?fields=title,parent"))
+    self.assertStatus(400, response)
+
   def test_index_todos_reject_permission(self):
     response, data = self.getJSON(self.base_url("/"))
     self.assertStatus(403, response)
@@ -432,6 +453,25 @@ class TestTodoAPI(ProjectTestCase):
     self.assertStatus(200, response)
     self.assertEquals(True, data["done"])
 
+  def test_clear_done(self):
+    todo1 = new_todo(self.user, self.project, done=True, save=True)
+    todo2 = new_todo(self.user, self.project, save=True)
+    todo3 = new_todo(self.user, self.project, done=True, save=True)
+    self.login()
+
+    response, data = self.deleteJSON(self.base_url("/done"))
+    self.assertStatus(200, response)
+    self.assertEquals("okay", data["status"])
+
+    for todo in (todo1, todo3):
+      with self.assertRaises(NotFoundError):
+        Todo.get(todo.key)
+      self.assertTrue(ArchivedTodo.get(todo.key).done)
+
+    Todo.get(todo2.key)
+    with self.assertRaises(NotFoundError):
+      ArchivedTodo.get(todo2.key)
+
 
 if __name__ == "__main__":
   unittest.main()
@@ -0,0 +1,32 @@
+from __future__ import absolute_import
+
+import json
+import unittest
+
+from projecto import utils
+from projecto.utils import stream_jsonify
+from .utils import FlaskTestCase
+
+
+class TestStreamJsonify(FlaskTestCase):
+  def stream(self, **params):
+    with self.app.test_request_context():
+      response = stream_jsonify(**params)
+      self.assertEquals("application/json", response.mimetype)
+      return list(response.response)
+
+  def test_encodes_iterators_as_lists(self):
+    chunks = self.stream(path="/", children=({"n": i} for i in xrange(3)), empty=iter([]), tags=["a"])
+    self.assertEquals({"path": "/", "children": [{"n": 0}, {"n": 1}, {"n": 2}], "empty": [], "tags": ["a"]},
+                      json.loads("".join(chunks)))
+
+  def test_chunks(self):
+    items = ("x" * 100 for _ in xrange(1000))
+    chunks = self.stream(items=items)
+    self.assertTrue(len(chunks) > 1)
+    self.assertTrue(all(len(chunk) < utils.STREAM_CHUNK_SIZE + 200 for chunk in chunks))
+    self.assertEquals(1000, len(json.loads("".join(chunks))["items"]))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,187 @@
+from __future__ import absolute_import
+
+from base64 import b64encode
+import os
+import unittest
+
+from kvkit import NotFoundError
+
+from projecto.apiv1.files.models import File
+from .utils import ProjectTestCase, new_file, new_directory, new_project
+
+
+class TestWebDAV(ProjectTestCase):
+  def tearDown(self):
+    self.reset_database()
+    ProjectTestCase.tearDown(self)
+
+  def url(self, path=""):
+    return "/dav/{}/{}".format(self.project.key, path)
+
+  def dav(self, method, path="", **kwargs):
+    return self.client.open(self.url(path), method=method, **kwargs)
+
+  def test_reject_anonymous(self):
+    response = self.dav("PROPFIND", headers={"Depth": "1"})
+    self.assertStatus(401, response)
+    self.assertTrue("WWW-Authenticate" in response.headers)
+
+  def test_basic_auth_with_token(self):
+    token = self.user.new_dav_token()
+    self.user.save()
+
+    auth = {"Authorization": "Basic " + b64encode("test@test.com:" + token), "Depth": "0"}
+    response = self.dav("PROPFIND", headers=auth)
+    self.assertStatus(207, response)
+
+    auth["Authorization"] = "Basic " + b64encode("test@test.com:wrong")
+    response = self.dav("PROPFIND", headers=auth)
+    self.assertStatus(401, response)
+
+  def test_reject_permission(self):
+    user2 = self.create_user("test2@test.com")
+    self.login(user2)
+    response = self.dav("PROPFIND", headers={"Depth": "1"})
+    self.assertStatus(403, response)
+
+  def test_propfind(self):
+    new_directory(self.user, self.project, path="/dir/", save=True)
+    new_file(self.user, self.project, path="/dir/file1.txt", save=True)
+    new_file(self.user, self.project, path="/file2.txt", save=True)
+    self.login()
+
+    response = self.dav("PROPFIND", headers={"Depth": "0"})
+    self.assertStatus(207, response)
+    self.assertEquals(1, response.data.count("<D:response>"))
+
+    response = self.dav("PROPFIND", headers={"Depth": "1"})
+    self.assertStatus(207, response)
+    self.assertEquals(3, response.data.count("<D:response>"))
+    self.assertTrue(self.url("dir/") in response.data)
+    self.assertTrue(self.url("file2.txt") in response.data)
+    self.assertTrue("<D:getcontentlength>11</D:getcontentlength>" in response.data)
+
+    response = self.dav("PROPFIND", headers={"Depth": "infinity"})
+    self.assertStatus(207, response)
+    self.assertEquals(4, response.data.count("<D:response>"))
+    self.assertTrue(self.url("dir/file1.txt") in response.data)
+
+    response = self.dav("PROPFIND", "nothere.txt", headers={"Depth": "0"})
+    self.assertStatus(404, response)
+
+  def test_get_range(self):
+    new_file(self.user, self.project, path="/file.txt", save=True)
+    self.login()
+
+    response = self.dav("GET", "file.txt")
+    self.assertStatus(200, response)
+    self.assertEquals("hello world", response.data)
+
+    response = self.dav("GET", "file.txt", headers={"Range": "bytes=6-"})
+    self.assertStatus(206, response)
+    self.assertEquals("world", response.data)
+    self.assertEquals("bytes 6-10/11", response.headers["Content-Range"])
+
+    response = self.dav("GET", "file.txt", headers={"Range": "bytes=-5"})
+    self.assertStatus(206, response)
+    self.assertEquals("world", response.data)
+
+    response = self.dav("GET", "file.txt", headers={"Range": "bytes=20-"})
+    self.assertStatus(416, response)
+
+  def test_put(self):
+    self.login()
+    response = self.dav("PUT", "new.txt", data="some content")
+    self.assertStatus(201, response)
+
+    f = File.get_by_project_path(self.project, "/new.txt")
+    self.assertEquals("some content", f.content)
+    self.assertEquals(self.user.key, f.author.key)
+
+    response = self.dav("PUT", "new.txt", data="other content")
+    self.assertStatus(204, response)
+    f = File.get_by_project_path(self.project, "/new.txt")
+    self.assertEquals("other content", f.content)
+    self.assertEquals("some content", f.version_content(1))
+
+    response = self.dav("PUT", "not/here.txt", data="some content")
+    self.assertStatus(409, response)
+
+  def test_names_are_kept(self):
+    self.login()
+    for name in ("my file.txt", ".DS_Store"):
+      response = self.dav("PUT", name, data="some content")
+      self.assertStatus(201, response)
+      self.assertEquals("some content", File.get_by_project_path(self.project, "/" + name).content)
+
+    response = self.dav("PROPFIND", headers={"Depth": "1"})
+    self.assertTrue(self.url("my%20file.txt") in response.data)
+
+    for path in ("a//b.txt", "a/./b.txt"):
+      self.assertStatus(400, self.dav("PUT", path, data="some content"))
+
+  def test_backticks_stay_in_the_project(self):
+    other = new_project(self.user, save=True)
+    other_file = new_file(self.user, other, path="/secret.txt", save=True)
+    self.login()
+
+    response = self.dav("PUT", "a`X../{}/secret.txt".format(other.key), data="overwritten")
+    self.assertStatus(409, response)
+    response = self.dav("DELETE", "a`X../{}/secret.txt".format(other.key))
+    self.assertStatus(404, response)
+    self.assertEquals("hello world", other_file.content)
+
+    self.assertStatus(201, self.dav("PUT", "don`t.txt", data="some content"))
+    self.assertEquals("some content", self.dav("GET", "don`t.txt").data)
+
+  def test_mkcol_and_delete(self):
+    self.login()
+    response = self.dav("MKCOL", "dir")
+    self.assertStatus(201, response)
+    d = File.get_by_project_path(self.project, "/dir/")
+    self.assertTrue(os.path.isdir(d.fspath))
+
+    response = self.dav("MKCOL", "dir")
+    self.assertStatus(405, response)
+
+    response = self.dav("DELETE", "dir")
+    self.assertStatus(204, response)
+    self.assertFalse(os.path.exists(d.fspath))
+
+    with self.assertRaises(NotFoundError):
+      d.reload()
+
+  def test_move(self):
+    new_directory(self.user, self.project, path="/dir/", save=True)
+    f = new_file(self.user, self.project, path="/file.txt", save=True)
+    self.login()
+
+    response = self.dav("MOVE", "file.txt", headers={"Destination": "http://localhost" + self.url("dir/moved.txt")})
+    self.assertStatus(201, response)
+    self.assertFalse(os.path.exists(f.fspath))
+
+    g = File.get_by_project_path(self.project, "/dir/moved.txt")
+    self.assertEquals("hello world", g.content)
+
+    new_file(self.user, self.project, path="/file.txt", save=True)
+    response = self.dav("MOVE", "file.txt", headers={"Destination": self.url("dir/moved.txt"), "Overwrite": "F"})
+    self.assertStatus(412, response)
+
+  def test_copy(self):
+    new_directory(self.user, self.project, path="/dir/", save=True)
+    new_file(self.user, self.project, path="/dir/file.txt", save=True)
+    self.login()
+
+    response = self.dav("COPY", "dir/", headers={"Destination": self.url("copied/")})
+    self.assertStatus(201, response)
+
+    original = File.get_by_project_path(self.project, "/dir/file.txt")
+    copied = File.get_by_project_path(self.project, "/copied/file.txt")
+    self.assertEquals(original.content, copied.content)
+    self.assertNotEquals(original.fspath, copied.fspath)
+
+    response = self.dav("COPY", "dir/", headers={"Destination": self.url("dir/inside/")})
+    self.assertStatus(403, response)
+
+if __name__ == "__main__":
+  unittest.main()
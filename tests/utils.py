@@ -1,4 +1,5 @@
 from cStringIO import StringIO
+import imp
 import json
 import shutil
 from unittest import TestCase
@@ -8,11 +9,11 @@ from flask import request
 from flask.ext.login import login_user, logout_user
 from werkzeug.datastructures import FileStorage
 from kvkit import Document
-import riak
 
 from projecto import app
 from projecto.extensions import csrf
 from projecto.models import (
+    store,
     User,
     Project,
     Comment,
@@ -140,11 +141,8 @@ class FlaskTestCase(TestCase):
 
     Must be called before ANY actions are taken in a test case."""
 
-    c = riak.RiakClient(protocol="pbc")
-    for bucket in settings.DATABASES.itervalues():
-      b = c.bucket(bucket)
-      for key in b.get_keys():
-        b.delete(key)
+    for name in settings.DATABASES.itervalues():
+      store.clear(store.bucket(name))
 
     files_folder = os.path.join(settings.APP_FOLDER, "test_userfiles")
     if os.path.exists(files_folder):
@@ -156,6 +154,11 @@ class FlaskTestCase(TestCase):
     self.user = self.create_user("test@test.com")
 
 
+def load_tool(name):
+  """Imports scripts/tools/<name>.py. The tools are not a package."""
+  return imp.load_source("tools_" + name, os.path.join(settings.APP_FOLDER, "scripts", "tools", name + ".py"))
+
+
 class ProjectTestCase(FlaskTestCase):
   def reset_database(self):
     FlaskTestCase.reset_database(self)